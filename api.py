@@ -1,10 +1,24 @@
 import asyncio
+import inspect
+import json
 import logging
+import math
+import os
+import time
+import urllib.parse
 
 import socketio
 from aiohttp import web
 
-from logic import Logic
+import downsample
+import hardware
+import metrics
+import wire
+from logic import MAX_TEMPERATURE_RISE, Logic
+from storage import FIELDS, MAX_POINTS, ROLLUP_LEVELS
+
+# Upper limit for max_points in a range request.
+MAX_RANGE_POINTS = 10000
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,54 +28,244 @@ sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*')
 app = web.Application()
 sio.attach(app)
 
-# Initialize the Logic class
-logic = Logic(sio)
+# Initialize the Logic class, on simulated hardware with OVEN_HARDWARE=sim. Started by supervisor.py
+# this is an API worker and acquisition and control run in the control process instead. With
+# OVEN_CONFIG, the ovens listed in that file run side by side and clients pick one with ?oven=<id>.
+simulators = []
+manager = None
+logic = None
+sim_speed = float(os.environ.get('OVEN_SIM_SPEED', 1.0)) if os.environ.get('OVEN_HARDWARE') == 'sim' else None
+# Simulated time runs faster, and temperatures rise faster with it.
+max_temperature_rise = MAX_TEMPERATURE_RISE * (sim_speed or 1.0)
+# How many samples a crash can lose, see Logic.
+storage_options = {'store_batch_size': int(os.environ.get('OVEN_STORE_BATCH_SIZE', 30)),
+                   'store_flush_interval': float(os.environ.get('OVEN_STORE_FLUSH_INTERVAL', 30.0)),
+                   'store_max_pending': int(os.environ.get('OVEN_STORE_MAX_PENDING', 3600))}
+if os.environ.get('OVEN_SHARED_RING') and os.environ.get('OVEN_CONFIG'):
+    # The control process runs a single oven, so the others would quietly not be controlled.
+    raise SystemExit("OVEN_CONFIG is not supported with a separate control process, run api.py alone for several ovens")
+if os.environ.get('OVEN_SHARED_RING'):
+    from workerlogic import WorkerLogic
+    logic = WorkerLogic(sio, os.environ['OVEN_SHARED_RING'], os.environ['OVEN_CONTROL_ADDRESS'],
+                        bytes.fromhex(os.environ['OVEN_CONTROL_AUTHKEY']), os.environ.get('OVEN_DB', 'data2.db'))
+elif os.environ.get('OVEN_CONFIG'):
+    from ovens import OvenManager, load_oven_configs
+    simulate = None
+    if sim_speed is not None:
+        from hardware.sim import Simulator
+
+        def simulate(i):
+            # One simulated oven per configured one, each on its own bus of a shared 1-Wire tree.
+            simulators.append(Simulator(speed=sim_speed, bus=i + 1,
+                                        root=simulators[0].w1.root if simulators else None).start())
+            sensor_set = simulators[-1].sensor_set()
+            return {'am2315_bus': sensor_set.am2315_bus, 'am2315_address': sensor_set.am2315_address,
+                    'probe_ids': list(sensor_set.probe_ids)}
+    configs = load_oven_configs(os.environ['OVEN_CONFIG'], simulate)
+    pcfs = {config.id: simulator.pcf for config, simulator in zip(configs, simulators)}
+    manager = OvenManager(sio, configs, db_path=os.environ.get('OVEN_DB', 'data2.db'), pcfs=pcfs,
+                          max_temperature_rise=max_temperature_rise, **storage_options)
+else:
+    # ROM IDs of ow1..ow5, comma-separated; simulated hardware brings its own.
+    hardware.ds18b20.probe_ids = hardware.ds18b20.parse_probe_ids(os.environ.get('OVEN_PROBE_IDS'))
+    if sim_speed is not None:
+        from hardware.sim import Simulator
+        simulators.append(Simulator(speed=sim_speed).start())
+    logic = Logic(sio, db_path=os.environ.get('OVEN_DB', 'data2.db'), pcf=simulators[0].pcf if simulators else None,
+                  max_temperature_rise=max_temperature_rise, **storage_options)
+
+def oven(sid):
+    """
+    Returns the Logic of a client's oven.
+    """
+    return manager.logic(sid) if manager else logic
 
 # Define event handlers for Socket.IO events
 @sio.event
 async def connect(sid, environ):
     logging.info(f"Client connected {sid}")
+    if manager is None:
+        await logic.live.connect(sid)
+        return
+    query = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+    try:
+        await manager.connect(sid, int(query['oven'][0]) if 'oven' in query else None)
+    except (KeyError, ValueError):
+        raise socketio.exceptions.ConnectionRefusedError(f"Unknown oven {query.get('oven')}")
 
 @sio.event
 async def disconnect(sid):
     logging.info(f"Client disconnected {sid}")
+    if manager is None:
+        await logic.live.disconnect(sid)
+    else:
+        await manager.disconnect(sid)
+
+@sio.event
+async def subscribe_sensor_state(sid, data):
+    """
+    Switches a client from the full 'sensor_state' broadcast to 'sensor_snapshot' and 'sensor_delta'
+    events for {"max_rate": updates per second, "deadband": {field: minimum change}}.
+    """
+    try:
+        await oven(sid).live.subscribe(sid, data)
+    except (TypeError, ValueError) as e:
+        await sio.emit('response-error', {'message': f"Invalid subscription: {e}"}, to=sid)
+
+@sio.event
+async def unsubscribe_sensor_state(sid, data):
+    await oven(sid).live.unsubscribe(sid)
+
+def history_format(data):
+    """
+    Returns the payload format a client asked for with {"format": "columnar" | "binary"}, legacy by default.
+    """
+    if isinstance(data, dict):
+        return data.get('format', wire.LEGACY)
+    return wire.LEGACY
+
+def history_mode(data):
+    """
+    Returns the downsampling mode a client asked for with {"mode": "avg" | "minmax" | "lttb"}, avg by default.
+    """
+    if isinstance(data, dict) and data.get('mode') in downsample.MODES:
+        return data['mode']
+    return downsample.AVG
 
 @sio.event
 async def get_sensors_24h(sid, data):
-    sensor_data = logic.get_sensor_data_for_period(1)  # Last 24 hours
+    sensor_data = wire.encode(await oven(sid).get_sensor_series(1, history_mode(data)), history_format(data))  # Last 24 hours
     await sio.emit('sensor_data_24h', sensor_data, to=sid)
 
 @sio.event
 async def get_sensors_7d(sid, data):
-    sensor_data = logic.get_sensor_data_for_period(7)  # Last 7 days
+    sensor_data = wire.encode(await oven(sid).get_sensor_series(7, history_mode(data)), history_format(data))  # Last 7 days
     await sio.emit('sensor_data_7d', sensor_data, to=sid)
 
+@sio.event
+async def get_sensors_range(sid, data):
+    """
+    Sends sensor data for {"from": epoch, "to": epoch, "max_points": n, "resolution": "raw", "mode": ..., "format": ...}.
+    "to" defaults to now and "from" to one day before "to". Raw data comes in pages: pass the returned
+    "next" as "from" to get the next page.
+    """
+    try:
+        end = float(data.get('to') or time.time())
+        start = float(data.get('from') or end - 86400)
+        max_points = int(data.get('max_points', MAX_POINTS))
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise ValueError("from and to must be finite")
+        if start >= end or not 0 < max_points <= MAX_RANGE_POINTS:
+            raise ValueError(f"expected from < to and 0 < max_points <= {MAX_RANGE_POINTS}")
+    except (AttributeError, TypeError, ValueError) as e:
+        await sio.emit('response-error', {'message': f"Invalid range request: {e}"}, to=sid)
+        return
+    series, resolution, cursor = await oven(sid).get_sensor_range(
+        start, end, max_points, data.get('resolution') == 'raw', history_mode(data))
+    await sio.emit('sensor_data_range', {
+        'from': start,
+        'to': end,
+        'resolution': resolution,
+        'next': cursor,
+        'data': wire.encode(series, history_format(data)),
+    }, to=sid)
+
 @sio.event
 async def start_task(sid, data):
     try:
-        logic.start(data)
+        # A WorkerLogic sends the task to the control process, a Logic starts it right away.
+        result = oven(sid).start(data)
+        if inspect.isawaitable(result):
+            await result
         await sio.emit('response', {'message': 'Task started successfully'}, to=sid)
         await get_task_status(sid, "")
-    except ValueError as e:
+    except (ValueError, ConnectionError) as e:
         await sio.emit('response-error', {'message': str(e)}, to=sid)
 
 @sio.event
 async def stop_task(sid, data):
-    logic.stop()
-    await sio.emit('response', {'message': 'Task stopped successfully'}, to=sid)
+    try:
+        result = oven(sid).stop()
+        if inspect.isawaitable(result):
+            await result
+        await sio.emit('response', {'message': 'Task stopped successfully'}, to=sid)
+    except ConnectionError as e:
+        await sio.emit('response-error', {'message': str(e)}, to=sid)
 
 @sio.event
 async def get_task_status(sid, data):
-    task = logic.get_current_task()
+    task = oven(sid).get_current_task()
     await sio.emit('task_status', task, to=sid)
 
+async def export(request):
+    """
+    Streams sensor data as NDJSON (default) or CSV.
+
+    Query parameters: from and to in epoch seconds (default: the last day), format=ndjson|csv,
+    resolution=raw (default) or one of the rollup levels in seconds, and with several ovens the
+    oven id (default: the first oven).
+    """
+    try:
+        if manager is None:
+            storage = logic.storage
+        else:
+            storage = manager.ovens[int(request.query.get('oven', manager.configs[0].id))].storage
+        end = float(request.query.get('to') or time.time())
+        start = float(request.query.get('from') or end - 86400)
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise ValueError("from and to must be finite")
+        resolution = request.query.get('resolution', 'raw')
+        level = None if resolution == 'raw' else int(resolution)
+        if level is not None and level not in ROLLUP_LEVELS:
+            raise ValueError(f"resolution must be raw or one of {ROLLUP_LEVELS}")
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    except KeyError:
+        raise web.HTTPNotFound(text=f"Unknown oven {request.query.get('oven')}")
+    csv_format = request.query.get('format') == 'csv'
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/csv' if csv_format else 'application/x-ndjson',
+    })
+    await response.prepare(request)
+    columns = ('timestamp',) + FIELDS + ('count',)
+    if csv_format:
+        await response.write((','.join(columns) + '\n').encode())
+    async for rows in storage.iter_range(start, end, level):
+        if csv_format:
+            lines = [','.join('' if v is None else str(v) for v in row) for row in rows]
+        else:
+            lines = [json.dumps(dict(zip(columns, row))) for row in rows]
+        await response.write(('\n'.join(lines) + '\n').encode())
+    await response.write_eof()
+    return response
+
+app.router.add_get('/export', export)
+
+async def metrics_endpoint(request):
+    """
+    Serves stage, sensor, I2C and database timings, event loop lag, queue depths and relay switch
+    counts in the Prometheus text format.
+    """
+    return web.Response(body=metrics.REGISTRY.render().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+app.router.add_get('/metrics', metrics_endpoint)
+
 # Define background tasks
 async def start_background_tasks(app):
-    app['logic_task'] = asyncio.create_task(logic.logic_loop())
+    app['logic_task'] = asyncio.create_task((manager or logic).logic_loop())
 
 async def cleanup_background_tasks(app):
     app['logic_task'].cancel()
-    await app['logic_task']
+    try:
+        await app['logic_task']
+    except asyncio.CancelledError:
+        pass
+    (manager or logic).close()
+    # The first simulator owns the shared 1-Wire tree, so it goes last.
+    for simulator in reversed(simulators):
+        simulator.stop()
 
 # Set up background tasks
 app.on_startup.append(start_background_tasks)
@@ -69,4 +273,5 @@ app.on_cleanup.append(cleanup_background_tasks)
 
 # Run the web application
 if __name__ == '__main__':
-    web.run_app(app, port=8080)
+    # Several API workers share the port, the kernel spreads connections across them.
+    web.run_app(app, port=int(os.environ.get('OVEN_PORT', 8080)), reuse_port=bool(os.environ.get('OVEN_SHARED_RING')))
@@ -0,0 +1,120 @@
+import datetime
+import os
+
+import numpy as np
+
+# Values are stored as integers in thousandths, the resolution of the DS18B20 driver.
+SCALE = 1000
+
+FORMAT_VERSION = 1
+
+
+def day_of(timestamp_ms):
+    """
+    Returns the UTC date of an epoch millisecond timestamp.
+    """
+    return datetime.datetime.fromtimestamp(timestamp_ms // 1000, datetime.timezone.utc).date()
+
+
+def day_start(day):
+    """
+    Returns the start of a UTC date in epoch milliseconds.
+    """
+    return int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp()) * 1000
+
+
+class SensorArchive:
+    """
+    Raw samples of whole days moved out of the database, one compressed file per UTC day.
+
+    Files are columnar: timestamps are stored as the first timestamp plus int32 deltas, and every field
+    as int32 deltas of its value in thousandths plus a bit mask of missing readings, all in a
+    deflate-compressed .npz. At 1 Hz the deltas are small and repetitive, so a day takes a small
+    fraction of its size in SQLite. Files are written atomically and never changed afterwards.
+    """
+
+    def __init__(self, directory, fields):
+        """
+        Args:
+            directory (str): The directory the day files are kept in, created on the first write.
+            fields (Tuple[str]): The sensor fields in row order.
+        """
+        self.directory = directory
+        self.fields = tuple(fields)
+
+    def path(self, day):
+        return os.path.join(self.directory, f'{day.isoformat()}.npz')
+
+    def has(self, day):
+        return os.path.exists(self.path(day))
+
+    def days(self):
+        """
+        Returns:
+            List[datetime.date]: The archived days, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(datetime.date.fromisoformat(name[:-4])
+                      for name in os.listdir(self.directory) if name.endswith('.npz'))
+
+    def write_day(self, day, rows):
+        """
+        Archives the raw samples of one day.
+
+        Args:
+            day (datetime.date): The UTC day.
+            rows (List[tuple]): Rows of (timestamp_ms, *fields), oldest first.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        timestamps = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(self.fields))
+        missing = np.isnan(values)
+        quantized = np.round(np.where(missing, 0.0, values) * SCALE).astype(np.int64)
+        arrays = {
+            'version': np.array(FORMAT_VERSION),
+            'first': timestamps[:1],
+            'timestamp': np.diff(timestamps).astype(np.int32),
+        }
+        for i, field in enumerate(self.fields):
+            arrays[field] = np.diff(quantized[:, i], prepend=0).astype(np.int32)
+            arrays[f'{field}_missing'] = np.packbits(missing[:, i])
+        path = self.path(day)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    def read_day(self, day):
+        """
+        Reads the samples of one archived day.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Epoch millisecond timestamps, and one column of values per
+            field with NaN for missing readings.
+        """
+        with np.load(self.path(day)) as data:
+            timestamps = np.concatenate((data['first'], data['first'][0] + np.cumsum(data['timestamp'], dtype=np.int64)))
+            values = np.empty((len(timestamps), len(self.fields)))
+            for i, field in enumerate(self.fields):
+                values[:, i] = np.cumsum(data[field], dtype=np.int64) / SCALE
+                missing = np.unpackbits(data[f'{field}_missing'], count=len(timestamps)).astype(bool)
+                values[missing, i] = np.nan
+        return timestamps, values
+
+    def read_range(self, start_ms, end_ms):
+        """
+        Reads the archived samples from `start_ms` up to `end_ms`.
+
+        Returns:
+            List[tuple]: Rows of (timestamp in epoch seconds, *fields, 1) like query_range_chunk,
+            with None for missing readings.
+        """
+        rows = []
+        for day in self.days():
+            if day_start(day) + 86400000 <= start_ms or day_start(day) >= end_ms:
+                continue
+            timestamps, values = self.read_day(day)
+            selected = (timestamps >= start_ms) & (timestamps < end_ms)
+            for timestamp, row in zip(timestamps[selected].tolist(), values[selected].tolist()):
+                rows.append((timestamp / 1000.0, *(None if v != v else v for v in row), 1))
+        return rows
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import hardware
+from hardware.sim import SimulatedPCF8574, Simulator, ThermalModel
+from logic import Logic
+from storage import FIELDS, SensorStorage
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Synthetic database sizes in days of 1 Hz samples.
+DATABASE_DAYS = {'1d': 1, '30d': 30, '1y': 365}
+
+# History periods requested from every database, in days.
+PERIODS = (1, 7, 30, 365)
+
+
+class NullSocketIO:
+    """
+    Accepts and discards Socket.IO events.
+    """
+
+    async def emit(self, *args, **kwargs):
+        pass
+
+    async def enter_room(self, *args, **kwargs):
+        pass
+
+    async def leave_room(self, *args, **kwargs):
+        pass
+
+
+def make_database(path, days, chunk_days=1):
+    """
+    Creates a database with `days` days of synthetic 1 Hz samples up to now, including rollups.
+    An existing database at `path` is reused if its newest sample is less than an hour old.
+
+    Args:
+        path (str): Path of the database file.
+        days (int): Number of days of samples.
+        chunk_days (int): Days of samples written per transaction.
+    """
+    now = int(time.time())
+    if os.path.exists(path):
+        storage = SensorStorage(path)
+        newest = storage.connection.execute("SELECT MAX(timestamp) FROM SensorSamples").fetchone()[0]
+        storage.close()
+        if newest and newest >= (now - 3600) * 1000:
+            return
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    logging.warning(f"Creating {path} with {days} days of samples")
+    storage = SensorStorage(path)
+    rng = np.random.default_rng(days)
+    columns = ', '.join(FIELDS)
+    for start in range(now - days * 86400, now, chunk_days * 86400):
+        seconds = np.arange(start, min(now, start + chunk_days * 86400))
+        # A daily cycle plus noise, with every field slightly offset.
+        base = 40.0 + 15.0 * np.sin(seconds * 2 * np.pi / 86400)
+        values = [base + i + rng.normal(0.0, 0.2, len(seconds)) for i in range(len(FIELDS))]
+        values[1] = 50.0 - 0.5 * (base - 40.0) + rng.normal(0.0, 0.5, len(seconds))
+        rows = zip((seconds * 1000).tolist(), *(np.round(v, 3).tolist() for v in values))
+        with storage.connection as conn:
+            conn.executemany(
+                f"INSERT INTO SensorSamples (timestamp, {columns}) VALUES (?, {', '.join('?' * len(FIELDS))})", rows)
+    storage.backfill_rollups()
+    storage.close()
+
+
+def summarize(durations):
+    """
+    Returns:
+        dict: Number of runs and the min, median, 95th percentile and max duration in seconds.
+    """
+    durations = sorted(durations)
+    return {
+        'runs': len(durations),
+        'min': durations[0],
+        'median': statistics.median(durations),
+        'p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        'max': durations[-1],
+    }
+
+
+async def time_async(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+async def bench_logic_iteration(workdir, repeat):
+    """
+    Latency of a full logic_iteration on simulated hardware without sensor latency, so it measures
+    the software path: concurrent sensor reads, control, broadcast and storage.
+    """
+    simulator = Simulator(seed=0, am2315_latency=0.0).start()
+    logic = Logic(NullSocketIO(), db_path=os.path.join(workdir, 'iteration.db'), pcf=simulator.pcf)
+    try:
+        logic.start({'temp_low': 30, 'temp_high': 40, 'never_ending': True})
+        return summarize(await time_async(logic.logic_iteration, repeat))
+    finally:
+        logic.close()
+        simulator.stop()
+
+
+def bench_store_throughput(workdir, samples):
+    """
+    Throughput of store_sensor_data including the write-behind flushes, in samples per second.
+    """
+    logic = Logic(NullSocketIO(), db_path=os.path.join(workdir, 'store.db'), pcf=SimulatedPCF8574(ThermalModel()))
+    try:
+        sensor_data = hardware.SensorData(temperature=20.0, humidity=50.0, ow1=21.0, ow2=22.0, ow3=23.0,
+                                          ow4=24.0, ow5=25.0, average_temp=22.5)
+        timestamp = int(time.time() * 1000) - samples * 1000
+        started = time.perf_counter()
+        for i in range(samples):
+            logic.store_sensor_data(sensor_data, timestamp + i * 1000)
+        logic.storage.flush()
+        elapsed = time.perf_counter() - started
+        return {'samples': samples, 'seconds': elapsed, 'samples_per_second': samples / elapsed}
+    finally:
+        logic.close()
+
+
+async def bench_history(db_path, days, repeat):
+    """
+    Latency of get_sensor_data_for_period for every period that fits in the database, cold (series
+    cache cleared before every call) and warm.
+    """
+    logic = Logic(NullSocketIO(), db_path=db_path, pcf=SimulatedPCF8574(ThermalModel()))
+    results = {}
+    try:
+        for period in PERIODS:
+            if period > days:
+                continue
+
+            async def cold():
+                logic.history.cache.clear()
+                await logic.get_sensor_data_for_period(period)
+
+            async def warm():
+                await logic.get_sensor_data_for_period(period)
+
+            results[f'{period}d cold'] = summarize(await time_async(cold, repeat))
+            results[f'{period}d warm'] = summarize(await time_async(warm, repeat))
+        return results
+    finally:
+        logic.close()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares median latencies and throughput against a baseline.
+
+    Returns:
+        List[str]: A description of every benchmark that got slower by more than `tolerance`.
+    """
+    regressions = []
+
+    def walk(current, previous, name):
+        if 'median' in current and 'median' in previous:
+            if current['median'] > previous['median'] * (1 + tolerance):
+                regressions.append(f"{name}: median {previous['median'] * 1000:.3f} ms -> {current['median'] * 1000:.3f} ms")
+        elif 'samples_per_second' in current and 'samples_per_second' in previous:
+            if current['samples_per_second'] < previous['samples_per_second'] / (1 + tolerance):
+                regressions.append(f"{name}: {previous['samples_per_second']:.0f}/s -> {current['samples_per_second']:.0f}/s")
+        else:
+            for key, value in current.items():
+                if isinstance(value, dict) and isinstance(previous.get(key), dict):
+                    walk(value, previous[key], f'{name}/{key}' if name else key)
+
+    walk(results, baseline, '')
+    return regressions
+
+
+def report(results, indent=''):
+    for name, value in results.items():
+        if 'median' in value:
+            print(f"{indent}{name:<24} median {value['median'] * 1000:9.3f} ms   p95 {value['p95'] * 1000:9.3f} ms"
+                  f"   min {value['min'] * 1000:9.3f} ms   ({value['runs']} runs)")
+        elif 'samples_per_second' in value:
+            print(f"{indent}{name:<24} {value['samples_per_second']:12.0f} samples/s ({value['samples']} samples)")
+        else:
+            print(f"{indent}{name}")
+            report(value, indent + '  ')
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='oven-bench-')
+    try:
+        results = {
+            'logic_iteration': await bench_logic_iteration(workdir, args.repeat),
+            'store_sensor_data': bench_store_throughput(workdir, args.samples),
+            'get_sensor_data_for_period': {},
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(args.data_dir, exist_ok=True)
+    for name in args.databases.split(','):
+        db_path = os.path.join(args.data_dir, f'bench-{name}.db')
+        make_database(db_path, DATABASE_DAYS[name])
+        results['get_sensor_data_for_period'][name] = await bench_history(db_path, DATABASE_DAYS[name], args.repeat)
+    return results
+
+
+def main():
+    """
+    Benchmarks the hot paths on simulated hardware and synthetic databases, and optionally fails
+    when they got slower than a saved baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the control loop, storage and history queries.")
+    parser.add_argument('--databases', default=','.join(DATABASE_DAYS),
+                        help=f"comma separated synthetic database sizes out of {', '.join(DATABASE_DAYS)}")
+    parser.add_argument('--data-dir', default='bench-data', help="where the synthetic databases are kept between runs")
+    parser.add_argument('--repeat', type=int, default=50, help="runs per latency benchmark")
+    parser.add_argument('--samples', type=int, default=20000, help="samples for the storage throughput benchmark")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
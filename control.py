@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+from collections import deque
+from multiprocessing.connection import Listener
+
+from aiohttp import web
+
+import hardware
+import metrics
+from logic import MAX_TEMPERATURE_RISE, Logic
+from pipeline import QueueConsumer
+from shmring import SharedSampleRing
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+class SharedEvents:
+    """
+    Stands in for the Socket.IO server in the control process.
+
+    Live sensor data reaches the API workers through the sample ring, so events for rooms or single
+    clients are dropped. Broadcast events such as 'task_done' are kept, numbered, in the control
+    state, and every API worker forwards them to its clients.
+    """
+
+    def __init__(self, size=32):
+        """
+        Args:
+            size (int): The number of most recent events kept.
+        """
+        self.events = deque(maxlen=size)
+        self.seq = 0
+
+    async def emit(self, event, data=None, to=None, room=None, **kwargs):
+        if to is not None or room is not None:
+            return
+        self.seq += 1
+        self.events.append([self.seq, event, data])
+
+    async def enter_room(self, *args, **kwargs):
+        pass
+
+    async def leave_room(self, *args, **kwargs):
+        pass
+
+
+class ControlProcess:
+    """
+    Runs Logic as a process of its own for the API workers.
+
+    Every sample is published to a SharedSampleRing right after the control stage acted on it. The
+    current task, the output states and recent events are published as the ring's control state.
+    Workers start and stop tasks over a multiprocessing connection; commands run on the control
+    event loop, between sensor reads and control decisions.
+    """
+
+    def __init__(self, logic, ring, events, state_period=0.5):
+        """
+        Args:
+            logic (Logic): The acquisition and control logic.
+            ring (SharedSampleRing): The ring to publish samples and state to, created by this process.
+            events (SharedEvents): The event sink `logic` emits to.
+            state_period (float): Seconds between checks whether the control state changed.
+        """
+        self.logic = logic
+        self.ring = ring
+        self.events = events
+        self.state_period = state_period
+        self.published = None
+        self.loop = None
+        logic.pipeline.add_consumer(QueueConsumer("Shared ring", lambda sample: ring.write(*sample), maxsize=600))
+
+    def state(self):
+        return {
+            'task': self.logic.get_current_task(),
+            'outputs': self.logic.outputs.shadow,
+            'events': list(self.events.events),
+        }
+
+    def publish_state(self):
+        """
+        Publishes the control state if it changed.
+        """
+        state = self.state()
+        if state != self.published:
+            self.ring.write_state(state)
+            self.published = state
+
+    async def execute(self, command):
+        """
+        Runs a command from an API worker: {"command": "start", "task": {...}} or {"command": "stop"}.
+
+        Returns:
+            dict: {"ok": True}, or {"error": message} if the command failed.
+        """
+        try:
+            if command.get('command') == 'start':
+                self.logic.start(command.get('task') or {})
+            elif command.get('command') == 'stop':
+                self.logic.stop()
+            else:
+                raise ValueError(f"Unknown command {command.get('command')}")
+        except ValueError as e:
+            return {'error': str(e)}
+        self.publish_state()
+        return {'ok': True}
+
+    def serve(self, listener):
+        """
+        Accepts worker connections until the listener is closed, one thread per connection.
+        """
+        while True:
+            try:
+                connection = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(connection,), name='control-client', daemon=True).start()
+
+    def handle(self, connection):
+        try:
+            while True:
+                command = connection.recv()
+                connection.send(asyncio.run_coroutine_threadsafe(self.execute(command), self.loop).result())
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    async def publish_state_loop(self):
+        while True:
+            self.publish_state()
+            await asyncio.sleep(self.state_period)
+
+    async def run(self, listener):
+        """
+        Runs acquisition, control and the command server until cancelled.
+        """
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self.serve, args=(listener,), name='control-server', daemon=True).start()
+        await asyncio.gather(self.logic.logic_loop(), self.publish_state_loop())
+
+
+async def serve_metrics(port):
+    """
+    Serves the control process's metrics on their own port, since /metrics of the API workers only
+    covers the workers.
+    """
+    app = web.Application()
+
+    async def metrics_endpoint(request):
+        return web.Response(body=metrics.REGISTRY.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app.router.add_get('/metrics', metrics_endpoint)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    return runner
+
+
+async def main():
+    """
+    Runs the acquisition and control process started by supervisor.py, configured like the API
+    workers through OVEN_* environment variables.
+    """
+    if os.environ.get('OVEN_CONFIG'):
+        raise SystemExit("OVEN_CONFIG is not supported by the control process, run api.py for several ovens")
+    nice = int(os.environ.get('OVEN_CONTROL_NICE', 0))
+    if nice:
+        try:
+            os.nice(nice)
+        except PermissionError:
+            logging.warning(f"Not allowed to change the control process priority by {nice}")
+    # ROM IDs of ow1..ow5, comma-separated; simulated hardware brings its own.
+    hardware.ds18b20.probe_ids = hardware.ds18b20.parse_probe_ids(os.environ.get('OVEN_PROBE_IDS'))
+    simulator = None
+    if os.environ.get('OVEN_HARDWARE') == 'sim':
+        from hardware.sim import Simulator
+        simulator = Simulator(speed=float(os.environ.get('OVEN_SIM_SPEED', 1.0))).start()
+    events = SharedEvents()
+    logic = Logic(events, db_path=os.environ.get('OVEN_DB', 'data2.db'), pcf=simulator.pcf if simulator else None,
+                  # Simulated time runs faster, and temperatures rise faster with it.
+                  max_temperature_rise=MAX_TEMPERATURE_RISE * (simulator.model.speed if simulator else 1.0),
+                  # How many samples a crash can lose, see Logic.
+                  store_batch_size=int(os.environ.get('OVEN_STORE_BATCH_SIZE', 30)),
+                  store_flush_interval=float(os.environ.get('OVEN_STORE_FLUSH_INTERVAL', 30.0)),
+                  store_max_pending=int(os.environ.get('OVEN_STORE_MAX_PENDING', 3600)))
+    ring = SharedSampleRing(os.environ['OVEN_SHARED_RING'], create=True)
+    listener = Listener(os.environ['OVEN_CONTROL_ADDRESS'], family='AF_UNIX',
+                        authkey=bytes.fromhex(os.environ['OVEN_CONTROL_AUTHKEY']))
+    runner = await serve_metrics(int(os.environ.get('OVEN_CONTROL_METRICS_PORT', 9101)))
+    task = asyncio.create_task(ControlProcess(logic, ring, events).run(listener))
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        listener.close()
+        await runner.cleanup()
+        logic.close()
+        ring.close()
+        ring.unlink()
+        if simulator:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
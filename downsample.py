@@ -0,0 +1,137 @@
+import numpy as np
+
+# Downsampling modes for history series.
+AVG = 'avg'
+MINMAX = 'minmax'
+LTTB = 'lttb'
+MODES = (AVG, MINMAX, LTTB)
+
+
+def bucket_starts(timestamps, width):
+    """
+    Splits sorted timestamps into buckets of `width` seconds aligned to the epoch.
+
+    Args:
+        timestamps (np.ndarray): Sorted epoch timestamps in seconds.
+        width (int): The bucket width in seconds.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The start time of every non-empty bucket and the index of
+        its first sample.
+    """
+    buckets = (timestamps // width).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    return buckets[starts] * width, starts
+
+
+def average(values, starts, weights=None):
+    """
+    Averages every bucket, ignoring NaN. Buckets without values are NaN.
+    """
+    valid = ~np.isnan(values)
+    if weights is None:
+        weights = np.ones(len(values))
+    weights = np.where(valid, weights, 0.0)
+    sums = np.add.reduceat(np.where(valid, values, 0.0) * weights, starts)
+    counts = np.add.reduceat(weights, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def envelope(values, starts):
+    """
+    Returns the minimum and maximum of every bucket, ignoring NaN.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)
+
+
+def lttb(timestamps, values, starts):
+    """
+    Picks one sample per bucket with largest-triangle-three-buckets: the sample forming the largest
+    triangle with the sample picked in the previous bucket and the average of the next bucket. The
+    first and last buckets keep their first and last sample. Unlike an average this keeps short
+    spikes. The work per bucket is vectorized, so the only Python loop is over buckets, not samples.
+
+    Returns:
+        np.ndarray: The picked value of every bucket, NaN for buckets without values.
+    """
+    ends = np.append(starts[1:], len(values))
+    next_x = np.append(average(timestamps.astype(np.float64), starts)[1:], timestamps[-1])
+    next_y = np.append(average(values, starts)[1:], np.nan)
+    picked = np.full(len(starts), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid):
+        return picked
+    # The first bucket keeps its first value, like the first point of the classic algorithm.
+    ax, ay = timestamps[valid[0]], values[valid[0]]
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        x = timestamps[start:end]
+        y = values[start:end]
+        if i == 0 and valid[0] < end:
+            j = valid[0] - start
+        elif i == len(starts) - 1 and i > 0:
+            # The last bucket keeps its last value, so the newest sample is always shown.
+            present = np.flatnonzero(~np.isnan(y))
+            if not len(present):
+                continue
+            j = int(present[-1])
+        else:
+            cx, cy = next_x[i], next_y[i]
+            if np.isnan(cy):
+                cx, cy = ax, ay
+            area = np.abs((ax - cx) * (y - ay) - (ax - x) * (cy - ay))
+            area = np.where(np.isnan(y), -1.0, area)
+            j = int(np.argmax(area))
+            if area[j] < 0:
+                continue
+        ax, ay = x[j], y[j]
+        picked[i] = ay
+    return picked
+
+
+def _to_list(values):
+    return [None if v != v else v for v in values.tolist()]
+
+
+def aggregate(timestamps, columns, width, mode=AVG, weights=None):
+    """
+    Downsamples raw columns into buckets of `width` seconds in one pass.
+
+    Args:
+        timestamps (np.ndarray): Sorted epoch timestamps in seconds.
+        columns (dict): Maps field names to value arrays with NaN for missing values.
+        width (int): The bucket width in seconds.
+        mode (str): AVG for the average of every bucket, MINMAX for the average plus `<field>_min`
+            and `<field>_max` columns, or LTTB for one representative sample per bucket.
+        weights (np.ndarray): Number of samples behind every value if the input is already
+            aggregated, or None for raw samples.
+
+    Returns:
+        dict: One list per column: 'timestamp' (epoch seconds of the bucket), the fields and 'count'.
+    """
+    if not len(timestamps):
+        series = {'timestamp': []}
+        for field in columns:
+            series[field] = []
+            if mode == MINMAX:
+                series[f'{field}_min'] = []
+                series[f'{field}_max'] = []
+        series['count'] = []
+        return series
+    bucket_times, starts = bucket_starts(timestamps, width)
+    series = {'timestamp': bucket_times.tolist()}
+    for field, values in columns.items():
+        if mode == LTTB:
+            series[field] = _to_list(lttb(timestamps, values, starts))
+        else:
+            series[field] = _to_list(average(values, starts, weights))
+        if mode == MINMAX:
+            minimum, maximum = envelope(values, starts)
+            series[f'{field}_min'] = _to_list(minimum)
+            series[f'{field}_max'] = _to_list(maximum)
+    if weights is None:
+        series['count'] = np.diff(np.append(starts, len(timestamps))).tolist()
+    else:
+        series['count'] = np.add.reduceat(weights, starts).astype(np.int64).tolist()
+    return series
@@ -1,2 +1,3 @@
 from hardware.am2315 import *
 from hardware.input import *
+from hardware.output import *
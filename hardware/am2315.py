@@ -5,8 +5,8 @@
 # Imports #
 ###########
 
+import threading
 import time
-import quick2wire.i2c as qI2c
 
 ################
 # am2315 class #
@@ -18,13 +18,25 @@ class am2315:
     
     am3215Addr: I2C address of the sensor, but will default to 0x5c if it's not specified. This defaults to 0x5c.
     i2cBusID: Bus ID number that the sensor is attached to. This defaults to 1 (the default bus ID on newer Raspberry Pis.)
+    
+    The object is meant to be long-lived: it keeps the I2C bus open between reads and adapts the wake and
+    read delays to how the sensor actually responds, so call close() when it is no longer needed.
     """
+    
+    # Bounds for the adaptive delays in seconds. The datasheet asks for at least 0.8 ms after the
+    # wake pulse and 1.5 ms between the read command and reading the result.
+    minWakeDelay = 0.001
+    minReadDelay = 0.002
+    maxDelay = 0.1
 
     # The config variables are based on the AM2315 datasheet
     def __init__(self, am2315Addr = 0x5c, i2cBusID = 1):
-        # Set up I2C libraries
+        # Set up I2C libraries. Imported here so the package can be imported without quick2wire,
+        # e.g. to run on the simulated hardware in hardware.sim.
+        import quick2wire.i2c as qI2c
         self.__i2c = qI2c
-        self.__i2cMaster = qI2c.I2CMaster(1)
+        self.__i2cMaster = qI2c.I2CMaster(i2cBusID)
+        self.__lock = threading.Lock()
         
         # Set global address var
         self.__addr = am2315Addr
@@ -49,6 +61,58 @@ class am2315:
         
         # Commands
         self.cmdReadReg = 0x03
+        
+        # Adaptive timing, starting from conservative values.
+        self.wakeDelay = 0.01
+        self.readDelay = 0.02
+        
+        # Statistics
+        self.readCount = 0
+        self.failCount = 0
+        self.crcErrorCount = 0
+        self.lastLatency = None
+        self.avgLatency = None
+    
+    def close(self):
+        """
+        close()
+        
+        Closes the I2C bus.
+        """
+        self.__i2cMaster.close()
+    
+    def getStats(self):
+        """
+        getStats()
+        
+        Returns a dictionary with read counts, failure counts, read latency and the current delays.
+        """
+        return {
+            'reads': self.readCount,
+            'failures': self.failCount,
+            'crc_errors': self.crcErrorCount,
+            'last_latency': self.lastLatency,
+            'avg_latency': self.avgLatency,
+            'wake_delay': self.wakeDelay,
+            'read_delay': self.readDelay,
+        }
+    
+    def __crc16(self, data):
+        """
+        __crc16(bytes)
+        
+        Computes the Modbus CRC16 the AM2315 appends to its responses.
+        """
+        
+        crc = 0xffff
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                if crc & 0x01:
+                    crc = (crc >> 1) ^ 0xa001
+                else:
+                    crc >>= 1
+        return crc
     
     def __getSigned(self, unsigned):
         """
@@ -69,59 +133,82 @@ class am2315:
         # Return the unsigned int.
         return signednum
         
-    def getTempHumid(self):
+    def __readRaw(self):
         """
-        getTempHumid()
+        __readRaw()
         
-        Get the temperature and humidity from the sensor. Returns an array with two integers - temp. [0] and humidity [1]
+        Wakes the sensor, requests the temperature and humidity registers and returns the 8 byte response.
+        Raises IOError if the transfer fails, the response is malformed or its CRC does not match.
         """
         
-        # Track temperature data.
-        tempRaw = 0
-        humidRaw = 0
+        # Commands to get data temp and humidity data from AM2315
+        thCmd = bytearray([0x00,0x04])
         
-        # Raw temperature and humidity data.
-        rawTH = 0
+        # The sensor sleeps between reads and NAKs the first transfer, which is enough to wake it up.
+        try:
+            self.__i2cMaster.transaction(self.__i2c.writing_bytes(self.__addr, 0x00))
+        except IOError:
+            pass
+        time.sleep(self.wakeDelay)
         
-        # Return value
-        retVal = []
+        # Request data from the sensor, using a reference to the command bytes.
+        self.__i2cMaster.transaction(self.__i2c.writing_bytes(self.__addr, self.cmdReadReg, *thCmd))
         
-        # Loop sentinel values
-        failCount = 0
-        notDone = True
+        # Wait for the sensor to supply data to read.
+        time.sleep(self.readDelay)
         
-        # Commands to get data temp and humidity data from AM2315
-        thCmd = bytearray([0x00,0x04])
+        # Now read 8 bytes from the AM2315 and break the string we want out of the array the transaction returns.
+        rawTH = bytearray(self.__i2cMaster.transaction(self.__i2c.reading(self.__addr, 8))[0])
         
-        # If we have failed more than twice to read the data, or have finished getting data break the loop.
-        while ((failCount < 2) and notDone):
+        # Confirm the command worked by checking the response for the command we executed
+        # and the number of bytes we asked for.
+        if len(rawTH) != 8 or rawTH[0] != self.cmdReadReg or rawTH[1] != 0x04:
+            raise IOError("am2315 IO Error: unexpected response header.")
+        
+        # The CRC is sent low byte first.
+        if self.__crc16(rawTH[:6]) != (rawTH[7] << 8) | rawTH[6]:
+            self.crcErrorCount = self.crcErrorCount + 1
+            raise IOError("am2315 IO Error: CRC mismatch.")
+        
+        return rawTH
+    
+    def getTempHumid(self, attempts = 3):
+        """
+        getTempHumid()
+        
+        Get the temperature and humidity from the sensor. Returns an array with two integers - temp. [0] and humidity [1]
+        Raises IOError if no valid reading was received in `attempts` tries.
+        
+        Every failed try doubles the wake and read delays, and every successful first try shortens
+        them a little, so the delays settle just above what this particular sensor needs.
+        """
+        
+        with self.__lock:
+            start = time.monotonic()
+            rawTH = None
             
-            try:
-                # Request data from the sensor, using a reference to the command bytes.
-                self.__i2cMaster.transaction(self.__i2c.writing_bytes(self.__addr, self.cmdReadReg, *thCmd))
-                
-                # Wait for the sensor to supply data to read.
-                time.sleep(0.1)
-                
-                # Now read 8 bytes from the AM2315.
-                rawTH = self.__i2cMaster.transaction(self.__i2c.reading(self.__addr, 8))
-                
-                # Break the string we want out of the array the transaction returns.
-                rawTH = bytearray(rawTH[0])
-                
-                # Confirm the command worked by checking the response for the command we executed
-                # and the number of bytes we asked for.
-                if (rawTH[0] == self.cmdReadReg) and (rawTH[1] == 0x04):
-                    
-                    # We're done. flag the loop to exit so we can interpret the data sent back to us.
-                    notDone = False
+            for attempt in range(attempts):
+                try:
+                    rawTH = self.__readRaw()
+                    break
+                except IOError:
+                    self.failCount = self.failCount + 1
+                    self.wakeDelay = min(self.maxDelay, self.wakeDelay * 2)
+                    self.readDelay = min(self.maxDelay, self.readDelay * 2)
             
-            # We usually fail to read data 50% of the time because the sensor goes to sleep, so try twice.
-            except IOError:
-                if failCount > 1:
-                    raise IOError("am2315 IO Error: failed to read from sensor.")
-                else:
-                    failCount = failCount + 1
+            if rawTH is None:
+                raise IOError("am2315 IO Error: failed to read from sensor.")
+            
+            if attempt == 0:
+                self.wakeDelay = max(self.minWakeDelay, self.wakeDelay * 0.9)
+                self.readDelay = max(self.minReadDelay, self.readDelay * 0.9)
+            
+            self.readCount = self.readCount + 1
+            self.lastLatency = time.monotonic() - start
+            if self.avgLatency is None:
+                self.avgLatency = self.lastLatency
+            else:
+                self.avgLatency = 0.9 * self.avgLatency + 0.1 * self.lastLatency
         
         # And the MSB and LSB for each value together to yield our raw values.
         humidRaw = (rawTH[2] << 8) | rawTH[3]
@@ -130,7 +217,4 @@ class am2315:
         tempRaw = self.__getSigned((rawTH[4] << 8) | rawTH[5])
         
         # The return data is sacled up by 10x, so compensate.
-        retVal.append(tempRaw / 10.0)
-        retVal.append(humidRaw / 10.0)
-        
-        return retVal
+        return [tempRaw / 10.0, humidRaw / 10.0]
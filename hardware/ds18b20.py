@@ -1,9 +1,30 @@
 import os
 import glob
+import logging
 import time
 
 base_dir = '/sys/bus/w1/devices/'
 
+# How many times to re-read w1_slave while the CRC check says 'NO' before giving up.
+max_retries = 10
+
+# ROM IDs of the probes in ow1..ow5 order, e.g. ['28-0316a2794cff', ...], set from OVEN_PROBE_IDS by
+# api.py and control.py. Slots never come from discovery: a probe missing at boot would shift the
+# others into its slot, and ow3 is safety relevant. A configured probe that is missing reads as None.
+probe_ids = []
+
+# How long to wait for a bulk conversion before giving up, in seconds.
+bulk_timeout = 1.5
+
+_warned = False
+
+def parse_probe_ids(value):
+    # Parses a comma-separated list of ROM IDs in ow1..ow5 order, such as OVEN_PROBE_IDS.
+    ids = [rom_id.strip() for rom_id in (value or '').split(',') if rom_id.strip()]
+    if len(ids) > 5:
+        raise ValueError(f"At most 5 DS18B20 probe ids can be configured, got {len(ids)}")
+    return ids
+
 def read_temp_raw(device_file):
     with open(device_file, 'r') as f:
         lines = f.readlines()
@@ -12,7 +33,11 @@ def read_temp_raw(device_file):
 
 def read_temp(device_file):
     lines = read_temp_raw(device_file)
+    retries = 0
     while lines[0].strip()[-3:] != 'YES':
+        retries += 1
+        if retries > max_retries:
+            raise IOError(f"ds18b20 IO Error: no valid reading from {device_file}")
         time.sleep(0.2)
         lines = read_temp_raw(device_file)
     equals_pos = lines[1].find('t=')
@@ -21,10 +46,57 @@ def read_temp(device_file):
         temp_c = float(temp_string) / 1000.0
         return temp_c
 
+def _masters():
+    return glob.glob(base_dir + 'w1_bus_master*')
+
+def get_devices():
+    # ROM IDs in ow1..ow5 order, see probe_ids.
+    global _warned
+    if not probe_ids and not _warned:
+        _warned = True
+        logging.error("No DS18B20 probe ids configured (OVEN_PROBE_IDS), probes are not read and the heater stays off")
+    return list(probe_ids)
+
+def bulk_convert():
+    # Starts one temperature conversion on every probe of every bus through the kernel's
+    # therm_bulk_read and waits for it. Returns False if the kernel does not support bulk reads.
+    files = [master + '/therm_bulk_read' for master in _masters()]
+    files = [f for f in files if os.path.exists(f)]
+    if not files:
+        return False
+    for bulk_file in files:
+        with open(bulk_file, 'w') as f:
+            f.write('trigger\n')
+    deadline = time.monotonic() + bulk_timeout
+    for bulk_file in files:
+        while True:
+            with open(bulk_file) as f:
+                if f.read().strip() != '-1':
+                    break
+            if time.monotonic() > deadline:
+                raise IOError("ds18b20 IO Error: bulk conversion timed out")
+            time.sleep(0.05)
+    return True
+
+def read_converted(rom_id):
+    # Reads the result of the last bulk conversion without starting a new one.
+    with open(base_dir + rom_id + '/temperature') as f:
+        return int(f.read()) / 1000.0
+
+def read_slave(rom_id):
+    # Reads a single probe, starting its own conversion.
+    return read_temp(base_dir + rom_id + '/w1_slave')
+
 def read_all():
+    devices = get_devices()
+    try:
+        read = read_converted if bulk_convert() else read_slave
+    except IOError:
+        read = read_slave
     temps = []
-    for folder in glob.glob(base_dir + '28*'):
-        device_file = folder + '/w1_slave'
-        temp_c = read_temp(device_file)
-        temps.append(temp_c)
+    for rom_id in devices:
+        try:
+            temps.append(read(rom_id))
+        except (IOError, ValueError):
+            temps.append(None)
     return temps
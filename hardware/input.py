@@ -1,20 +1,35 @@
+import asyncio
 import dataclasses
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
 
+import metrics
 from hardware import ds18b20
 from hardware.am2315 import am2315
 
+# Per-sensor timeouts (seconds) for the async acquisition path.
+AM2315_TIMEOUT = 2.0
+DS18B20_TIMEOUT = 2.0
+
+# One worker for the AM2315 plus one per DS18B20 probe, so every read runs at the same time; with
+# several ovens the AM2315s of up to ten run at once, and the probe reads after a bulk conversion
+# are only file reads. Threads are started as they are needed.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='sensor')
+
 @dataclass
 class SensorData:
-    temperature: float = 0.0
-    humidity: float = 0.0
-    ow1: float = 0.0
-    ow2: float = 0.0
-    ow3: float = 0.0
-    ow4: float = 0.0
-    ow5: float = 0.0
-    average_temp: float = 0.0
+    temperature: Optional[float] = 0.0
+    humidity: Optional[float] = 0.0
+    ow1: Optional[float] = 0.0
+    ow2: Optional[float] = 0.0
+    ow3: Optional[float] = 0.0
+    ow4: Optional[float] = 0.0
+    ow5: Optional[float] = 0.0
+    average_temp: Optional[float] = 0.0
 
     def to_json(self):
         return json.dumps(
@@ -25,18 +40,117 @@ class SensorData:
     def to_dict(self):
         return dataclasses.asdict(self)
 
-def get_sensor_data() -> SensorData:
-    thSens = am2315()
-    thDat = thSens.getTempHumid()
+def _build_sensor_data(thDat, ow_temps) -> SensorData:
+    """
+    Builds a SensorData from an AM2315 reading and a list of probe temperatures.
+    Sensors that could not be read are passed as None and stay None in the result.
+    """
     data = SensorData()
-    data.temperature = thDat[0]
-    data.humidity = thDat[1]
-    ow_temps = ds18b20.read_all()
-    data.ow1 = ow_temps[0]
-    data.ow2 = ow_temps[1]
-    data.ow3 = ow_temps[2]
-    data.ow4 = ow_temps[3]
-    data.ow5 = ow_temps[4]
-    data.average_temp = round((sum(ow_temps) + data.temperature) / (len(ow_temps) + 1) * 1000) / 1000
-
+    data.temperature, data.humidity = thDat if thDat is not None else (None, None)
+    ow_temps = list(ow_temps[:5]) + [None] * (5 - len(ow_temps))
+    data.ow1, data.ow2, data.ow3, data.ow4, data.ow5 = ow_temps
+    temps = [t for t in ow_temps + [data.temperature] if t is not None]
+    data.average_temp = round(sum(temps) / len(temps) * 1000) / 1000 if temps else None
     return data
+
+@dataclass(frozen=True)
+class SensorSet:
+    """
+    The sensors of one oven: an AM2315 and up to five DS18B20 probes in ow1..ow5 order.
+
+    All AM2315s have the same address, so several ovens need a TCA9548A multiplexer. The kernel's
+    i2c-mux-pca954x driver (dtoverlay=i2c-mux,pca9548) exposes each of its channels as an I2C bus
+    of its own, which is what `am2315_bus` refers to.
+    """
+    am2315_bus: int = 1
+    am2315_address: int = 0x5c
+    probe_ids: Tuple[str, ...] = ()
+
+# AM2315 drivers by I2C bus and address, see get_am2315().
+_am2315s = {}
+
+def get_am2315(bus=1, address=0x5c) -> am2315:
+    """
+    Returns the shared AM2315 driver on an I2C bus, opening it on first use.
+    The driver keeps its I2C bus open and its timing statistics across reads.
+    """
+    driver = _am2315s.get((bus, address))
+    if driver is None:
+        driver = _am2315s[(bus, address)] = am2315(address, bus)
+    return driver
+
+def get_sensor_data() -> SensorData:
+    with metrics.SENSOR_READ_SECONDS.time('AM2315'):
+        thDat = get_am2315().getTempHumid()
+    with metrics.SENSOR_READ_SECONDS.time('DS18B20'):
+        ow_temps = ds18b20.read_all()
+    return _build_sensor_data(thDat, ow_temps)
+
+def _read_am2315(bus=1, address=0x5c):
+    return get_am2315(bus, address).getTempHumid()
+
+async def _read_sensor(name, func, timeout, *args):
+    """
+    Runs a blocking sensor read on the sensor executor and records its duration under `name`.
+    Returns None instead of raising if the read fails or takes longer than `timeout` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_executor, func, *args), timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Reading {name} timed out after {timeout}s")
+    except Exception as e:
+        logging.warning(f"Reading {name} failed: {e}")
+    finally:
+        metrics.SENSOR_READ_SECONDS.observe(time.perf_counter() - started, name)
+    metrics.SENSOR_ERRORS.inc(name)
+    return None
+
+async def _read_ds18b20(timeout):
+    """
+    Reads the configured DS18B20 probes in ow1..ow5 order, see ds18b20.probe_ids.
+    Uses one bulk conversion for all probes if the kernel supports it, and parallel per-probe
+    conversions otherwise. Probes that are missing, fail or time out are reported as None.
+    """
+    devices = ds18b20.get_devices()
+    read = ds18b20.read_slave
+    if await _read_sensor('DS18B20 bulk conversion', ds18b20.bulk_convert, timeout):
+        read = ds18b20.read_converted
+    return await asyncio.gather(*[_read_sensor(rom_id, read, timeout, rom_id) for rom_id in devices])
+
+async def get_sensor_data_async(am2315_timeout=AM2315_TIMEOUT, ds18b20_timeout=DS18B20_TIMEOUT) -> SensorData:
+    """
+    Reads the AM2315 and all DS18B20 probes concurrently without blocking the event loop.
+    Each sensor has its own timeout; sensors that fail or time out are reported as None.
+    """
+    thDat, ow_temps = await asyncio.gather(
+        _read_sensor('AM2315', _read_am2315, am2315_timeout),
+        _read_ds18b20(ds18b20_timeout),
+    )
+    return _build_sensor_data(thDat, ow_temps)
+
+async def get_sensor_sets_data_async(sensor_sets, am2315_timeout=AM2315_TIMEOUT,
+                                     ds18b20_timeout=DS18B20_TIMEOUT) -> List[SensorData]:
+    """
+    Reads the sensors of several ovens at once. One bulk conversion starts every DS18B20 on every
+    1-Wire bus, then all AM2315s and probes are read concurrently, so the time a read takes hardly
+    grows with the number of ovens. Sensors that fail or time out are reported as None.
+
+    Args:
+        sensor_sets (List[SensorSet]): The sensors of every oven.
+
+    Returns:
+        List[SensorData]: One sample per sensor set, in the same order.
+    """
+    read = ds18b20.read_slave
+    if await _read_sensor('DS18B20 bulk conversion', ds18b20.bulk_convert, ds18b20_timeout):
+        read = ds18b20.read_converted
+    results = await asyncio.gather(
+        *[_read_sensor(f'AM2315 bus {s.am2315_bus}', _read_am2315, am2315_timeout, s.am2315_bus, s.am2315_address)
+          for s in sensor_sets],
+        *[_read_sensor(rom_id, read, ds18b20_timeout, rom_id) for s in sensor_sets for rom_id in s.probe_ids],
+    )
+    temps = iter(results[len(sensor_sets):])
+    return [_build_sensor_data(thDat, [next(temps) for _ in s.probe_ids])
+            for s, thDat in zip(sensor_sets, results[:len(sensor_sets)])]
@@ -0,0 +1,89 @@
+import metrics
+
+# PCF8574 pin assignment
+HEATER = 1
+XTR1 = 2
+XTR2 = 3
+BEEPER = 4
+FAN = 5
+COOLER = 6
+START = 7
+
+def open_pcf8574(address=0x20):
+    """
+    Opens the PCF8574 on the board's default I2C bus.
+
+    Args:
+        address (int): The I2C address of the port expander.
+
+    Returns:
+        adafruit_pcf8574.PCF8574: The port expander.
+    """
+    import board
+    import adafruit_pcf8574
+    return adafruit_pcf8574.PCF8574(board.I2C(), address)
+
+class PCF8574Outputs:
+    """
+    Drives all 8 PCF8574 pins from a shadow byte.
+
+    The whole port is written in a single I2C transaction, and only when the byte changes, so
+    unchanged relays cost no bus traffic and are never glitched. `writes` counts the I2C writes, and
+    every pin that changes state is counted in metrics.RELAY_SWITCHES.
+    """
+
+    def __init__(self, pcf, initial=0x00):
+        """
+        Args:
+            pcf (adafruit_pcf8574.PCF8574): The port expander.
+            initial (int): The pin state to assume for pins that were never set.
+        """
+        self.pcf = pcf
+        self.shadow = initial
+        self.written = None
+        self.writes = 0
+
+    def set(self, states):
+        """
+        Sets several pins at once.
+
+        Args:
+            states (dict): Maps pin numbers to the desired state.
+
+        Returns:
+            bool: True if the port was written, False if nothing changed.
+        """
+        shadow = self.shadow
+        for pin, state in states.items():
+            if state:
+                shadow |= 1 << pin
+            else:
+                shadow &= ~(1 << pin)
+        self.shadow = shadow
+        return self.flush()
+
+    def get(self, pin):
+        """
+        Returns the state last set for a pin.
+        """
+        return bool(self.shadow & (1 << pin))
+
+    def flush(self):
+        """
+        Writes the shadow byte to the port if it differs from what was last written.
+        After a failed write the next call writes again.
+        """
+        if self.shadow == self.written:
+            return False
+        previous = self.written
+        self.written = None
+        with metrics.I2C_WRITE_SECONDS.time():
+            self.pcf.write_gpio(self.shadow)
+        self.written = self.shadow
+        self.writes += 1
+        if previous is not None:
+            changed = previous ^ self.shadow
+            for pin in range(8):
+                if changed & (1 << pin):
+                    metrics.RELAY_SWITCHES.inc(pin)
+        return True
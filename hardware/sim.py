@@ -0,0 +1,277 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from hardware import ds18b20
+from hardware import input as sensor_input
+from hardware.output import COOLER, FAN, HEATER
+
+
+class ThermalModel:
+    """
+    A lumped thermal model of the oven.
+
+    The air is heated by the heater, cooled by the cooler and loses heat to the ambient. Every probe
+    follows the air temperature plus its own offset with a first-order lag that the fan shortens.
+    Humidity drops as the air warms up. `speed` makes simulated time run faster than wall time, so
+    long tasks can be exercised quickly.
+    """
+
+    ambient = 22.0
+    heater_rate = 0.05     # K/s with the heater on
+    cooler_rate = 0.03     # K/s with the cooler on
+    loss_rate = 0.002      # 1/s towards the ambient
+    probe_lag = 60.0       # s, time constant of the probes without the fan
+    fan_lag = 20.0         # s, time constant of the probes with the fan
+    probe_offsets = (0.0, -0.5, 1.0, 0.5, -1.0)
+    noise = 0.05
+
+    def __init__(self, speed=1.0, seed=None):
+        """
+        Args:
+            speed (float): Simulated seconds per wall-clock second.
+            seed (int): Seed for the measurement noise, random if None.
+        """
+        self.speed = speed
+        self.random = random.Random(seed)
+        self.air = self.ambient
+        self.probes = [self.ambient] * len(self.probe_offsets)
+        self.outputs = 0x00
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def advance(self):
+        """
+        Integrates the model up to now in steps of at most one simulated second.
+        """
+        with self.lock:
+            now = time.monotonic()
+            elapsed = (now - self.last) * self.speed
+            self.last = now
+            heater = bool(self.outputs & (1 << HEATER))
+            cooler = bool(self.outputs & (1 << COOLER))
+            lag = self.fan_lag if self.outputs & (1 << FAN) else self.probe_lag
+            while elapsed > 0:
+                dt = min(1.0, elapsed)
+                elapsed -= dt
+                self.air += dt * (heater * self.heater_rate - cooler * self.cooler_rate
+                                  - self.loss_rate * (self.air - self.ambient))
+                for i, offset in enumerate(self.probe_offsets):
+                    self.probes[i] += dt * (self.air + offset - self.probes[i]) / lag
+
+    def temperature(self):
+        return self.air + self.random.gauss(0.0, self.noise)
+
+    def humidity(self):
+        return min(100.0, max(0.0, 50.0 - 0.8 * (self.air - self.ambient) + self.random.gauss(0.0, self.noise)))
+
+    def probe(self, i):
+        return self.probes[i] + self.random.gauss(0.0, self.noise)
+
+
+class SimulatedPCF8574:
+    """
+    Stands in for adafruit_pcf8574.PCF8574 and feeds the written port byte to the thermal model.
+    """
+
+    def __init__(self, model, latency=0.0, failure_rate=0.0):
+        """
+        Args:
+            model (ThermalModel): The model the outputs drive.
+            latency (float): Duration of every write in seconds.
+            failure_rate (float): Probability that a write raises OSError.
+        """
+        self.model = model
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.writes = 0
+
+    def write_gpio(self, value):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.model.random.random() < self.failure_rate:
+            raise OSError("Simulated PCF8574 write failure")
+        self.model.advance()
+        self.model.outputs = value
+        self.writes += 1
+
+
+class SimulatedAM2315:
+    """
+    Stands in for the am2315 driver, with the same getTempHumid(), getStats() and close().
+    """
+
+    def __init__(self, model, latency=0.03, failure_rate=0.0):
+        """
+        Args:
+            model (ThermalModel): The model to measure.
+            latency (float): Duration of every read attempt in seconds.
+            failure_rate (float): Probability that a read attempt fails.
+        """
+        self.model = model
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.readCount = 0
+        self.failCount = 0
+
+    def close(self):
+        pass
+
+    def getStats(self):
+        return {'reads': self.readCount, 'failures': self.failCount}
+
+    def getTempHumid(self, attempts=3):
+        for attempt in range(attempts):
+            if self.latency:
+                time.sleep(self.latency)
+            if self.model.random.random() < self.failure_rate:
+                self.failCount += 1
+                continue
+            self.model.advance()
+            self.readCount += 1
+            return [round(self.model.temperature(), 1), round(self.model.humidity(), 1)]
+        raise IOError("am2315 IO Error: failed to read from sensor.")
+
+
+class SimulatedW1Bus:
+    """
+    A DS18B20 sysfs tree in a temporary directory, in the layout of /sys/bus/w1/devices.
+
+    The real ds18b20 driver reads it unchanged, including bulk conversions and CRC retries. Every
+    update() writes the current probe temperatures; with `failure_rate` a probe reports a failed CRC
+    check, which the driver retries after its usual delay, and has no bulk conversion result.
+    Several buses can share one tree, each with its own bus master.
+    """
+
+    def __init__(self, model, failure_rate=0.0, root=None, master=1):
+        """
+        Args:
+            model (ThermalModel): The model to measure.
+            failure_rate (float): Probability that a probe reports a failed CRC check.
+            root (str): Directory to create the tree in, a new temporary directory if None.
+            master (int): Number of the bus master, which is also part of the probe ROM IDs.
+        """
+        self.model = model
+        self.failure_rate = failure_rate
+        self.owned = root is None
+        self.root = root or tempfile.mkdtemp(prefix='w1-')
+        self.probe_ids = [f'28-{master:06x}00000{i + 1}' for i in range(len(model.probe_offsets))]
+        self.master = master = os.path.join(self.root, f'w1_bus_master{master}')
+        os.makedirs(master, exist_ok=True)
+        self._write(os.path.join(master, 'w1_master_slave_count'), f'{len(self.probe_ids)}\n')
+        self._write(os.path.join(master, 'therm_bulk_read'), '1\n')
+        for rom_id in self.probe_ids:
+            os.makedirs(os.path.join(self.root, rom_id), exist_ok=True)
+        self.update()
+
+    @staticmethod
+    def _write(path, text):
+        # Replaced atomically, so a driver thread never reads a half-written file.
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+    def update(self):
+        """
+        Writes the current temperature of every probe.
+        """
+        for i, rom_id in enumerate(self.probe_ids):
+            millis = int(self.model.probe(i) * 1000)
+            failed = self.model.random.random() < self.failure_rate
+            self._write(os.path.join(self.root, rom_id, 'w1_slave'),
+                        f'50 05 4b 46 7f ff 0c 10 1c : crc=1c {"NO" if failed else "YES"}\n'
+                        f'50 05 4b 46 7f ff 0c 10 1c t={millis}\n')
+            self._write(os.path.join(self.root, rom_id, 'temperature'), '' if failed else f'{millis}\n')
+
+    def close(self):
+        """
+        Removes the tree, or only this bus from a tree shared with other buses.
+        """
+        if self.owned:
+            shutil.rmtree(self.root, ignore_errors=True)
+            return
+        for path in [self.master] + [os.path.join(self.root, rom_id) for rom_id in self.probe_ids]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Simulator:
+    """
+    Simulated oven hardware: an AM2315, five DS18B20 probes and the PCF8574 outputs, all driven by
+    one ThermalModel.
+
+    start() installs the simulated sensors in place of the real ones and keeps the probe files up to
+    date every `conversion_time` seconds, like the probes converting continuously; pass `pcf` to
+    Logic for the outputs.
+
+    Several simulators can run side by side as the ovens of an OvenManager: give each its own `bus`
+    and the `root` of the first one, and the ovens' sensor sets from sensor_set().
+    """
+
+    def __init__(self, speed=1.0, seed=None, am2315_latency=0.03, am2315_failure_rate=0.0,
+                 ds18b20_failure_rate=0.0, pcf_latency=0.0, pcf_failure_rate=0.0, conversion_time=0.75,
+                 bus=1, root=None):
+        """
+        Args:
+            speed (float): Simulated seconds per wall-clock second, see ThermalModel.
+            seed (int): Seed for noise and failures, random if None.
+            am2315_latency (float): Duration of every AM2315 read attempt in seconds.
+            am2315_failure_rate (float): Probability that an AM2315 read attempt fails.
+            ds18b20_failure_rate (float): Probability that a probe reports a failed CRC check.
+            pcf_latency (float): Duration of every PCF8574 write in seconds.
+            pcf_failure_rate (float): Probability that a PCF8574 write fails.
+            conversion_time (float): Seconds between updates of the probe files.
+            bus (int): The I2C bus of the AM2315 and the number of the 1-Wire bus master.
+            root (str): The simulated 1-Wire tree, see SimulatedW1Bus.
+        """
+        self.bus = bus
+        self.model = ThermalModel(speed, seed)
+        self.am2315 = SimulatedAM2315(self.model, am2315_latency, am2315_failure_rate)
+        self.w1 = SimulatedW1Bus(self.model, ds18b20_failure_rate, root, bus)
+        self.pcf = SimulatedPCF8574(self.model, pcf_latency, pcf_failure_rate)
+        self.conversion_time = conversion_time
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sensor_set(self):
+        """
+        Returns:
+            SensorSet: The simulated sensors, for OvenManager.
+        """
+        return sensor_input.SensorSet(self.bus, 0x5c, tuple(self.w1.probe_ids))
+
+    def install(self):
+        """
+        Points the sensor drivers at the simulated sensors.
+        """
+        sensor_input._am2315s[(self.bus, 0x5c)] = self.am2315
+        ds18b20.base_dir = self.w1.root + '/'
+        ds18b20.probe_ids = list(self.w1.probe_ids)
+
+    def start(self):
+        """
+        Installs the simulated sensors and starts updating the probe files.
+
+        Returns:
+            Simulator: This simulator.
+        """
+        self.install()
+        self.thread = threading.Thread(target=self._run, name='simulator', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.conversion_time):
+            self.model.advance()
+            self.w1.update()
+
+    def stop(self):
+        """
+        Stops updating the probe files and removes them.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.w1.close()
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import downsample
+import wire
+from ringbuffer import SensorRingBuffer
+from seriescache import SeriesCache
+from storage import MAX_POINTS, bucket_width
+
+
+class SensorHistory:
+    """
+    Answers history queries from an in-memory ring of recent samples, backed by the database.
+
+    The ring holds the last `days` days and is loaded from the database once; after that every new
+    sample is appended with append(). Periods that fit in the ring never touch the database.
+
+    Aggregating a week of samples takes tens of milliseconds, so those aggregations run on a thread
+    instead of the event loop, and identical requests in flight at the same time share one result.
+    """
+
+    def __init__(self, storage, days=7):
+        """
+        Args:
+            storage (SensorStorage): The database for periods the ring does not cover.
+            days (int): Number of days of samples kept in memory.
+        """
+        self.storage = storage
+        self.days = days
+        self.ring = SensorRingBuffer(days * 86400)
+        since = time.time() - days * 86400
+        self.ring.load(storage.read_samples(since), since)
+        self.cache = SeriesCache(
+            lambda start, end, width, mode: self.ring.get_range_series(start, end, mode=mode, width=width))
+        self.inflight = {}
+        self.coalesced = 0
+
+    def append(self, timestamp, sensor_data):
+        """
+        Appends a new sample.
+
+        Args:
+            timestamp (int): When the sample was taken in epoch milliseconds.
+            sensor_data (SensorData): The sample.
+        """
+        self.ring.append(timestamp, sensor_data)
+
+    async def offload(self, key, func, *args):
+        """
+        Runs `func(*args)` on a thread. Callers that ask for the same `key` while it runs share its result.
+
+        Returns:
+            The result of `func`.
+        """
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def get_sensor_data_for_period(self, days):
+        """
+        Retrieves sensor data for a specified period and averages down if needed.
+
+        Args:
+            days (int): The number of days for which to retrieve data.
+
+        Returns:
+            List[dict]: A list of dictionaries representing the sensor data.
+        """
+        return wire.to_rows(await self.get_sensor_series(days))
+
+    async def get_sensor_series(self, days, mode=downsample.AVG):
+        """
+        Retrieves sensor data for a specified period as columns, downsampled if needed.
+        Periods that fit in the in-memory history are answered without touching the database,
+        incrementally from the series cache where possible.
+
+        Args:
+            days (int): The number of days for which to retrieve data.
+            mode (str): The downsampling mode, see downsample.aggregate.
+
+        Returns:
+            dict: One list per column, see SensorStorage.get_sensor_series.
+        """
+        if days > self.days:
+            return await self.storage.get_sensor_series(days, mode=mode)
+        if mode == downsample.LTTB:
+            # LTTB picks depend on the neighbouring buckets, so its buckets cannot be cached.
+            return await self.offload(('series', days, mode), self.ring.get_series, days, MAX_POINTS, mode)
+        period = days * 86400
+        _, width = bucket_width(period, MAX_POINTS)
+        return await self.cache.get(period, width, mode)
+
+    async def get_sensor_range(self, start, end, max_points=MAX_POINTS, raw=False, mode=downsample.AVG):
+        """
+        Retrieves sensor data for an arbitrary range.
+
+        Aggregated data covers the whole range in at most about `max_points` buckets, answered from
+        the in-memory history when it covers the range. Raw data is returned in pages of `max_points`
+        samples; the returned cursor is the `start` of the next page.
+
+        Args:
+            start (float): Start of the range in epoch seconds.
+            end (float): End of the range (exclusive) in epoch seconds.
+            max_points (int): The maximum number of points to return.
+            raw (bool): Whether to return raw samples instead of buckets.
+            mode (str): The downsampling mode for buckets, see downsample.aggregate.
+
+        Returns:
+            Tuple[dict, int, float]: The series, its resolution in seconds (0 for raw samples) and
+            the cursor of the next page, or None.
+        """
+        if raw:
+            series, cursor = await self.storage.get_raw_page(start, end, max_points)
+            return series, 0, cursor
+        start, end = int(start), int(end)
+        _, width = bucket_width(max(1, end - start), max_points)
+        if self.ring.covers(start):
+            series = await self.offload(('range', start, end, max_points, mode),
+                                        self.ring.get_range_series, start, end, max_points, mode)
+            return series, width, None
+        return await self.storage.get_range_series(start, end, max_points, mode), width, None
@@ -1,6 +1,8 @@
 import board
 import adafruit_pcf8574
 
+from hardware.output import PCF8574Outputs
+
 # 1 HEATER
 # 2 XTR1
 # 3 XTR2
@@ -13,7 +15,5 @@ import adafruit_pcf8574
 i2c = board.I2C()  # uses board.SCL and board.SDA
 pcf = adafruit_pcf8574.PCF8574(i2c)
 
-for i in range(8):
-    pin = pcf.get_pin(i)
-    pin.switch_to_output(value=True)
-    pin.value = False
\ No newline at end of file
+# Drive all 8 pins low in a single write.
+PCF8574Outputs(pcf).flush()
@@ -0,0 +1,227 @@
+import dataclasses
+import itertools
+import math
+import time
+
+from hardware import SensorData
+
+# Room of clients without a subscription; they get the full 'sensor_state' on every sample.
+LEGACY_ROOM = 'sensor_state'
+
+# Fields a client can set a deadband for.
+LIVE_FIELDS = tuple(f.name for f in dataclasses.fields(SensorData))
+
+# Upper limit for the update rate a client can ask for, in updates per second.
+MAX_RATE = 10.0
+
+
+def changed(old, new, deadband):
+    """
+    Checks whether a value moved by at least `deadband` since it was last sent.
+    A reading appearing or disappearing (None) always counts as a change.
+    """
+    if old is None or new is None:
+        return old is not new
+    return abs(new - old) >= deadband if deadband else new != old
+
+
+class LiveGroup:
+    """
+    The clients sharing one subscription profile, and the state they were last sent.
+    """
+
+    def __init__(self, room, interval, deadband):
+        self.room = room
+        self.interval = interval
+        self.deadband = deadband
+        self.members = set()
+        self.state = None
+        self.timestamp = None
+        self.sent_at = None
+
+    def delta(self, timestamp, values, now):
+        """
+        Returns the fields that moved past their deadband since the last update of this group and
+        records them as sent, or None if nothing is due.
+        """
+        if self.sent_at is not None and now - self.sent_at < self.interval:
+            return None
+        delta = {name: value for name, value in values.items()
+                 if changed(self.state.get(name), value, self.deadband.get(name, 0.0))}
+        if not delta:
+            return None
+        # Fields within their deadband keep their last sent value, so slow drifts still add up.
+        self.state.update(delta)
+        self.timestamp = timestamp
+        self.sent_at = now
+        return {'timestamp': timestamp, **delta}
+
+    def snapshot(self):
+        return {'timestamp': self.timestamp, **self.state}
+
+
+class LiveFeed:
+    """
+    Broadcasts live sensor data to Socket.IO clients.
+
+    Clients without a subscription get the full 'sensor_state' on every sample. A client can
+    subscribe with a maximum update rate and a deadband per field; it then gets a 'sensor_snapshot'
+    right away and afterwards 'sensor_delta' events with only the fields that moved past their
+    deadband since its last update. Clients with the same rate and deadbands share a Socket.IO room
+    and a LiveGroup, so every update is built and serialized once per profile instead of once per
+    client.
+
+    With a `room`, the feed serves the clients of one of several ovens: they are all in that room,
+    and its own rooms are prefixed with its name.
+    """
+
+    def __init__(self, sio, room=None):
+        """
+        Args:
+            sio (socketio.AsyncServer): The Socket.IO server to emit events on.
+            room (str): The room of this feed's clients, or None if it serves every client.
+        """
+        self.sio = sio
+        self.room = room
+        self.prefix = f'{room}:' if room else ''
+        self.legacy_room = self.prefix + LEGACY_ROOM
+        self.groups = {}
+        self.subscriptions = {}
+        self.latest = None
+        self.latest_stats = None
+        self._rooms = itertools.count()
+
+    @staticmethod
+    def profile(options):
+        """
+        Validates subscription options {"max_rate": updates per second, "deadband": {field: delta}}.
+
+        Returns:
+            Tuple[float, tuple]: The minimum interval between updates and the sorted deadbands.
+
+        Raises:
+            ValueError: If the options are invalid.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        max_rate = options.get('max_rate')
+        interval = 0.0
+        if max_rate is not None:
+            max_rate = float(max_rate)
+            if not 0 < max_rate <= MAX_RATE:
+                raise ValueError(f"expected 0 < max_rate <= {MAX_RATE}")
+            interval = 1.0 / max_rate
+        deadband = options.get('deadband') or {}
+        if not isinstance(deadband, dict):
+            raise ValueError("deadband must map fields to values")
+        for name, value in deadband.items():
+            if name not in LIVE_FIELDS:
+                raise ValueError(f"unknown field {name}")
+            if not math.isfinite(float(value)) or float(value) < 0:
+                raise ValueError(f"deadband of {name} must be a non-negative number")
+        return interval, tuple(sorted((name, float(value)) for name, value in deadband.items() if float(value)))
+
+    async def connect(self, sid):
+        """
+        Adds a new client to the legacy room and sends it the latest sample.
+        """
+        if self.room:
+            await self.sio.enter_room(sid, self.room)
+        await self.sio.enter_room(sid, self.legacy_room)
+        if self.latest is not None:
+            await self.sio.emit('sensor_state', self.state(self.latest[1]), to=sid)
+
+    async def disconnect(self, sid):
+        """
+        Forgets a client's subscription.
+        """
+        self._leave(sid)
+
+    async def subscribe(self, sid, options):
+        """
+        Subscribes a client to deltas with the given options, replacing an earlier subscription,
+        and sends it a full snapshot.
+
+        Raises:
+            ValueError: If the options are invalid.
+        """
+        key = self.profile(options)
+        await self.sio.leave_room(sid, self.legacy_room)
+        old = self._leave(sid)
+        if old is not None:
+            await self.sio.leave_room(sid, old.room)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = LiveGroup(f'{self.prefix}live:{next(self._rooms)}', key[0], dict(key[1]))
+            if self.latest is not None:
+                group.state = self.latest[1].to_dict()
+                group.timestamp = self.latest[0]
+                group.sent_at = time.monotonic()
+        group.members.add(sid)
+        self.subscriptions[sid] = key
+        await self.sio.enter_room(sid, group.room)
+        if group.state is not None:
+            # The group's last sent state, not the latest sample, so the next delta applies to it.
+            await self.sio.emit('sensor_snapshot', group.snapshot(), to=sid)
+
+    async def unsubscribe(self, sid):
+        """
+        Moves a client back to the full 'sensor_state' broadcast.
+        """
+        old = self._leave(sid)
+        if old is not None:
+            await self.sio.leave_room(sid, old.room)
+        await self.sio.enter_room(sid, self.legacy_room)
+
+    def _leave(self, sid):
+        key = self.subscriptions.pop(sid, None)
+        group = self.groups.get(key)
+        if group is None:
+            return None
+        group.members.discard(sid)
+        if not group.members:
+            del self.groups[key]
+        return group
+
+    def state(self, sensor_data):
+        """
+        Returns:
+            dict: The 'sensor_state' payload: the sample's fields, plus the rolling statistics
+            published with the latest sample under 'stats' if there are any.
+        """
+        values = sensor_data.to_dict()
+        if self.latest_stats is not None:
+            values['stats'] = self.latest_stats
+        return values
+
+    async def publish(self, timestamp, sensor_data, stats=None):
+        """
+        Sends a sample to every room it is due for.
+
+        Args:
+            timestamp (int): When the sample was taken in epoch milliseconds.
+            sensor_data (SensorData): The sample.
+            stats (dict): Rolling statistics per field, see SensorStatistics.summary.
+        """
+        self.latest = (timestamp, sensor_data)
+        self.latest_stats = stats
+        values = sensor_data.to_dict()
+        await self.sio.emit('sensor_state', self.state(sensor_data), room=self.legacy_room)
+        now = time.monotonic()
+        for group in list(self.groups.values()):
+            if group.state is None:
+                group.state = dict(values)
+                group.timestamp = timestamp
+                group.sent_at = now
+                await self.sio.emit('sensor_snapshot', group.snapshot(), room=group.room)
+                continue
+            delta = group.delta(timestamp, values, now)
+            if delta is not None:
+                await self.sio.emit('sensor_delta', delta, room=group.room)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Number of subscription profiles and subscribed clients.
+        """
+        return {'profiles': len(self.groups), 'subscribers': len(self.subscriptions)}
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+import aiohttp
+import socketio
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0..100) of a list of values, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def parse_metrics(text):
+    """
+    Parses the Prometheus text format into {(name, labels): value}, labels as a sorted tuple of pairs.
+    """
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        pairs = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or '')))
+        samples[(name, pairs)] = float(value)
+    return samples
+
+
+def histogram_quantile(before, after, name, q, **labels):
+    """
+    Estimates the q-quantile (0..1) of a histogram over the interval between two scrapes, as the
+    upper bound of the bucket it falls in, like Prometheus' histogram_quantile without interpolation.
+    """
+    buckets = []
+    for (metric, pairs), value in after.items():
+        if metric != f'{name}_bucket':
+            continue
+        pair_dict = dict(pairs)
+        if any(pair_dict.get(key) != str(val) for key, val in labels.items()):
+            continue
+        le = float(pair_dict['le'])
+        buckets.append((le, value - before.get((metric, pairs), 0.0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = q * buckets[-1][1]
+    for le, count in buckets:
+        if count >= target:
+            return le
+    return buckets[-1][0]
+
+
+def counter_delta(before, after, name, **labels):
+    total = 0.0
+    for (metric, pairs), value in after.items():
+        if metric == name and all(dict(pairs).get(key) == str(val) for key, val in labels.items()):
+            total += value - before.get((metric, pairs), 0.0)
+    return total
+
+
+class DashboardClient:
+    """
+    A simulated dashboard: either receives the full sensor_state broadcast or subscribes to deltas,
+    and now and then asks for history or the task status.
+    """
+
+    def __init__(self, url, stats, subscribe, history_interval, status_interval):
+        self.url = url
+        self.stats = stats
+        self.subscribe = subscribe
+        self.history_interval = history_interval
+        self.status_interval = status_interval
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.pending = {}
+        self.sio.on('sensor_state', self.on_state)
+        self.sio.on('sensor_snapshot', self.on_update)
+        self.sio.on('sensor_delta', self.on_update)
+        for event in ('sensor_data_24h', 'sensor_data_7d', 'task_status'):
+            self.sio.on(event, self._on_response(event))
+
+    async def on_state(self, data):
+        self.stats['broadcasts'] += 1
+
+    async def on_update(self, data):
+        self.stats['broadcasts'] += 1
+        if data.get('timestamp'):
+            self.stats['fanout'].append(time.time() - data['timestamp'] / 1000)
+
+    def _on_response(self, event):
+        async def handler(*data):
+            sent = self.pending.pop(event, None)
+            if sent is not None:
+                self.stats['responses'].setdefault(event, []).append(time.perf_counter() - sent)
+        return handler
+
+    async def request(self, event, response):
+        self.pending[response] = time.perf_counter()
+        await self.sio.emit(event, {})
+
+    async def run(self):
+        await self.sio.connect(self.url, transports=['websocket'])
+        self.stats['connected'] += 1
+        try:
+            if self.subscribe:
+                await self.sio.emit('subscribe_sensor_state', {'deadband': {'temperature': random.choice([0, 0.1, 0.5])}})
+            await asyncio.gather(self.history_loop(), self.status_loop())
+        finally:
+            await self.sio.disconnect()
+
+    async def history_loop(self):
+        while True:
+            await asyncio.sleep(random.expovariate(1 / self.history_interval))
+            await self.request(*random.choice([('get_sensors_24h', 'sensor_data_24h'),
+                                               ('get_sensors_7d', 'sensor_data_7d')]))
+
+    async def status_loop(self):
+        while True:
+            await asyncio.sleep(random.expovariate(1 / self.status_interval))
+            await self.request('get_task_status', 'task_status')
+
+
+async def scrape(session, url):
+    async with session.get(f'{url}/metrics') as response:
+        return parse_metrics(await response.text())
+
+
+def ms(value):
+    return '-' if value is None else f'{value * 1000:.1f}'
+
+
+async def run_step(url, session, clients, args, tasks):
+    """
+    Grows the client population to `clients`, holds it for the step duration and returns the report row.
+    """
+    stats = {'connected': 0, 'broadcasts': 0, 'fanout': [], 'responses': {}}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+    for i in range(clients):
+        client = DashboardClient(url, stats, random.random() < args.subscribe_ratio,
+                                 args.history_interval, args.status_interval)
+        tasks.append(asyncio.create_task(client.run()))
+    await asyncio.sleep(args.warmup)
+    stats['fanout'].clear()
+    stats['responses'].clear()
+    stats['broadcasts'] = 0
+    before = await scrape(session, url)
+    await asyncio.sleep(args.duration)
+    after = await scrape(session, url)
+    history = stats['responses'].get('sensor_data_7d', []) + stats['responses'].get('sensor_data_24h', [])
+    return {
+        'clients': clients,
+        'connected': stats['connected'],
+        'broadcasts/s': f"{stats['broadcasts'] / args.duration:.0f}",
+        'fanout p50': ms(percentile(stats['fanout'], 50)),
+        'fanout p95': ms(percentile(stats['fanout'], 95)),
+        'fanout p99': ms(percentile(stats['fanout'], 99)),
+        'history p95': ms(percentile(history, 95)),
+        'status p95': ms(percentile(stats['responses'].get('task_status', []), 95)),
+        'loop lag p99': ms(histogram_quantile(before, after, 'oven_event_loop_lag_seconds', 0.99)),
+        'control jitter p99': ms(histogram_quantile(before, after, 'oven_task_lateness_seconds', 0.99, task='Sampling')),
+        'overruns': f"{counter_delta(before, after, 'oven_task_overruns_total'):.0f}",
+        'dropped': f"{counter_delta(before, after, 'oven_queue_dropped_total', queue='Broadcast'):.0f}",
+    }
+
+
+async def wait_for_server(session, url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f'{url}/metrics') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+        await asyncio.sleep(0.5)
+
+
+async def run(args):
+    server = None
+    if args.spawn:
+        env = dict(os.environ, OVEN_HARDWARE='sim')
+        server_log = open(os.path.join(args.spawn_dir, 'loadtest-server.log'), 'w')
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.py')],
+                                  env=env, cwd=args.spawn_dir, stdout=server_log, stderr=subprocess.STDOUT)
+    tasks = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session, args.url)
+            async with socketio.AsyncSimpleClient() as starter:
+                # A running task keeps the control path busy during the test.
+                await starter.connect(args.url, transports=['websocket'])
+                await starter.emit('start_task', {'temp_low': 30, 'temp_high': 40, 'never_ending': True})
+            rows = []
+            for clients in (int(n) for n in args.clients.split(',')):
+                rows.append(await run_step(args.url, session, clients, args, tasks))
+                print('  '.join(f'{key}={value}' for key, value in rows[-1].items()), flush=True)
+        return rows
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if server is not None:
+            server.terminate()
+            server.wait()
+            server_log.close()
+
+
+def report(rows):
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row[column]).rjust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    """
+    Load-tests the Socket.IO server with a growing number of simulated dashboards and reports
+    broadcast latency, history response times, event loop lag and control tick jitter per step.
+    Latencies are in milliseconds. Broadcast latency is measured on the delta subscribers from the
+    sample timestamp, so it includes the sensor read; loop lag and jitter come from /metrics.
+    """
+    parser = argparse.ArgumentParser(description="Load-test the Socket.IO server with simulated dashboards.")
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--spawn', action='store_true',
+                        help="start api.py on simulated hardware (OVEN_HARDWARE=sim) for the test")
+    parser.add_argument('--spawn-dir', default='.',
+                        help="working directory of the spawned server, where its database and log go")
+    parser.add_argument('--clients', default='1,10,50,100,200', help="comma separated client counts, one step each")
+    parser.add_argument('--duration', type=float, default=30.0, help="measured seconds per step")
+    parser.add_argument('--warmup', type=float, default=5.0, help="seconds between connecting and measuring")
+    parser.add_argument('--subscribe-ratio', type=float, default=0.5,
+                        help="share of clients subscribing to deltas instead of the full broadcast")
+    parser.add_argument('--history-interval', type=float, default=30.0, help="mean seconds between history requests per client")
+    parser.add_argument('--status-interval', type=float, default=10.0, help="mean seconds between task status requests per client")
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,71 @@ import asyncio
 import datetime
 import json
 import logging
-import board
-import adafruit_pcf8574
-from flask_socketio import SocketIO
+import time
 from pydantic import BaseModel, Field
+import downsample
 import hardware
-import sqlite3
+import metrics
+from history import SensorHistory
+from livefeed import LiveFeed
+from pipeline import QueueConsumer, SamplePipeline
+from rollingstats import SensorStatistics
+from scheduler import DeadlineTimers, FixedRateTask
+from storage import LEGACY_OVEN, MAX_POINTS, SensorStorage
 
-i2c = board.I2C()
-pcf = adafruit_pcf8574.PCF8574(i2c)
+
+# Fastest rise of any temperature, in degrees per minute, before a task is stopped as a runaway.
+MAX_TEMPERATURE_RISE = 10.0
+
+# Fields whose rate of change is checked against MAX_TEMPERATURE_RISE.
+RISE_FIELDS = ('temperature', 'ow1', 'ow2', 'ow3', 'ow4', 'ow5')
+
+# Fields the safety checks depend on; a sample without one of them is never treated as within limits.
+SAFETY_FIELDS = ('temperature', 'humidity', 'ow3')
+
+# Consecutive samples with a missing safety reading before a running task is stopped.
+MAX_MISSED_READINGS = 5
+
+
+def exceeds(value, limit):
+    """
+    Checks a sensor value against a limit, treating a missing reading (None) as within limits.
+    Safety checks must handle missing readings first, see missing_readings.
+    """
+    return value is not None and value > limit
+
+
+def missing_readings(sensor_data):
+    """
+    Returns:
+        List[str]: The SAFETY_FIELDS the sample has no reading for.
+    """
+    return [field for field in SAFETY_FIELDS if getattr(sensor_data, field) is None]
+
+
+def cooler_phase(cooling, since, on_minutes, off_minutes, now):
+    """
+    Works out where a cooler cycle is at `now`, given that it entered its current phase at `since`.
+
+    Args:
+        cooling (bool): Whether the cycle was in its cooling phase.
+        since (datetime.datetime): When that phase started.
+        on_minutes (int): Length of the cooling phase.
+        off_minutes (int): Length of the phase without cooling.
+        now (datetime.datetime): The time to advance the cycle to.
+
+    Returns:
+        Tuple[bool, datetime.datetime]: The phase at `now` and when it started.
+    """
+    durations = {True: datetime.timedelta(minutes=on_minutes), False: datetime.timedelta(minutes=off_minutes)}
+    period = durations[True] + durations[False]
+    if not period or since + durations[cooling] >= now:
+        return cooling, since
+    since += (now - since) // period * period
+    while since + durations[cooling] < now:
+        since += durations[cooling]
+        cooling = not cooling
+    return cooling, since
 
 
 class Task(BaseModel):
@@ -44,77 +100,201 @@ class Task(BaseModel):
 class Logic:
     """
     Manages the logic for reading sensor data, managing tasks, and controlling hardware.
+
+    The current task and the cooler cycle are checkpointed to the database on every transition and
+    restored on startup, so after a restart control picks up where it left off on the first tick.
+
+    Cooler phase changes and the end of the task are timers at their due time, see DeadlineTimers,
+    rather than checks on every control tick. They switch the outputs as soon as they fire, using
+    the latest sample, without waiting for the next sensor read. Every control tick re-arms them if
+    the system clock was stepped since they were set.
+
+    Safety checks act on samples passed through SensorStatistics, so a single spike does not stop a
+    task, while a real step reaches them two samples late. They also stop it when a temperature
+    rises faster than `max_temperature_rise`. A sample without a temperature, humidity or ow3
+    reading switches the heater off, and after `max_missed_readings` such samples in a row the task
+    is stopped.
+
+    Samples reach the database through the "Storage" pipeline queue and the write-behind buffer of
+    SensorStorage. A crash loses what is in both: up to `store_queue_size` queued samples, which only
+    pile up while the event loop falls behind, plus the pending samples, normally fewer than
+    `store_batch_size` and never older than `store_flush_interval` seconds, or up to
+    `store_max_pending` while flushes keep failing. At 1 Hz the defaults lose at most 30 seconds in
+    normal operation and at worst 600 + 3600 samples, i.e. 70 minutes.
+
+    One Logic controls one oven. With an `oven_id` it is one of several ovens run by an OvenManager,
+    which reads the sensors of all ovens at once and hands every Logic its samples through
+    publish_sample(); its data is stored under its oven id and its events go to its Socket.IO room.
     """
 
-    def __init__(self, sio: SocketIO, db_path="data2.db"):
+    def __init__(self, sio, db_path="data2.db", history_days=7,
+                 sample_period=1.0, watchdog_period=1.0, store_period=1.0, max_sample_age=15.0, pcf=None,
+                 max_temperature_rise=MAX_TEMPERATURE_RISE, max_missed_readings=MAX_MISSED_READINGS,
+                 store_batch_size=30, store_flush_interval=30.0, store_max_pending=3600, store_queue_size=600,
+                 oven_id=None,
+                 shared_storage=None):
+        """
+        Args:
+            sio (socketio.AsyncServer): The Socket.IO server to emit events on.
+            db_path (str): Path of the SQLite database file.
+            history_days (int): Number of days of samples kept in memory, about 5.5 MB per day.
+            sample_period (float): Seconds between sensor reads, unused with an `oven_id`.
+            watchdog_period (float): Seconds between checks for a stale sample or a stepped clock.
+            store_period (float): Seconds between checks whether the storage is due for a flush.
+            max_sample_age (float): Seconds after which the latest sample is too old to control on.
+            pcf (adafruit_pcf8574.PCF8574): The output port expander, opened on the default I2C bus
+                if None. Pass hardware.sim.Simulator().pcf to run on simulated hardware.
+            max_temperature_rise (float): Degrees per minute at which a running task is stopped.
+            max_missed_readings (int): Consecutive samples without a safety reading at which a
+                running task is stopped.
+            store_batch_size (int): Number of pending samples that triggers a flush, see SensorStorage.
+            store_flush_interval (float): Age in seconds of the oldest pending sample that triggers a flush.
+            store_max_pending (int): Maximum number of samples the storage keeps while flushes keep failing.
+            store_queue_size (int): Maximum number of samples queued for the storage stage.
+            oven_id (int): The oven among those of an OvenManager, or None for a single oven that
+                reads its own sensors and registers its own metrics.
+            shared_storage (SensorStorage): Another oven's storage whose database connections to share.
+        """
         self.sio = sio
+        self.oven_id = oven_id
+        self.live = LiveFeed(sio, None if oven_id is None else f'oven:{oven_id}')
+        self.sample_period = sample_period
+        self.watchdog_period = watchdog_period
+        self.store_period = store_period
+        self.max_sample_age = max_sample_age
+        self.max_temperature_rise = max_temperature_rise
+        self.max_missed_readings = max_missed_readings
+        self.missed_readings = 0
+        self.stats = SensorStatistics()
+        self.tasks = []
+        self.latest_sample = None
+        self.latest_sample_time = None
+        self.pipeline = SamplePipeline(self.on_sample)
+        self.broadcast_queue = self.pipeline.add_consumer(
+            QueueConsumer("Broadcast", lambda sample: self.emit_sensor_data(sample[1], sample[0]), maxsize=1, log_drops=False))
+        self.store_queue = self.pipeline.add_consumer(
+            QueueConsumer("Storage", lambda sample: self.store_sensor_data(sample[1], sample[0]),
+                          maxsize=store_queue_size))
         self.current_task: Task = None
         self.cooler_cycle_status = False
         self.cooler_off_start_time = None
         self.cooler_on_start_time = None
-        self.connection = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        self.connection.row_factory = sqlite3.Row
-        self.initialize_db()
-
-    def initialize_db(self):
-        """
-        Initializes the database by creating necessary tables if they do not already exist.
-        """
-        with self.connection as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS SensorData (
-                    timestamp DATETIME PRIMARY KEY,
-                    temperature REAL,
-                    humidity REAL,
-                    ow1 REAL,
-                    ow2 REAL,
-                    ow3 REAL,
-                    ow4 REAL,
-                    ow5 REAL
-                );
-            """)
-            conn.commit()
-
-    def get_sensor_data_for_period(self, days):
-        """
-        Retrieves sensor data for a specified period and averages down if needed.
+        self.timers = DeadlineTimers()
+        self.outputs = hardware.PCF8574Outputs(pcf if pcf is not None else hardware.open_pcf8574())
+        self.storage = SensorStorage(db_path, batch_size=store_batch_size, flush_interval=store_flush_interval,
+                                     max_pending=store_max_pending,
+                                     oven_id=LEGACY_OVEN if oven_id is None else oven_id, shared=shared_storage)
+        self.history = SensorHistory(self.storage, history_days)
+        self.checkpointed = None
+        self.restore()
+        if oven_id is None:
+            self.register_metrics()
+
+    def checkpoint(self):
+        """
+        Saves the current task and cooler cycle if they changed since the last checkpoint.
+        """
+        state = {
+            'task': self.get_current_task(),
+            'cooler_cycle_status': self.cooler_cycle_status,
+            'cooler_on_start_time': self.cooler_on_start_time and self.cooler_on_start_time.isoformat(),
+            'cooler_off_start_time': self.cooler_off_start_time and self.cooler_off_start_time.isoformat(),
+        }
+        if state == self.checkpointed:
+            return
+        try:
+            self.storage.save_control_state(state)
+            self.checkpointed = state
+        except Exception as e:
+            logging.error(f"Error checkpointing control state: {e}")
 
-        Args:
-            days (int): The number of days for which to retrieve data.
+    def restore(self):
+        """
+        Resumes the task of the last checkpoint, with the cooler cycle advanced by the time the
+        process was down. Its timers are set once the logic loop runs, see set_timers; an expired task
+        is finished right then.
+        """
+        state = self.storage.load_control_state()
+        self.checkpointed = state
+        if not state or not state['task']:
+            return
+        try:
+            task = Task(**state['task'])
+        except Exception as e:
+            logging.error(f"Not restoring invalid checkpointed task: {e}")
+            return
+        self.current_task = task
+        times = {key: state[key] and datetime.datetime.fromisoformat(state[key])
+                 for key in ('cooler_on_start_time', 'cooler_off_start_time')}
+        self.cooler_on_start_time = times['cooler_on_start_time']
+        self.cooler_off_start_time = times['cooler_off_start_time']
+        self.cooler_cycle_status = state['cooler_cycle_status']
+        since = self.cooler_on_start_time if self.cooler_cycle_status else self.cooler_off_start_time
+        if since:
+            self.cooler_cycle_status, since = cooler_phase(
+                self.cooler_cycle_status, since, task.cooler_on, task.cooler_off, datetime.datetime.utcnow())
+            if self.cooler_cycle_status:
+                self.cooler_on_start_time = since
+            else:
+                self.cooler_off_start_time = since
+        logging.info(f"Restored task {task}, cooler {'on' if self.cooler_cycle_status else 'off'} since {since}")
+
+    def register_metrics(self):
+        """
+        Exposes queue depths and the counters of the pipeline, tasks, storage and caches on /metrics.
+        They are read only when /metrics is scraped.
+        """
+        for metric in self.gauges():
+            metrics.REGISTRY.register(metric)
 
+    def gauges(self):
+        """
         Returns:
-            List[dict]: A list of dictionaries representing the sensor data.
-        """
-        with self.connection as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) FROM SensorData
-                WHERE timestamp >= datetime('now', ?)
-            """, ('-' + str(days) + ' day',))
-            count = cursor.fetchone()[0]
-            step = max(1, count // 1000)
-            cursor.execute("""
-                SELECT
-                    MIN(timestamp) as timestamp,
-                    AVG(temperature) as temperature,
-                    AVG(humidity)  as humidity,
-                    AVG(ow1) as ow1,
-                    AVG(ow2) as ow2,
-                    AVG(ow3) as ow3,
-                    AVG(ow4) as ow4,
-                    AVG(ow5) as ow5,
-                    COUNT(*) as count
-                FROM (
-                    SELECT *,
-                        ROW_NUMBER() OVER (ORDER BY timestamp) as rownum
-                    FROM SensorData
-                    WHERE timestamp >= datetime('now', ?)
-                )
-                WHERE rownum % ? = 0
-                GROUP BY (rownum - 1) / ?
-            """, ('-' + str(days) + ' day', step, step))
-            return [dict(row) for row in cursor.fetchall()]
+            List[metrics.Gauge]: The gauges register_metrics() exposes, see OvenManager.register_metrics.
+        """
+        consumers = self.pipeline.consumers
+        return [
+            metrics.Gauge('oven_queue_depth', 'Samples waiting in a pipeline queue.',
+                          lambda: {(c.name,): c.queue.qsize() for c in consumers}, ('queue',)),
+            metrics.Gauge('oven_queue_dropped_total', 'Samples dropped from a full pipeline queue.',
+                          lambda: {(c.name,): c.dropped for c in consumers}, ('queue',), kind='counter'),
+            metrics.Gauge('oven_task_overruns_total', 'Fixed-rate task runs that overran their period.',
+                          lambda: {(t.name,): t.overruns for t in self.tasks}, ('task',), kind='counter'),
+            metrics.Gauge('oven_task_missed_ticks_total', 'Fixed-rate task ticks skipped after an overrun.',
+                          lambda: {(t.name,): t.missed_ticks for t in self.tasks}, ('task',), kind='counter'),
+            metrics.Gauge('oven_storage_pending', 'Samples waiting in the write-behind buffer.',
+                          lambda: len(self.storage.pending)),
+            metrics.Gauge('oven_storage_pruned_rows_total', 'Raw samples and rollup buckets deleted by retention.',
+                          lambda: self.storage.pruned, kind='counter'),
+            metrics.Gauge('oven_db_reads_coalesced_total', 'History reads answered by an identical read in flight.',
+                          lambda: self.storage.readers.coalesced, kind='counter'),
+            metrics.Gauge('oven_series_cache_requests_total', 'Series cache lookups.',
+                          lambda: {('hit',): self.history.cache.hits, ('miss',): self.history.cache.misses},
+                          ('result',), kind='counter'),
+            metrics.Gauge('oven_history_coalesced_total', 'In-memory history aggregations shared by identical requests.',
+                          lambda: self.history.cache.coalesced + self.history.coalesced, kind='counter'),
+            metrics.Gauge('oven_i2c_writes_total', 'PCF8574 port writes.', lambda: self.outputs.writes, kind='counter'),
+            metrics.Gauge('oven_live_subscribers', 'Clients subscribed to sensor deltas.',
+                          lambda: len(self.live.subscriptions)),
+        ]
+
+    async def get_sensor_data_for_period(self, days):
+        """
+        Retrieves sensor data for a specified period and averages down if needed, see SensorHistory.
+        """
+        return await self.history.get_sensor_data_for_period(days)
+
+    async def get_sensor_series(self, days, mode=downsample.AVG):
+        """
+        Retrieves sensor data for a specified period as columns, see SensorHistory.
+        """
+        return await self.history.get_sensor_series(days, mode)
+
+    async def get_sensor_range(self, start, end, max_points=MAX_POINTS, raw=False, mode=downsample.AVG):
+        """
+        Retrieves sensor data for an arbitrary range, see SensorHistory.
+        """
+        return await self.history.get_sensor_range(start, end, max_points, raw, mode)
 
     def start(self, task_data):
         """
@@ -135,6 +315,8 @@ class Logic:
         except Exception as e:
             logging.error(f"Error starting task: {e}")
             raise ValueError(f"Invalid task data: {e}")
+        self.checkpoint()
+        self.set_timers()
 
     def stop(self):
         """
@@ -145,6 +327,8 @@ class Logic:
         self.cooler_cycle_status = False
         self.cooler_off_start_time = None
         self.cooler_on_start_time = None
+        self.timers.cancel_all()
+        self.checkpoint()
         self.control_hardware(False, False, False)
 
     def get_current_task(self):
@@ -167,9 +351,7 @@ class Logic:
             cooler (bool): State of the cooler.
             fan (bool): State of the fan.
         """
-        self.set_hardware_state(1, heater)
-        self.set_hardware_state(6, cooler)
-        self.set_hardware_state(5, fan)
+        self.outputs.set({hardware.HEATER: heater, hardware.COOLER: cooler, hardware.FAN: fan})
 
     def set_hardware_state(self, pin_number, state):
         """
@@ -179,62 +361,90 @@ class Logic:
             pin_number (int): The pin number of the hardware.
             state (bool): The desired state of the pin.
         """
-        pin = pcf.get_pin(pin_number)
-        pin.switch_to_output(value=True)
-        pin.value = state
+        self.outputs.set({pin_number: state})
 
-    async def emit_sensor_data(self, sensor_data):
+    async def emit_sensor_data(self, sensor_data, timestamp=None):
         """
-        Emits the sensor data via Socket.IO.
+        Emits the sensor data via Socket.IO to every client according to its subscription, see LiveFeed.
 
         Args:
             sensor_data (SensorData): The sensor data to emit.
+            timestamp (int): When the sample was taken in epoch milliseconds, defaults to now.
         """
-        await self.sio.emit('sensor_state', sensor_data.to_dict())
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        await self.live.publish(timestamp, sensor_data, self.stats.summary())
 
-    def store_sensor_data(self, sensor_data):
+    def store_sensor_data(self, sensor_data, timestamp=None):
         """
-        Stores the sensor data in the database.
+        Queues the sensor data for the write-behind storage and appends it to the in-memory history.
 
         Args:
             sensor_data (SensorData): The sensor data to store.
+            timestamp (int): When the sample was taken in epoch milliseconds, defaults to now.
+        """
+        timestamp = self.storage.add(sensor_data, timestamp)
+        self.history.append(timestamp, sensor_data)
+
+    def close(self):
+        """
+        Stores samples still queued in the pipeline, flushes pending sensor data to the database and closes it.
+        """
+        for timestamp, sensor_data in self.store_queue.take_pending():
+            self.store_sensor_data(sensor_data, timestamp)
+        self.storage.close()
+
+    def set_timers(self):
+        """
+        Sets the timers for the end of the current task and the end of the current cooler phase.
+        Does nothing outside the event loop, e.g. when restoring in __init__; logic_loop sets them then.
         """
         try:
-            with self.connection as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO SensorData (timestamp, temperature, humidity, ow1, ow2, ow3, ow4, ow5) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        datetime.datetime.now(),
-                        sensor_data.temperature,
-                        sensor_data.humidity,
-                        sensor_data.ow1,
-                        sensor_data.ow2,
-                        sensor_data.ow3,
-                        sensor_data.ow4,
-                        sensor_data.ow5,
-                    )
-                )
-                conn.commit()
-                logging.info("Sensor data stored successfully")
-        except Exception as e:
-            logging.error(f"Error storing sensor data: {e}")
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.timers.cancel_all()
+        if not self.current_task:
+            return
+        if not self.current_task.never_ending:
+            self.timers.set("Task expiry", self.current_task.end_time(), self.handle_expired_task)
+        self.set_cooler_timer()
 
-    def is_task_expired(self):
+    def set_cooler_timer(self):
+        """
+        Sets the timer for the end of the current cooler phase. A cooling phase of 0 minutes disables
+        the cooler cycle.
         """
-        Checks if the current task has expired.
+        if self.cooler_cycle_status:
+            self.timers.set("Cooler cycle", self.cooler_on_start_time + datetime.timedelta(
+                minutes=self.current_task.cooler_on), self.switch_cooler_cycle)
+        elif self.cooler_off_start_time and self.current_task.cooler_on:
+            self.timers.set("Cooler cycle", self.cooler_off_start_time + datetime.timedelta(
+                minutes=self.current_task.cooler_off), self.switch_cooler_cycle)
 
-        Returns:
-            bool: True if the task has expired, otherwise False.
+    def switch_cooler_cycle(self):
+        """
+        Ends the current cooler phase when its timer fires, and sets the outputs for the next phase
+        right away if the latest sample is recent enough to control on.
         """
-        return not self.current_task.never_ending and datetime.datetime.utcnow() >= self.current_task.end_time()
+        now = datetime.datetime.utcnow()
+        self.cooler_cycle_status = not self.cooler_cycle_status
+        if self.cooler_cycle_status:
+            self.cooler_on_start_time = now
+        else:
+            self.cooler_off_start_time = now
+        self.checkpoint()
+        self.set_cooler_timer()
+        if self.latest_sample is not None and time.monotonic() - self.latest_sample_time <= self.max_sample_age:
+            self.manage_cooler_cycle(self.latest_sample)
 
     async def handle_expired_task(self):
         """
-        Handles an expired task by stopping it and sending a notification.
+        Handles an expired task by stopping it and sending a notification. Runs when the task's
+        expiry timer fires.
         """
         logging.info("Task has expired")
-        await self.sio.emit("task_done", {"message": "Task has finished."})
+        await self.sio.emit("task_done", {"message": "Task has finished."}, room=self.live.room)
         self.stop()
 
     def manage_cooler_cycle(self, sensor_data):
@@ -256,17 +466,12 @@ class Logic:
         Args:
             sensor_data (SensorData): The current sensor data.
         """
-        heater = sensor_data.temperature < self.current_task.temp_low
-        if sensor_data.temperature > self.current_task.temp_high:
+        # Without an AM2315 or ow3 reading the heater stays off.
+        heater = not missing_readings(sensor_data) and sensor_data.temperature < self.current_task.temp_low
+        if exceeds(sensor_data.temperature, self.current_task.temp_high):
             heater = False
         fan = True
         cooler = False
-
-        if self.cooler_off_start_time and (self.cooler_off_start_time + datetime.timedelta(
-                minutes=self.current_task.cooler_off)) < datetime.datetime.utcnow():
-            self.cooler_cycle_status = True
-            self.cooler_on_start_time = datetime.datetime.utcnow()
-
         self.control_hardware(heater, cooler, fan)
 
     def handle_cooling_on_state(self):
@@ -276,64 +481,160 @@ class Logic:
         heater = False
         fan = False
         cooler = True
-
-        if self.cooler_on_start_time and (self.cooler_on_start_time + datetime.timedelta(
-                minutes=self.current_task.cooler_on)) < datetime.datetime.utcnow():
-            self.cooler_cycle_status = False
-            self.cooler_off_start_time = datetime.datetime.utcnow()
-
         self.control_hardware(heater, cooler, fan)
 
     async def logic_loop(self):
         """
-        The main logic loop that continuously fetches sensor data, processes it, and controls hardware.
-        If the loop takes longer than the set timeout, the iteration is skipped.
+        The main logic loop. Sensor sampling, the watchdog and storage flushes each run as a
+        fixed-rate task with its own period, see FixedRateTask, next to the pipeline consumers.
+        Control decisions are made once per sample, by the control stage of the pipeline.
+        A sampling run that takes longer than the set timeout is skipped. Timers of a task restored
+        from the checkpoint are set here. An oven of an OvenManager gets its samples and the loop lag
+        monitor from the manager.
+        """
+        self.set_timers()
+        self.tasks = [
+            FixedRateTask("Watchdog", self.watchdog_period, self.watchdog_iteration),
+            FixedRateTask("Persistence", self.store_period, self.store_iteration),
+        ]
+        background = [self.pipeline.run(), self.migrate_storage(), self.prune_storage()]
+        if self.oven_id is None:
+            self.tasks.insert(0, FixedRateTask("Sampling", self.sample_period, self.sample_iteration, timeout=15.0))
+            background.append(metrics.monitor_loop_lag())
+        await asyncio.gather(*background, *(task.run() for task in self.tasks))
+
+    async def migrate_storage(self):
+        """
+        Migrates a legacy database in small chunks, yielding to the event loop between chunks
+        so sampling and control continue during the migration.
+        """
+        while self.storage.migrate_step():
+            await asyncio.sleep(0.1)
+
+    async def prune_storage(self, interval=3600):
+        """
+        Applies the storage retention every `interval` seconds, in small steps with pauses in between
+        so sampling and control continue, see SensorStorage.prune_step.
         """
         while True:
             try:
-                await asyncio.wait_for(self.logic_iteration(), timeout=15.0)
-            except asyncio.TimeoutError:
-                logging.error("Iteration timed out, skipping to the next iteration")
-            await asyncio.sleep(1)
+                while await self.storage.prune_step():
+                    await asyncio.sleep(0.1)
+            except Exception as e:
+                logging.exception(f"Pruning sensor data failed: {e}")
+            await asyncio.sleep(interval)
 
     async def logic_iteration(self):
         """
-        Performs a single iteration of the main logic.
-        Fetches sensor data, emits it, stores it, performs safety checks, and manages the current task.
+        Performs a single iteration of the main logic: sampling, control, broadcast and storage in sequence.
+        """
+        await self.sample_iteration()
+        await self.pipeline.drain()
+        await self.store_iteration()
+
+    async def sample_iteration(self):
+        """
+        Fetches sensor data and publishes it, see publish_sample.
         """
-        logging.info("Starting logic iteration")
-        sensor_data = hardware.get_sensor_data()
-        logging.info(f"Fetched sensor data: {sensor_data}")
+        logging.debug("Starting sample iteration")
+        timestamp = int(time.time() * 1000)
+        with metrics.STAGE_SECONDS.time('Acquire'):
+            sensor_data = await hardware.get_sensor_data_async()
+        await self.publish_sample(timestamp, sensor_data)
+
+    async def publish_sample(self, timestamp, sensor_data):
+        """
+        Publishes a sample to the pipeline. Samples with extreme values are discarded.
+
+        Args:
+            timestamp (int): When the sample was taken in epoch milliseconds.
+            sensor_data (SensorData): The sample.
+        """
+        logging.debug(f"Fetched sensor data: {sensor_data}")
 
         # Safety checks for extreme values
-        if sensor_data.temperature > 200 or sensor_data.humidity > 101:
+        if exceeds(sensor_data.temperature, 200) or exceeds(sensor_data.humidity, 101):
             logging.error("Extreme sensor values detected, not emitting or storing data")
             return
 
-        await self.emit_sensor_data(sensor_data)
-        logging.info("Emitted sensor data")
+        await self.pipeline.publish((timestamp, sensor_data))
 
-        self.store_sensor_data(sensor_data)
-        logging.info("Stored sensor data")
+    async def on_sample(self, sample):
+        """
+        Control stage of the pipeline: adds a sample to the rolling statistics, makes it the latest one
+        with spikes filtered out and acts on it right away, before it is broadcast or stored.
+
+        Args:
+            sample (Tuple[int, SensorData]): The sample and when it was taken in epoch milliseconds.
+        """
+        self.latest_sample = self.stats.update(*sample)
+        self.latest_sample_time = time.monotonic()
+        self.missed_readings = self.missed_readings + 1 if missing_readings(self.latest_sample) else 0
+        await self.control_iteration()
+
+    async def store_iteration(self):
+        """
+        Flushes the storage when due.
+        """
+        self.storage.flush_if_due()
+
+    async def watchdog_iteration(self):
+        """
+        Re-arms the timers if the system clock was stepped, see DeadlineTimers.resync, and switches
+        the heater, cooler and fan off while a task runs without a recent sample. Control itself
+        resumes with the next sample.
+        """
+        self.timers.resync()
+        stale = self.latest_sample is not None and time.monotonic() - self.latest_sample_time > self.max_sample_age
+        if self.current_task and stale:
+            logging.error("No recent sensor data, switching hardware off")
+            self.control_hardware(False, False, False)
+
+    async def control_iteration(self):
+        """
+        Performs the safety checks on the latest sample and manages the current task. Runs once per
+        sample, see on_sample. Without a safety reading the heater is switched off, see
+        missing_readings. Timers are re-armed first if the system clock was stepped, see
+        DeadlineTimers.resync.
+        """
+        self.timers.resync()
+        sensor_data = self.latest_sample
+        if sensor_data is None:
+            return
 
         # Safety checks
-        if sensor_data.humidity > 90:
+        if exceeds(sensor_data.humidity, 90):
             logging.error("Humidity above 90, stopping task")
             self.stop()
             return
 
-        if sensor_data.ow3 > 50:
+        if exceeds(sensor_data.ow3, 50):
             logging.error("OW3 temperature above 50, stopping task")
             self.stop()
             return
 
-        if sensor_data.temperature > 100:
+        if exceeds(sensor_data.temperature, 100):
             logging.error("Temperature above 100, stopping task")
             self.stop()
             return
 
+        rising = [f for f in RISE_FIELDS if exceeds(self.stats.rate(f), self.max_temperature_rise)]
+        if self.current_task and rising:
+            logging.error(f"{', '.join(rising)} rising faster than {self.max_temperature_rise} per minute, stopping task")
+            self.stop()
+            return
+
+        # The limits above are checked on the readings that are there; a missing one is a trip of its own.
+        missing = missing_readings(sensor_data)
+        if self.current_task and missing:
+            if self.missed_readings >= self.max_missed_readings:
+                logging.error(f"No {', '.join(missing)} reading for {self.missed_readings} samples, stopping task")
+                self.stop()
+                return
+            if self.missed_readings == 1:
+                logging.warning(f"No {', '.join(missing)} reading, switching heater off")
+            self.set_hardware_state(hardware.HEATER, False)
+            return
+
         if self.current_task:
-            if self.is_task_expired():
-                await self.handle_expired_task()
-            else:
-                self.manage_cooler_cycle(sensor_data)
+            self.manage_cooler_cycle(sensor_data)
@@ -0,0 +1,186 @@
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket bounds in seconds, from a fast I2C write to a stuck sensor read.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Histogram:
+    """
+    A Prometheus histogram with fixed buckets.
+
+    An observation is a bisect and two additions under a lock, cheap enough for every sample and
+    safe to call from executor threads.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """
+        Records one value, e.g. a duration in seconds.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observes the duration of the `with` block, also when it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Counter:
+    """
+    A Prometheus counter.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = sorted(self.values.items())
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in values)
+        return lines
+
+
+class Gauge:
+    """
+    A Prometheus gauge, or counter, whose values are read from a callback when scraped.
+
+    The callback returns a number, or a dict mapping label value tuples to numbers. Values are
+    collected only on a scrape, so the hot path pays nothing for them.
+    """
+
+    def __init__(self, name, documentation, func, labelnames=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {value}'
+                     for labels, value in sorted(values.items()) if value is not None)
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed on /metrics.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Adds a metric, replacing an earlier one with the same name.
+
+        Returns:
+            The metric.
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'oven_stage_seconds', 'Duration of the sample, control, broadcast and storage stages.', ('stage',)))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'oven_stage_errors_total', 'Samples a pipeline stage failed to handle.', ('stage',)))
+TASK_SECONDS = REGISTRY.register(Histogram(
+    'oven_task_seconds', 'Duration of every run of a fixed-rate task.', ('task',)))
+TASK_LATENESS_SECONDS = REGISTRY.register(Histogram(
+    'oven_task_lateness_seconds', 'How long after its deadline a fixed-rate task run started (tick jitter).', ('task',)))
+SENSOR_READ_SECONDS = REGISTRY.register(Histogram(
+    'oven_sensor_read_seconds', 'Duration of sensor reads, including failed ones.', ('sensor',)))
+SENSOR_ERRORS = REGISTRY.register(Counter(
+    'oven_sensor_errors_total', 'Sensor reads that failed or timed out.', ('sensor',)))
+I2C_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'oven_i2c_write_seconds', 'Duration of PCF8574 port writes.'))
+RELAY_SWITCHES = REGISTRY.register(Counter(
+    'oven_relay_switches_total', 'Output pin state changes written to the PCF8574.', ('pin',)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'oven_db_query_seconds', 'Duration of database writes and queries.', ('query',)))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'oven_event_loop_lag_seconds', 'How late the event loop woke up a sleeping coroutine.'))
+
+
+async def monitor_loop_lag(interval=0.5):
+    """
+    Measures event loop lag until cancelled: the time a sleep of `interval` overshoots shows how long
+    the loop was blocked.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
@@ -0,0 +1,34 @@
+import argparse
+import logging
+
+from storage import SensorStorage
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def main():
+    """
+    Migrates a database to the current storage format without starting the server.
+    The server migrates on its own in the background, this is for doing it ahead of time.
+    """
+    parser = argparse.ArgumentParser(description="Migrate a sensor database to the current storage format.")
+    parser.add_argument('db_path', nargs='?', default='data2.db')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--vacuum', action='store_true',
+                        help="rebuild the database with incremental auto-vacuum so retention can shrink the file")
+    args = parser.parse_args()
+
+    storage = SensorStorage(args.db_path)
+    steps = 0
+    while storage.migrate_step(args.chunk_size):
+        steps += 1
+        logging.info(f"Migrated {steps * args.chunk_size} rows")
+    if args.vacuum:
+        logging.info("Rebuilding the database, this needs free space for a copy of it")
+        storage.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        storage.connection.execute("VACUUM")
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
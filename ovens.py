@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import time
+from typing import List
+
+from pydantic import BaseModel, Field, field_validator
+
+import hardware
+import metrics
+from logic import Logic
+from scheduler import FixedRateTask
+from storage import LEGACY_OVEN
+
+
+class OvenConfig(BaseModel):
+    """
+    The hardware of one oven run by an OvenManager, and how much of its history it keeps in memory.
+    """
+    id: int = Field(ge=0)
+    pcf_address: int = Field(default=0x20)
+    am2315_bus: int = Field(default=1, ge=0)
+    am2315_address: int = Field(default=0x5c)
+    # ow1..ow5 in order. ow3 is safety relevant, see logic.SAFETY_FIELDS, so an oven without it could
+    # never heat; without any probe ids no DS18B20 would be read at all.
+    probe_ids: List[str] = Field(min_length=3, max_length=5)
+    # Days of samples kept in memory for history queries, see SensorHistory. A day at 1 Hz takes
+    # about 5.5 MB and is read from the database at startup, so 7 days cost about 39 MB per oven;
+    # longer periods are answered from the database's rollups instead.
+    history_days: int = Field(default=7, ge=1)
+
+    @field_validator('pcf_address', 'am2315_address', mode='before')
+    @classmethod
+    def parse_address(cls, value):
+        # JSON has no hex literals, so addresses can also be given as strings like "0x21".
+        return int(value, 0) if isinstance(value, str) else value
+
+    def sensor_set(self):
+        """
+        Returns:
+            hardware.SensorSet: The sensors of this oven.
+        """
+        return hardware.SensorSet(self.am2315_bus, self.am2315_address, tuple(self.probe_ids))
+
+
+def load_oven_configs(path, overrides=None):
+    """
+    Reads the ovens from a JSON file holding a list of OvenConfig objects, e.g.
+    [{"id": 1, "pcf_address": "0x20", "am2315_bus": 3, "probe_ids": ["28-0000075a4c1b", ...],
+    "history_days": 2}, ...].
+
+    Args:
+        path (str): Path of the file.
+        overrides (Callable[[int], dict]): Called with the index of every oven, returns settings that
+            replace the file's before validation, e.g. the sensors of a simulated oven.
+
+    Returns:
+        List[OvenConfig]: The ovens in file order.
+
+    Raises:
+        ValueError: If the file is invalid or two ovens share an id.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    configs = [OvenConfig(**{**entry, **(overrides(i) if overrides else {})}) for i, entry in enumerate(entries)]
+    ids = [config.id for config in configs]
+    if not configs or len(set(ids)) != len(ids):
+        raise ValueError(f"{path} must list at least one oven, with unique ids")
+    return configs
+
+
+class OvenManager:
+    """
+    Runs several ovens from one process, each with its own Logic: its own task, outputs on its own
+    PCF8574, samples stored under its oven id and events in its own Socket.IO room.
+
+    Acquisition is shared: one fixed-rate task reads the sensors of all ovens at once, see
+    hardware.get_sensor_sets_data_async, and hands every Logic its sample. The control and
+    persistence ticks of the ovens only touch memory and their outputs, so adding an oven adds
+    little to the event loop's work per second. Memory does grow with every oven, mostly by the
+    in-memory history of its `history_days`, see OvenConfig.
+
+    All ovens store their samples through one writer connection and read history through one
+    ReadPool, see SensorStorage's `shared`.
+
+    Every client belongs to one oven, chosen when it connects.
+    """
+
+    def __init__(self, sio, configs, db_path="data2.db", sample_period=1.0, pcfs=None, **options):
+        """
+        Args:
+            sio (socketio.AsyncServer): The Socket.IO server to emit events on.
+            configs (List[OvenConfig]): The ovens.
+            db_path (str): Path of the SQLite database file all ovens share.
+            sample_period (float): Seconds between sensor reads.
+            pcfs (dict): Output port expanders by oven id, e.g. simulated ones; the others are opened
+                at their configured address.
+            **options: Passed on to every Logic, except `history_days`, which each OvenConfig sets.
+        """
+        pcfs = pcfs or {}
+        self.sio = sio
+        self.configs = list(configs)
+        self.sample_period = sample_period
+        self.sensor_sets = [config.sensor_set() for config in self.configs]
+        self.ovens = {}
+        # The first oven's storage holds the one writer connection and ReadPool all ovens share.
+        self.storage = None
+        for config in self.configs:
+            pcf = pcfs.get(config.id)
+            logic = self.ovens[config.id] = Logic(
+                sio, db_path=db_path, oven_id=config.id,
+                pcf=pcf if pcf is not None else hardware.open_pcf8574(config.pcf_address),
+                shared_storage=self.storage, **{**options, 'history_days': config.history_days})
+            self.storage = self.storage or logic.storage
+        if LEGACY_OVEN not in self.ovens:
+            storage = self.storage
+            if storage.migration_pending or storage.connection.execute(
+                    "SELECT 1 FROM SensorSamples WHERE oven_id = ? LIMIT 1", (LEGACY_OVEN,)).fetchone():
+                logging.warning(f"{db_path} holds data from before multiple ovens, which belongs to oven "
+                                f"{LEGACY_OVEN}; configure an oven with id {LEGACY_OVEN} to see and prune it")
+        self.clients = {}
+        self.sampling = FixedRateTask("Sampling", sample_period, self.sample_iteration, timeout=15.0)
+        self.register_metrics()
+
+    def register_metrics(self):
+        """
+        Exposes the gauges of every oven on /metrics, one series per oven with an 'oven' label.
+        Histograms such as the stage timings stay shared by all ovens.
+        """
+        gauges = {oven_id: logic.gauges() for oven_id, logic in self.ovens.items()}
+        for metric_gauges in zip(*gauges.values()):
+            first = metric_gauges[0]
+            metrics.REGISTRY.register(metrics.Gauge(
+                first.name, first.documentation, self._collect(dict(zip(gauges, metric_gauges))),
+                ('oven',) + first.labelnames, first.kind))
+
+    @staticmethod
+    def _collect(gauges):
+        def collect():
+            values = {}
+            for oven_id, gauge in gauges.items():
+                value = gauge.func()
+                if not isinstance(value, dict):
+                    value = {(): value}
+                values.update(((oven_id, *labels), v) for labels, v in value.items())
+            return values
+        return collect
+
+    def logic(self, sid):
+        """
+        Returns:
+            Logic: The oven of a connected client.
+        """
+        return self.ovens[self.clients[sid]]
+
+    async def connect(self, sid, oven_id=None):
+        """
+        Adds a client to an oven's live feed.
+
+        Args:
+            sid (str): The client.
+            oven_id (int): The oven, the first configured one if None.
+
+        Returns:
+            Logic: The oven.
+
+        Raises:
+            KeyError: If there is no such oven.
+        """
+        if oven_id is None:
+            oven_id = self.configs[0].id
+        logic = self.ovens[oven_id]
+        self.clients[sid] = oven_id
+        await logic.live.connect(sid)
+        return logic
+
+    async def disconnect(self, sid):
+        oven_id = self.clients.pop(sid, None)
+        if oven_id is not None:
+            await self.ovens[oven_id].live.disconnect(sid)
+
+    async def logic_loop(self):
+        """
+        Runs the loops of all ovens and the shared sampling task.
+        """
+        await asyncio.gather(self.sampling.run(), metrics.monitor_loop_lag(),
+                             *(logic.logic_loop() for logic in self.ovens.values()))
+
+    async def sample_iteration(self):
+        """
+        Reads the sensors of all ovens and publishes every oven's sample to its Logic.
+        """
+        timestamp = int(time.time() * 1000)
+        with metrics.STAGE_SECONDS.time('Acquire'):
+            samples = await hardware.get_sensor_sets_data_async(self.sensor_sets)
+        logging.debug(f"Fetched sensor data of {len(samples)} ovens")
+        await asyncio.gather(*(logic.publish_sample(timestamp, sensor_data)
+                               for logic, sensor_data in zip(self.ovens.values(), samples)))
+
+    def close(self):
+        # The first oven owns the shared database connections, so it is closed last.
+        for logic in reversed(list(self.ovens.values())):
+            logic.close()
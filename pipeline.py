@@ -0,0 +1,161 @@
+import asyncio
+import inspect
+import logging
+
+import metrics
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class QueueConsumer:
+    """
+    Consumes items from its own bounded queue with a handler, independently of the producer.
+
+    When the queue is full, `drop_policy` decides which item is lost: DROP_OLDEST keeps the freshest
+    items (right for live broadcasts), DROP_NEWEST keeps what is already queued. The producer never
+    waits for a consumer.
+    """
+
+    def __init__(self, name, handler, maxsize, drop_policy=DROP_OLDEST, log_drops=True):
+        """
+        Args:
+            name (str): Name used in log messages.
+            handler (Callable): Called with every item, may be a coroutine function.
+            maxsize (int): The maximum number of queued items.
+            drop_policy (str): DROP_OLDEST or DROP_NEWEST.
+            log_drops (bool): Whether to log a warning for every dropped item.
+        """
+        self.name = name
+        self.handler = handler
+        self.drop_policy = drop_policy
+        self.log_drops = log_drops
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.handled = 0
+
+    def offer(self, item):
+        """
+        Queues an item without waiting, dropping one according to the drop policy if the queue is full.
+
+        Returns:
+            bool: False if an item was dropped.
+        """
+        if self.queue.full():
+            self.dropped += 1
+            if self.log_drops:
+                logging.warning(f"{self.name} queue full, dropping {'newest' if self.drop_policy == DROP_NEWEST else 'oldest'} item")
+            if self.drop_policy == DROP_NEWEST:
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+            return False
+        self.queue.put_nowait(item)
+        return True
+
+    def take_pending(self):
+        """
+        Removes and returns all queued items, e.g. to handle them synchronously on shutdown.
+        """
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return items
+
+    async def handle(self, item):
+        """
+        Handles one item. A failing item is logged and skipped.
+        """
+        try:
+            with metrics.STAGE_SECONDS.time(self.name):
+                result = self.handler(item)
+                if inspect.isawaitable(result):
+                    await result
+            self.handled += 1
+        except Exception as e:
+            metrics.STAGE_ERRORS.inc(self.name)
+            logging.exception(f"{self.name} failed to handle item: {e}")
+
+    async def drain(self):
+        """
+        Handles all queued items now.
+        """
+        for item in self.take_pending():
+            await self.handle(item)
+
+    async def run(self):
+        """
+        Handles queued items until cancelled.
+        """
+        while True:
+            await self.handle(await self.queue.get())
+
+    def stats(self):
+        """
+        Returns:
+            dict: Queue depth and counters of this consumer.
+        """
+        return {
+            'depth': self.queue.qsize(),
+            'maxsize': self.queue.maxsize,
+            'handled': self.handled,
+            'dropped': self.dropped,
+        }
+
+
+class SamplePipeline:
+    """
+    Fans each acquired sample out to its stages.
+
+    The control stage runs first and inline, so actuation never waits for I/O. Every other stage is a
+    QueueConsumer with its own queue, so a slow client or disk only delays that stage. A failing
+    control stage, e.g. an I2C error on the outputs, is logged and counted, and the sample is still
+    stored and broadcast.
+    """
+
+    def __init__(self, control):
+        """
+        Args:
+            control (Callable): Coroutine function called with every sample before it is fanned out.
+        """
+        self.control = control
+        self.consumers = []
+
+    def add_consumer(self, consumer):
+        """
+        Adds a consumer stage.
+
+        Args:
+            consumer (QueueConsumer): The consumer to feed every sample to.
+
+        Returns:
+            QueueConsumer: The consumer.
+        """
+        self.consumers.append(consumer)
+        return consumer
+
+    async def publish(self, sample):
+        """
+        Runs the control stage on a sample and queues it for every consumer, also if the control stage fails.
+        """
+        try:
+            with metrics.STAGE_SECONDS.time('Control'):
+                await self.control(sample)
+        except Exception as e:
+            metrics.STAGE_ERRORS.inc('Control')
+            logging.exception(f"Control failed to handle sample: {e}")
+        for consumer in self.consumers:
+            consumer.offer(sample)
+
+    async def drain(self):
+        """
+        Lets every consumer handle its queued samples now.
+        """
+        for consumer in self.consumers:
+            await consumer.drain()
+
+    async def run(self):
+        """
+        Runs all consumers until cancelled.
+        """
+        await asyncio.gather(*(consumer.run() for consumer in self.consumers))
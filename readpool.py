@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class ReadPool:
+    """
+    Runs database reads on a small thread pool, each thread with its own read-only connection.
+
+    In WAL mode the readers see a consistent snapshot and never block the writer or the event loop.
+    Identical reads that are in flight at the same time can be coalesced into a single query.
+    """
+
+    def __init__(self, db_path, size=2):
+        """
+        Args:
+            db_path (str): Path of the SQLite database file.
+            size (int): The number of reader threads and connections.
+        """
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db-read')
+        self.local = threading.local()
+        self.connections = []
+        self.inflight = {}
+        self.queries = 0
+        self.coalesced = 0
+
+    def _connection(self):
+        """
+        Returns the read-only connection of the calling reader thread, opening it on first use.
+        """
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self.local.connection = conn
+            self.connections.append(conn)
+        return conn
+
+    async def run(self, func, *args):
+        """
+        Runs `func(connection, *args)` on a reader thread. Its duration is recorded in
+        metrics.DB_QUERY_SECONDS under the name of `func`.
+
+        Returns:
+            The result of `func`.
+        """
+        self.queries += 1
+        loop = asyncio.get_running_loop()
+
+        def query():
+            with metrics.DB_QUERY_SECONDS.time(func.__name__):
+                return func(self._connection(), *args)
+
+        return await loop.run_in_executor(self.executor, query)
+
+    async def coalesce(self, key, func, *args):
+        """
+        Like run(), but callers that ask for the same `key` while the read is in flight share its result.
+
+        Returns:
+            The result of `func`.
+        """
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.run(func, *args))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def close(self):
+        """
+        Waits for running reads and closes all reader connections.
+        """
+        self.executor.shutdown(wait=True)
+        for conn in self.connections:
+            conn.close()
+        self.connections.clear()
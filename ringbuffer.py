@@ -0,0 +1,167 @@
+import time
+
+import numpy as np
+
+import downsample
+from storage import FIELDS, MAX_POINTS, bucket_width
+
+
+class SensorRingBuffer:
+    """
+    Keeps the most recent sensor samples in memory as fixed-size NumPy columns.
+
+    There is one float64 column per field in FIELDS plus an int64 column with the epoch timestamp
+    in milliseconds, so a sample costs 8 bytes per field: 64 bytes in total, about 39 MB for 7 days
+    at 1 Hz. The same samples as a list of dicts take well over 1 KB each. Missing readings are
+    stored as NaN. When the buffer is full the oldest sample is overwritten.
+
+    Queries may run on another thread while the event loop appends: they work on the samples present
+    when they started, of which at most the oldest few can be overwritten while they run.
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): The maximum number of samples to keep.
+        """
+        self.capacity = capacity
+        self.size = 0
+        self.next_index = 0
+        self.horizon = None
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.columns = {field: np.full(capacity, np.nan) for field in FIELDS}
+
+    @property
+    def nbytes(self):
+        """
+        int: The memory used by the columns in bytes.
+        """
+        return self.timestamps.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def append(self, timestamp_ms, sensor_data):
+        """
+        Appends one sample.
+
+        Args:
+            timestamp_ms (int): The epoch timestamp of the sample in milliseconds.
+            sensor_data (SensorData): The sensor data to append.
+        """
+        i = self.next_index
+        self.timestamps[i] = timestamp_ms
+        for field, column in self.columns.items():
+            value = getattr(sensor_data, field)
+            column[i] = np.nan if value is None else value
+        self.next_index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def load(self, chunks, since=None):
+        """
+        Appends chunks of rows read from the database, oldest first.
+
+        Args:
+            chunks (Iterable[List[tuple]]): Rows of (timestamp_ms, *FIELDS).
+            since (float): Epoch timestamp in seconds the rows were read from, so the buffer holds all
+                samples since then. Without it, only samples since the oldest one are known to be complete.
+        """
+        if since is not None:
+            self.horizon = int(since * 1000)
+        for rows in chunks:
+            if not rows:
+                continue
+            data = np.array(rows, dtype=np.float64)[-self.capacity:]
+            n = len(data)
+            positions = (self.next_index + np.arange(n)) % self.capacity
+            self.timestamps[positions] = data[:, 0].astype(np.int64)
+            for j, column in enumerate(self.columns.values(), start=1):
+                column[positions] = data[:, j]
+            self.next_index = (self.next_index + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+
+    def _range(self, column, start, stop, view):
+        """
+        Returns the samples of a column from logical position `start` up to `stop`, in order.
+        This is a view unless the range wraps around the end of the buffer.
+        """
+        next_index, size = view
+        first = (next_index - size + start) % self.capacity
+        last = first + stop - start
+        if last <= self.capacity:
+            return column[first:last]
+        return np.concatenate((column[first:], column[:last - self.capacity]))
+
+    def _search(self, timestamp_ms, view):
+        """
+        Returns the logical position of the first sample at or after `timestamp_ms`.
+        """
+        next_index, size = view
+        oldest = (next_index - size) % self.capacity
+        head = self.timestamps[oldest:oldest + size]
+        if len(head) and timestamp_ms <= head[-1]:
+            return int(np.searchsorted(head, timestamp_ms))
+        tail = self.timestamps[:size - len(head)]
+        return len(head) + int(np.searchsorted(tail, timestamp_ms))
+
+    @property
+    def newest(self):
+        """
+        int: The epoch timestamp of the newest sample in milliseconds, or None if the buffer is empty.
+        """
+        if not self.size:
+            return None
+        return int(self.timestamps[self.next_index - 1])
+
+    def covers(self, start):
+        """
+        Checks whether the buffer holds all samples since `start`: `start` must be at or after both
+        the horizon the buffer was loaded from and its oldest sample.
+
+        Args:
+            start (float): Epoch timestamp in seconds.
+        """
+        bounds = [] if self.horizon is None else [self.horizon]
+        if self.size:
+            bounds.append(self.timestamps[(self.next_index - self.size) % self.capacity])
+        return bool(bounds) and start * 1000 >= max(bounds)
+
+    def get_series(self, days, max_points=MAX_POINTS, mode=downsample.AVG):
+        """
+        Aggregates the samples of the last `days` days into at most about `max_points` buckets,
+        in the same format as SensorStorage.get_sensor_series.
+
+        Args:
+            days (int): The number of days for which to retrieve data.
+            max_points (int): The maximum number of points to return.
+            mode (str): The downsampling mode, see downsample.aggregate.
+
+        Returns:
+            dict: One list per column: 'timestamp' (epoch seconds of the bucket), FIELDS and 'count'.
+        """
+        now = int(time.time())
+        return self.get_range_series(now - days * 86400, now, max_points, mode)
+
+    def get_range_series(self, start, end, max_points=MAX_POINTS, mode=downsample.AVG, width=None):
+        """
+        Aggregates the samples from `start` up to `end` into at most about `max_points` buckets,
+        in the same format as SensorStorage.get_range_series.
+
+        Args:
+            start (int): Start of the range in epoch seconds.
+            end (int): End of the range (exclusive) in epoch seconds.
+            max_points (int): The maximum number of points to return.
+            mode (str): The downsampling mode, see downsample.aggregate.
+            width (int): The bucket width in seconds, by default derived from the range and `max_points`.
+
+        Returns:
+            dict: One list per column: 'timestamp' (epoch seconds of the bucket), FIELDS and 'count'.
+        """
+        if width is None:
+            _, width = bucket_width(max(1, end - start), max_points)
+        # The samples as of now, so appends while this runs on another thread do not move the range.
+        view = self.next_index, self.size
+        first = self._search(start * 1000, view)
+        stop = self._search(end * 1000, view)
+        if first >= stop:
+            return downsample.aggregate(np.empty(0), dict.fromkeys(FIELDS), width, mode)
+        timestamps = self._range(self.timestamps, first, stop, view) / 1000.0
+        columns = {field: self._range(column, first, stop, view) for field, column in self.columns.items()}
+        return downsample.aggregate(timestamps, columns, width, mode)
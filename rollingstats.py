@@ -0,0 +1,183 @@
+import dataclasses
+from collections import deque
+
+from hardware import SensorData
+
+# SensorData fields statistics are kept for.
+STAT_FIELDS = tuple(f.name for f in dataclasses.fields(SensorData))
+
+# Scales a median absolute deviation to the standard deviation of normally distributed noise.
+MAD_SCALE = 1.4826
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class RollingStats:
+    """
+    Rolling statistics of one sensor, updated in constant time per reading.
+
+    Every reading first passes a Hampel filter: if it is further from the median of the last
+    `spike_size` readings, itself included, than `threshold` times their scaled median absolute
+    deviation (at least `min_deviation`), it counts as a spike and the median stands in for it. A
+    single bad read is rejected, while a real step passes once it makes up the majority of those
+    readings: with the default `spike_size` of 5 the first two readings after a step are replaced
+    and the third is accepted, so a step reaches the safety checks two samples late.
+
+    Accepted readings enter a window of the last `size` readings with running sums for the mean and
+    the least-squares rate of change, and monotonic queues for the minimum and maximum. The sums are
+    recomputed from the window once per `size` readings, so rounding errors do not build up.
+    """
+
+    def __init__(self, size=60, spike_size=5, threshold=3.0, min_deviation=0.5):
+        """
+        Args:
+            size (int): Number of accepted readings in the window.
+            spike_size (int): Number of recent readings spikes are judged against.
+            threshold (float): Distance from the median, in scaled deviations, that makes a spike.
+            min_deviation (float): Lower bound of the scaled deviation, so steady readings do not
+                turn every small change into a spike.
+        """
+        self.size = size
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self.recent = deque(maxlen=spike_size)
+        self.window = deque()
+        self.mins = deque()
+        self.maxs = deque()
+        self.count = 0
+        self.spikes = 0
+        self.origin = 0.0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+
+    def add(self, t, value):
+        """
+        Args:
+            t (float): When the reading was taken in epoch seconds.
+            value (float): The reading, or None if the sensor could not be read.
+
+        Returns:
+            float: The reading, the median of the recent readings if it is a spike, or None if missing.
+        """
+        if value is None:
+            return None
+        judged = len(self.recent) >= 3
+        self.recent.append(value)
+        if judged:
+            center = median(self.recent)
+            deviation = max(MAD_SCALE * median(abs(v - center) for v in self.recent), self.min_deviation)
+            if abs(value - center) > self.threshold * deviation:
+                self.spikes += 1
+                return center
+        self.push(t, value)
+        return value
+
+    def push(self, t, value):
+        n = self.count
+        self.count += 1
+        if not self.window:
+            self.origin = t
+        self.window.append((t, value))
+        self.accumulate(t, value, 1)
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((n, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((n, value))
+        if len(self.window) > self.size:
+            self.accumulate(*self.window.popleft(), -1)
+            oldest = n - self.size + 1
+            if self.mins[0][0] < oldest:
+                self.mins.popleft()
+            if self.maxs[0][0] < oldest:
+                self.maxs.popleft()
+        if self.count % self.size == 0:
+            self.origin = self.window[0][0]
+            self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+            for t, value in self.window:
+                self.accumulate(t, value, 1)
+
+    def accumulate(self, t, value, sign):
+        t -= self.origin
+        self.sum_t += sign * t
+        self.sum_v += sign * value
+        self.sum_tt += sign * t * t
+        self.sum_tv += sign * t * value
+
+    @property
+    def rate(self):
+        """
+        float: Least-squares slope of the window in units per minute, None until a quarter of
+        the window is filled.
+        """
+        n = len(self.window)
+        if n < max(2, self.size // 4):
+            return None
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return None
+        return 60.0 * (n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+    def summary(self):
+        """
+        Returns:
+            dict: 'mean', 'min', 'max' and 'rate' (per minute) of the window, 'median' of the recent
+            readings and the number of 'spikes' rejected; None where there are no readings yet.
+        """
+        if not self.window:
+            return {'mean': None, 'min': None, 'max': None, 'rate': None, 'median': None, 'spikes': self.spikes}
+        rate = self.rate
+        return {
+            'mean': round(self.sum_v / len(self.window), 3),
+            'min': round(self.mins[0][1], 3),
+            'max': round(self.maxs[0][1], 3),
+            'rate': None if rate is None else round(rate, 3),
+            'median': round(median(self.recent), 3),
+            'spikes': self.spikes,
+        }
+
+
+class SensorStatistics:
+    """
+    RollingStats for every SensorData field.
+    """
+
+    def __init__(self, **options):
+        """
+        Args:
+            **options: Passed on to every RollingStats.
+        """
+        self.fields = {field: RollingStats(**options) for field in STAT_FIELDS}
+
+    def update(self, timestamp, sensor_data):
+        """
+        Adds a sample to the statistics.
+
+        Args:
+            timestamp (int): When the sample was taken in epoch milliseconds.
+            sensor_data (SensorData): The sample.
+
+        Returns:
+            SensorData: The sample with spikes replaced by the median of the recent readings.
+        """
+        t = timestamp / 1000.0
+        return dataclasses.replace(sensor_data, **{
+            field: stats.add(t, getattr(sensor_data, field)) for field, stats in self.fields.items()})
+
+    def rate(self, field):
+        """
+        Returns:
+            float: The rate of change of a field per minute, see RollingStats.rate.
+        """
+        return self.fields[field].rate
+
+    def summary(self):
+        """
+        Returns:
+            dict: RollingStats.summary() per field.
+        """
+        return {field: stats.summary() for field, stats in self.fields.items()}
@@ -0,0 +1,174 @@
+import asyncio
+import datetime
+import logging
+
+import metrics
+
+
+class FixedRateTask:
+    """
+    Runs a coroutine function at a fixed rate.
+
+    Ticks are scheduled from the event loop's monotonic clock as start + n * period, so the rate does
+    not drift by however long each run takes. A run that ends after the next deadline is counted as an
+    overrun, and the deadlines it missed are skipped instead of being run back to back.
+    """
+
+    def __init__(self, name, period, func, timeout=None):
+        """
+        Args:
+            name (str): Name used in log messages.
+            period (float): Time between ticks in seconds.
+            func (Callable[[], Awaitable]): The coroutine function to run every tick.
+            timeout (float): Maximum duration of a single run in seconds, or None for no limit.
+        """
+        self.name = name
+        self.period = period
+        self.func = func
+        self.timeout = timeout
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.timeouts = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+
+    async def run(self):
+        """
+        Runs the task until it is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            started = loop.time()
+            metrics.TASK_LATENESS_SECONDS.observe(max(0.0, started - deadline), self.name)
+            try:
+                await asyncio.wait_for(self.func(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logging.error(f"{self.name} timed out after {self.timeout}s, skipping to the next tick")
+            except Exception as e:
+                logging.exception(f"{self.name} failed: {e}")
+            now = loop.time()
+            self.ticks += 1
+            self.last_duration = now - started
+            self.max_duration = max(self.max_duration, self.last_duration)
+            metrics.TASK_SECONDS.observe(self.last_duration, self.name)
+
+            deadline += self.period
+            if now > deadline:
+                late = now - deadline
+                missed = int(late // self.period) + 1
+                self.overruns += 1
+                self.missed_ticks += missed
+                deadline += missed * self.period
+                logging.warning(f"{self.name} overran its {self.period}s period by {late:.3f}s, skipped {missed} tick(s)")
+            await asyncio.sleep(deadline - now)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Tick, overrun and timing counters of this task.
+        """
+        return {
+            'period': self.period,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'missed_ticks': self.missed_ticks,
+            'timeouts': self.timeouts,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+        }
+
+
+class DeadlineTimers:
+    """
+    Named one-shot timers that fire at a wall-clock due time, scheduled with loop.call_at.
+
+    A due time is converted to a deadline on the event loop's monotonic clock when the timer is set,
+    so it fires on time independent of any polling period. The system clock can still be stepped
+    afterwards, e.g. by NTP on a Pi without an RTC, which moves the due times against the monotonic
+    deadlines. resync() re-arms the timers when the two clocks have drifted apart by more than
+    `tolerance` seconds, and a timer that fires before its due time on the wall clock is re-armed
+    instead of run. Setting a timer again replaces it. A callback that returns a coroutine has it run
+    as a task. How late each timer fired is recorded in metrics.TASK_LATENESS_SECONDS.
+    """
+
+    def __init__(self, tolerance=1.0):
+        """
+        Args:
+            tolerance (float): Seconds the wall clock may move against the monotonic clock before
+                the timers are re-armed.
+        """
+        self.tolerance = tolerance
+        self.handles = {}
+        self.timers = {}
+        self.running = set()
+
+    @staticmethod
+    def clock_offset(loop):
+        """
+        Returns:
+            float: The wall clock minus the event loop's monotonic clock in seconds.
+        """
+        return (datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)).total_seconds() - loop.time()
+
+    def set(self, name, due, callback):
+        """
+        Args:
+            name (str): Name of the timer, also used in log messages and metrics.
+            due (datetime.datetime): When to fire, naive UTC like Task.start_date. Past times fire right away.
+            callback (Callable[[], Any]): Called without arguments on the event loop.
+        """
+        self.cancel(name)
+        loop = asyncio.get_running_loop()
+        offset = self.clock_offset(loop)
+        deadline = (due - datetime.datetime(1970, 1, 1)).total_seconds() - offset
+        self.timers[name] = (due, callback, offset)
+        self.handles[name] = loop.call_at(deadline, self.fire, name, deadline, callback)
+
+    def resync(self):
+        """
+        Re-arms every timer whose deadline was computed before the wall clock moved by more than
+        `tolerance` seconds against the monotonic clock. Cheap enough to call on every control tick.
+        """
+        if not self.timers:
+            return
+        offset = self.clock_offset(asyncio.get_running_loop())
+        for name, (due, callback, set_offset) in list(self.timers.items()):
+            if abs(offset - set_offset) > self.tolerance:
+                logging.warning(f"Wall clock moved by {offset - set_offset:.1f}s, re-arming the {name} timer")
+                self.set(name, due, callback)
+
+    def fire(self, name, deadline, callback):
+        due, _, _ = self.timers[name]
+        if datetime.datetime.utcnow() < due - datetime.timedelta(seconds=self.tolerance):
+            logging.warning(f"{name} timer fired before its due time {due}, the wall clock moved; re-arming it")
+            self.set(name, due, callback)
+            return
+        self.handles.pop(name, None)
+        self.timers.pop(name, None)
+        metrics.TASK_LATENESS_SECONDS.observe(max(0.0, asyncio.get_running_loop().time() - deadline), name)
+        try:
+            result = callback()
+        except Exception as e:
+            logging.exception(f"{name} timer failed: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            # The loop only keeps weak references to tasks.
+            task = asyncio.ensure_future(result)
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    def cancel(self, name):
+        """
+        Cancels a timer if it is set.
+        """
+        self.timers.pop(name, None)
+        handle = self.handles.pop(name, None)
+        if handle is not None:
+            handle.cancel()
+
+    def cancel_all(self):
+        for name in list(self.handles):
+            self.cancel(name)
@@ -0,0 +1,132 @@
+import asyncio
+import bisect
+import time
+from collections import OrderedDict
+
+
+class SeriesCache:
+    """
+    Caches history series as completed buckets and extends them incrementally.
+
+    Every entry holds the buckets of one (period, resolution, mode) that can no longer change. On a
+    hit, buckets that fell out of the period are dropped from the front, buckets completed since the
+    last request are computed and appended, and only the current, still filling bucket is computed
+    from scratch. A dashboard refresh then costs a copy of the cached lists plus two small range
+    aggregations instead of aggregating the whole period. At most `max_entries` entries are kept,
+    evicting the least recently used one across all resolutions.
+
+    A miss aggregates the whole period, which takes tens of milliseconds for a week of samples, so it
+    runs through `run` off the event loop, and requests that miss on the same entry at the same time
+    share that one aggregation. The small aggregations of a hit run inline.
+    """
+
+    def __init__(self, compute, max_entries=8, settle=5.0, run=asyncio.to_thread):
+        """
+        Args:
+            compute (Callable[[int, int, int, str], dict]): Aggregates the samples from start up to
+                end (epoch seconds) into buckets of the given width with the given downsampling mode.
+            max_entries (int): The maximum number of cached series.
+            settle (float): Seconds after its end before a bucket counts as complete, so samples
+                still on their way into the history are not missed.
+            run (Callable): Awaits `compute` with its arguments off the event loop, e.g. on a thread.
+        """
+        self.compute = compute
+        self.max_entries = max_entries
+        self.settle = settle
+        self.run = run
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def window(self, period, width):
+        """
+        Returns:
+            Tuple[float, int, int]: Now, the start of the oldest bucket of the period and the end of
+            the newest complete bucket, in epoch seconds.
+        """
+        now = time.time()
+        return now, int((now - period) // width * width), int((now - self.settle) // width * width)
+
+    async def fill(self, key):
+        """
+        Aggregates the complete buckets of an entry off the event loop and caches them. Callers that
+        miss on the same entry while it is being filled share the result.
+
+        Returns:
+            dict: The entry.
+        """
+        future = self.inflight.get(key)
+        if future is None:
+            period, width, mode = key
+            _, window_start, complete_until = self.window(period, width)
+
+            async def load():
+                series = await self.run(self.compute, window_start, complete_until, width, mode)
+                entry = self.entries[key] = {'series': series, 'until': complete_until}
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                return entry
+
+            future = asyncio.ensure_future(load())
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    async def get(self, period, width, mode):
+        """
+        Returns the series of the last `period` seconds in buckets of `width` seconds.
+
+        Args:
+            period (int): The length of the period in seconds.
+            width (int): The bucket width in seconds.
+            mode (str): The downsampling mode, see downsample.aggregate.
+
+        Returns:
+            dict: One list per column, see SensorStorage.get_sensor_series.
+        """
+        key = (period, width, mode)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = await self.fill(key)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        # Time has passed while filling, so bring the entry up to date like on a hit.
+        now, window_start, complete_until = self.window(period, width)
+        series = entry['series']
+        if complete_until > entry['until']:
+            added = self.compute(entry['until'], complete_until, width, mode)
+            for column, values in series.items():
+                values.extend(added[column])
+            entry['until'] = complete_until
+        expired = bisect.bisect_left(series['timestamp'], window_start)
+        if expired:
+            for values in series.values():
+                del values[:expired]
+        current = self.compute(complete_until, int(now) + 1, width, mode)
+        return {column: values + current[column] for column, values in series.items()}
+
+    def clear(self):
+        """
+        Drops all cached series.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count, hits, misses, misses that shared a fill and the hit rate.
+        """
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': self.hits / requests if requests else None,
+        }
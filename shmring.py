@@ -0,0 +1,163 @@
+import dataclasses
+import json
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from hardware import SensorData
+
+# SensorData fields in slot order.
+SAMPLE_FIELDS = tuple(f.name for f in dataclasses.fields(SensorData))
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<i8'),
+    ('timestamp', '<i8'),
+    ('values', '<f8', (len(SAMPLE_FIELDS),)),
+])
+
+# Header words: sample sequence, capacity, state sequence, state length.
+HEADER_SIZE = 64
+
+# Space for the JSON control state, see write_state().
+STATE_SIZE = 16384
+
+
+class SharedSampleRing:
+    """
+    A single-writer, many-reader ring of samples in shared memory.
+
+    The writer stores sample n in slot n % capacity and then publishes n in the header, so readers
+    never take a lock and never block the writer. Every slot carries its own sequence number, which
+    is set to -1 while the slot is written: a reader accepts a copy only if the slot held the
+    expected sequence number before and after copying, and otherwise retries or, if the writer has
+    lapped it, skips ahead. A second seqlocked region holds the JSON control state.
+    """
+
+    def __init__(self, name=None, capacity=3600, create=False):
+        """
+        Args:
+            name (str): Name of the shared memory block, generated when creating if None.
+            capacity (int): Number of samples kept, only used when creating.
+            create (bool): Whether to create the block (the writer) or attach to it (a reader).
+        """
+        slots_size = SLOT_DTYPE.itemsize * capacity
+        if create:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=HEADER_SIZE + slots_size + STATE_SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # Before Python 3.13 attaching registers the block with this process's resource tracker,
+            # which would remove it when this process exits although the writer still uses it.
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.header = np.ndarray(4, dtype='<i8', buffer=self.shm.buf)
+        if create:
+            self.header[:] = (0, capacity, 0, 0)
+        self.capacity = int(self.header[1])
+        self.slots = np.ndarray(self.capacity, dtype=SLOT_DTYPE, buffer=self.shm.buf, offset=HEADER_SIZE)
+        if create:
+            self.slots['seq'] = 0
+        self.state = np.ndarray(STATE_SIZE, dtype=np.uint8, buffer=self.shm.buf,
+                                offset=HEADER_SIZE + SLOT_DTYPE.itemsize * self.capacity)
+        self.lost = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def head(self):
+        """
+        int: Sequence number of the newest sample, 0 before the first one.
+        """
+        return int(self.header[0])
+
+    def write(self, timestamp, sensor_data):
+        """
+        Publishes a sample. Only one process may write.
+
+        Args:
+            timestamp (int): When the sample was taken in epoch milliseconds.
+            sensor_data (SensorData): The sample.
+        """
+        seq = int(self.header[0]) + 1
+        i = seq % self.capacity
+        self.slots['seq'][i] = -1
+        self.slots['timestamp'][i] = timestamp
+        self.slots['values'][i] = [np.nan if v is None else v for v in (getattr(sensor_data, f) for f in SAMPLE_FIELDS)]
+        self.slots['seq'][i] = seq
+        self.header[0] = seq
+
+    def read_since(self, seq):
+        """
+        Returns the samples published after sequence number `seq`, oldest first. Samples the writer
+        already overwrote are skipped and counted in `lost`.
+
+        Args:
+            seq (int): The sequence number of the last sample the caller has seen.
+
+        Returns:
+            Tuple[int, List[Tuple[int, SensorData]]]: The sequence number to pass next time and the
+            samples with their epoch millisecond timestamps.
+        """
+        head = self.head
+        if head - seq > self.capacity:
+            self.lost += head - seq - self.capacity
+            seq = head - self.capacity
+        samples = []
+        seqs, timestamps, values = self.slots['seq'], self.slots['timestamp'], self.slots['values']
+        for n in range(seq + 1, head + 1):
+            i = n % self.capacity
+            if seqs[i] != n:
+                self.lost += 1
+                continue
+            timestamp = int(timestamps[i])
+            row = values[i].tolist()
+            if seqs[i] != n:
+                # Overwritten while copying.
+                self.lost += 1
+                continue
+            samples.append((timestamp, SensorData(*(None if v != v else v for v in row))))
+        return head, samples
+
+    def write_state(self, state):
+        """
+        Publishes the control state as JSON.
+
+        Args:
+            state (dict): JSON serializable state, at most STATE_SIZE bytes encoded.
+        """
+        data = json.dumps(state).encode()
+        if len(data) > STATE_SIZE:
+            raise ValueError(f"Control state of {len(data)} bytes exceeds {STATE_SIZE} bytes")
+        self.header[2] += 1
+        self.state[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.header[3] = len(data)
+        self.header[2] += 1
+
+    def read_state(self):
+        """
+        Returns:
+            Tuple[int, dict]: The state version, and the control state or None if none was written.
+            The version is None if no consistent copy could be read, e.g. while the writer is stuck.
+        """
+        for _ in range(1000):
+            version = int(self.header[2])
+            if version % 2:
+                continue
+            data = self.state[:int(self.header[3])].tobytes()
+            if int(self.header[2]) == version:
+                return version, json.loads(data) if data else None
+        return None, None
+
+    def close(self):
+        """
+        Detaches from the shared memory.
+        """
+        # The NumPy views must go before the buffer can be released.
+        del self.header, self.slots, self.state
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Removes the shared memory block; called by the writer when it shuts down.
+        """
+        self.shm.unlink()
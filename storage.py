@@ -0,0 +1,744 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import downsample
+import metrics
+from archive import SensorArchive, day_of, day_start
+from readpool import ReadPool
+
+# Sensor columns of the SensorData table, in storage order.
+FIELDS = ('temperature', 'humidity', 'ow1', 'ow2', 'ow3', 'ow4', 'ow5')
+
+# Current storage format. Version 1 is the legacy SensorData table with local-time DATETIME keys,
+# version 2 the SensorSamples table keyed by epoch milliseconds, version 3 adds the oven id to the
+# keys of samples, rollups and control state.
+SCHEMA_VERSION = 3
+
+# The oven that the data of a database from before version 3 belongs to.
+LEGACY_OVEN = 0
+
+# Converts a legacy local-time SensorData timestamp to epoch milliseconds in SQL.
+LEGACY_TIMESTAMP_MS = "CAST(round((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Bucket sizes (seconds) of the rollup levels, finest first.
+ROLLUP_LEVELS = (10, 60, 300, 900, 3600)
+
+# Days raw samples are kept in the database before they are moved to the archive, None to keep them.
+RAW_RETENTION_DAYS = 30
+
+# Days the buckets of each rollup level are kept, None to keep them forever.
+ROLLUP_RETENTION_DAYS = {10: 90, 60: 365, 300: None, 900: None, 3600: None}
+
+# Free pages returned to the file system after every retention batch, see SensorStorage.prune_step.
+VACUUM_PAGES = 256
+
+# Columns of a history series, see SensorStorage.get_sensor_series.
+SERIES_COLUMNS = ('timestamp',) + FIELDS + ('count',)
+
+# Default number of points returned by a history query.
+MAX_POINTS = 1000
+
+# How many rollup buckets per returned point LTTB picks from when the raw samples are not in memory.
+LTTB_OVERSAMPLE = 10
+
+# Merges one aggregated bucket into SensorRollup; min/max ignore NULLs from missing readings.
+ROLLUP_UPSERT = f"""
+    INSERT INTO SensorRollup (oven_id, level, bucket, count, {", ".join(f"{f}_n, {f}_sum, {f}_min, {f}_max" for f in FIELDS)})
+    VALUES (?, ?, ?, ?, {", ".join("?, ?, ?, ?" for _ in FIELDS)})
+    ON CONFLICT (oven_id, level, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        {", ".join(
+            f"{f}_n = {f}_n + excluded.{f}_n, "
+            f"{f}_sum = {f}_sum + excluded.{f}_sum, "
+            f"{f}_min = coalesce(min({f}_min, excluded.{f}_min), {f}_min, excluded.{f}_min), "
+            f"{f}_max = coalesce(max({f}_max, excluded.{f}_max), {f}_max, excluded.{f}_max)"
+            for f in FIELDS)}
+"""
+
+
+def bucket_width(period, max_points=MAX_POINTS):
+    """
+    Picks the bucket width for a history query: the coarsest rollup level that still has at least
+    `max_points` buckets in the period, widened to a multiple of it so at most `max_points` remain.
+
+    Args:
+        period (int): The length of the period in seconds.
+        max_points (int): The maximum number of points to return.
+
+    Returns:
+        Tuple[int, int]: The rollup level and the bucket width, both in seconds.
+    """
+    level = ROLLUP_LEVELS[0]
+    for candidate in ROLLUP_LEVELS:
+        if period // candidate >= max_points:
+            level = candidate
+    return level, level * max(1, -(-period // (level * max_points)))
+
+
+def retained_level(level, start, retention=ROLLUP_RETENTION_DAYS):
+    """
+    Returns the finest rollup level from `level` up whose buckets are still kept at `start`.
+
+    Args:
+        level (int): The preferred level from ROLLUP_LEVELS.
+        start (int): The start of the queried range in epoch seconds.
+        retention (dict): Days kept per level, see ROLLUP_RETENTION_DAYS.
+
+    Returns:
+        int: The rollup level.
+    """
+    now = time.time()
+    for candidate in ROLLUP_LEVELS[ROLLUP_LEVELS.index(level):]:
+        days = retention.get(candidate)
+        if days is None or start >= now - days * 86400:
+            return candidate
+    return ROLLUP_LEVELS[-1]
+
+
+class SensorStorage:
+    """
+    Stores sensor samples in SQLite using a write-behind buffer.
+
+    Samples are collected in memory and written with a single `executemany` in one transaction
+    once `batch_size` samples are pending or the oldest pending sample is `flush_interval` seconds old.
+    Together these two settings cap how much of the added data a crash can lose while flushes
+    succeed; samples still queued before add() come on top, see Logic. The database runs in WAL mode
+    with `synchronous=NORMAL`, so a flush does not fsync the SD card on every commit. All writes go
+    through this one connection; history queries run on a ReadPool of read-only connections.
+
+    Samples are stored in the SensorSamples table, keyed by oven and epoch milliseconds. Several ovens
+    share a database with one SensorStorage each, all on the writer connection and ReadPool of the
+    first one, see `shared`; every query is limited to its `oven_id`. A database
+    still in the legacy format is migrated in the background with migrate_step(), see SCHEMA_VERSION.
+
+    Every flush also updates the SensorRollup table, which holds count, sum, min and max per field
+    for each bucket of each level in ROLLUP_LEVELS. History queries read from the coarsest level that
+    still gives enough points, so their cost depends on the number of points and not on retention.
+
+    Retention is tiered: prune_step() moves raw samples older than `raw_days` to a SensorArchive of
+    compressed day files, which raw reads still cover, and deletes rollup buckets older than their
+    level's retention. Queries reaching further back fall back to a coarser level.
+    """
+
+    def __init__(self, db_path="data2.db", batch_size=30, flush_interval=30.0, max_pending=3600, readers=2,
+                 readonly=False, raw_days=RAW_RETENTION_DAYS, rollup_days=ROLLUP_RETENTION_DAYS, archive_dir=None,
+                 oven_id=LEGACY_OVEN, shared=None):
+        """
+        Args:
+            db_path (str): Path of the SQLite database file.
+            batch_size (int): Number of pending samples that triggers a flush.
+            flush_interval (float): Age in seconds of the oldest pending sample that triggers a flush.
+            max_pending (int): Maximum number of samples kept in memory while flushes keep failing.
+            readers (int): Number of read-only connections for history queries, see ReadPool.
+            readonly (bool): Only query an existing database that another process writes to.
+            raw_days (int): Days raw samples are kept in the database, None to keep them forever.
+            rollup_days (dict): Days the buckets of each rollup level are kept, see ROLLUP_RETENTION_DAYS.
+            archive_dir (str): Directory of the raw sample archive, defaults to the database path
+                without extension followed by "-archive", plus "-oven<id>" for other ovens than LEGACY_OVEN.
+            oven_id (int): The oven whose data this storage reads and writes.
+            shared (SensorStorage): The storage of another oven on the same database whose connection
+                and ReadPool to use, so all ovens share one writer; it must be closed last.
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.pending_since = None
+        self.readonly = readonly
+        self.raw_days = raw_days
+        self.rollup_days = rollup_days
+        self.oven_id = oven_id
+        if archive_dir is None:
+            archive_dir = os.path.splitext(db_path)[0] + ("-archive" if oven_id == LEGACY_OVEN else f"-oven{oven_id}-archive")
+        self.archive = SensorArchive(archive_dir, FIELDS)
+        self.pruned = 0
+        self.shared = shared is not None
+        if shared is not None:
+            self.connection = shared.connection
+            self.readers = shared.readers
+            self.read_schema_version()
+            if not readonly:
+                self.backfill_rollups()
+            return
+        if readonly:
+            self.connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            self.connection.row_factory = sqlite3.Row
+            self.read_schema_version()
+        else:
+            self.connection = sqlite3.connect(db_path)
+            self.connection.row_factory = sqlite3.Row
+            # Only takes effect for a new database; migrate.py --vacuum converts an existing one.
+            self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.initialize_db()
+        self.readers = ReadPool(db_path, readers)
+
+    def initialize_db(self):
+        """
+        Initializes the database by creating necessary tables if they do not already exist.
+        A database that only has the legacy SensorData table is marked as version 1 for migration,
+        a version 2 database gets the oven id right away, see add_oven_ids().
+        """
+        with self.connection as conn:
+            cursor = conn.cursor()
+            tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "SchemaVersion" not in tables:
+                cursor.execute("""
+                    CREATE TABLE SchemaVersion (
+                        version INTEGER NOT NULL,
+                        migrated_rowid INTEGER NOT NULL DEFAULT 0
+                    );
+                """)
+                version = 1 if "SensorData" in tables else SCHEMA_VERSION
+                cursor.execute("INSERT INTO SchemaVersion (version) VALUES (?)", (version,))
+            elif cursor.execute("SELECT version FROM SchemaVersion").fetchone()[0] == 2:
+                self.add_oven_ids(tables)
+            self.create_tables(cursor)
+            conn.commit()
+        self.read_schema_version()
+        self.backfill_rollups()
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS SensorSamples (
+                oven_id INTEGER NOT NULL DEFAULT {LEGACY_OVEN},
+                timestamp INTEGER NOT NULL,
+                {", ".join(f"{f} REAL" for f in FIELDS)},
+                PRIMARY KEY (oven_id, timestamp)
+            ) WITHOUT ROWID;
+        """)
+        columns = ", ".join(f"{f}_n INTEGER, {f}_sum REAL, {f}_min REAL, {f}_max REAL" for f in FIELDS)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS SensorRollup (
+                oven_id INTEGER NOT NULL DEFAULT {LEGACY_OVEN},
+                level INTEGER,
+                bucket INTEGER,
+                count INTEGER,
+                {columns},
+                PRIMARY KEY (oven_id, level, bucket)
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ControlState (
+                oven_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+        """)
+
+    def add_oven_ids(self, tables):
+        """
+        Upgrades a version 2 database to version 3 in one transaction: rebuilds the sample, rollup and
+        control state tables with the oven id in their keys, all data belonging to LEGACY_OVEN. Since
+        raw samples are only kept for RAW_RETENTION_DAYS this takes seconds to a minute; migrate.py
+        does it ahead of time.
+
+        Args:
+            tables (Set[str]): The tables in the database.
+        """
+        logging.info("Adding oven ids to the sensor tables")
+        old = [table for table in ("SensorSamples", "SensorRollup", "ControlState") if table in tables]
+        with self.connection as conn:
+            conn.execute("BEGIN")
+            for table in old:
+                conn.execute(f"ALTER TABLE {table} RENAME TO {table}V2")
+            self.create_tables(conn)
+            if "SensorSamples" in old:
+                conn.execute(f"""
+                    INSERT INTO SensorSamples (oven_id, timestamp, {", ".join(FIELDS)})
+                    SELECT {LEGACY_OVEN}, timestamp, {", ".join(FIELDS)} FROM SensorSamplesV2
+                """)
+            if "SensorRollup" in old:
+                columns = ", ".join(f"{f}_n, {f}_sum, {f}_min, {f}_max" for f in FIELDS)
+                conn.execute(f"""
+                    INSERT INTO SensorRollup (oven_id, level, bucket, count, {columns})
+                    SELECT {LEGACY_OVEN}, level, bucket, count, {columns} FROM SensorRollupV2
+                """)
+            if "ControlState" in old:
+                conn.execute(f"INSERT INTO ControlState (oven_id, state) SELECT {LEGACY_OVEN}, state FROM ControlStateV2")
+            for table in old:
+                conn.execute(f"DROP TABLE {table}V2")
+            conn.execute("UPDATE SchemaVersion SET version = ?", (SCHEMA_VERSION,))
+
+    def read_schema_version(self):
+        """
+        Reads the schema version and migration progress from the database.
+        """
+        self.schema_version, self.migrated_rowid = self.connection.execute(
+            "SELECT version, migrated_rowid FROM SchemaVersion").fetchone()
+
+    @property
+    def migration_pending(self):
+        """
+        bool: Whether legacy SensorData rows still have to be migrated. While they do, the database is
+        asked every time, since the storages of the other ovens sharing it migrate as well.
+        """
+        if self.schema_version < SCHEMA_VERSION:
+            self.read_schema_version()
+        return self.schema_version < SCHEMA_VERSION
+
+    def migrate_step(self, chunk_size=5000):
+        """
+        Copies the next chunk of legacy SensorData rows to SensorSamples in one short transaction, so
+        sampling can continue between steps. Once all rows are copied the legacy table is dropped.
+        Legacy rows belong to LEGACY_OVEN, but the storage of any oven migrates them, whether or not
+        LEGACY_OVEN is one of the configured ovens; retention waits until the migration is done.
+        Storages of several ovens on one database continue from each other's progress.
+
+        Args:
+            chunk_size (int): The number of rows to copy.
+
+        Returns:
+            bool: True while there are rows left to migrate.
+        """
+        if self.readonly or not self.migration_pending:
+            return False
+        with self.connection as conn:
+            last_rowid = conn.execute(
+                "SELECT MAX(rowid) FROM (SELECT rowid FROM SensorData WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                (self.migrated_rowid, chunk_size)).fetchone()[0]
+            if last_rowid is None:
+                conn.execute("DROP TABLE SensorData")
+                conn.execute("UPDATE SchemaVersion SET version = ?, migrated_rowid = 0", (SCHEMA_VERSION,))
+                self.schema_version = SCHEMA_VERSION
+                logging.info(f"Migrated sensor data to schema version {SCHEMA_VERSION}")
+                return False
+            conn.execute(f"""
+                INSERT OR IGNORE INTO SensorSamples (oven_id, timestamp, {", ".join(FIELDS)})
+                SELECT {LEGACY_OVEN}, {LEGACY_TIMESTAMP_MS}, {", ".join(FIELDS)}
+                FROM SensorData
+                WHERE rowid > ? AND rowid <= ?
+            """, (self.migrated_rowid, last_rowid))
+            conn.execute("UPDATE SchemaVersion SET migrated_rowid = ?", (last_rowid,))
+        self.migrated_rowid = last_rowid
+        return True
+
+    async def prune_step(self, batch_size=5000):
+        """
+        Runs one small step of retention, so sampling continues between steps: archives the oldest
+        raw day past `raw_days`, or deletes one batch of archived raw samples or expired rollup
+        buckets and hands up to VACUUM_PAGES free pages back to the file system. Raw samples are
+        only deleted once their day is completely archived.
+
+        Args:
+            batch_size (int): The maximum number of rows to delete.
+
+        Returns:
+            bool: True while there is work left.
+        """
+        if self.readonly or self.migration_pending:
+            return False
+        now = int(time.time())
+        if self.raw_days is not None:
+            cutoff = (now // 86400 - self.raw_days) * 86400000
+            oldest = query_oldest_sample(self.connection, self.oven_id)
+            if oldest is not None and oldest < cutoff:
+                day = day_of(oldest)
+                if not self.archive.has(day):
+                    # Reading and compressing a day takes a while, so neither runs on the event loop.
+                    rows = await self.readers.run(query_raw_day, self.oven_id, day_start(day))
+                    await asyncio.to_thread(self.archive.write_day, day, rows)
+                    logging.info(f"Archived {len(rows)} sensor samples of {day}")
+                    return True
+                with self.connection as conn:
+                    deleted = conn.execute("""
+                        DELETE FROM SensorSamples WHERE oven_id = ? AND timestamp IN (
+                            SELECT timestamp FROM SensorSamples WHERE oven_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?
+                        )
+                    """, (self.oven_id, self.oven_id, day_start(day) + 86400000, batch_size)).rowcount
+                self.vacuum(deleted)
+                return True
+        for level, days in self.rollup_days.items():
+            if days is None:
+                continue
+            with self.connection as conn:
+                deleted = conn.execute("""
+                    DELETE FROM SensorRollup WHERE oven_id = ? AND level = ? AND bucket IN (
+                        SELECT bucket FROM SensorRollup WHERE oven_id = ? AND level = ? AND bucket < ? ORDER BY bucket LIMIT ?
+                    )
+                """, (self.oven_id, level, self.oven_id, level, now - days * 86400, batch_size)).rowcount
+            if deleted:
+                self.vacuum(deleted)
+                return True
+        return False
+
+    def vacuum(self, deleted):
+        """
+        Counts deleted rows and returns free pages to the file system. Without auto_vacuum, e.g. in a
+        database created before retention existed, the pages are only reused by SQLite.
+        """
+        self.pruned += deleted
+        # execute() would step the pragma once, which frees a single page.
+        self.connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+
+    def backfill_rollups(self):
+        """
+        Builds the rollup tables from the raw samples if they are empty, e.g. for a database
+        created before rollups existed.
+        """
+        if self.connection.execute("SELECT 1 FROM SensorRollup WHERE oven_id = ? LIMIT 1", (self.oven_id,)).fetchone():
+            return
+        source = f"(SELECT timestamp, {', '.join(FIELDS)} FROM SensorSamples WHERE oven_id = {self.oven_id})"
+        if self.oven_id == LEGACY_OVEN and self.migration_pending:
+            source = f"""(
+            SELECT timestamp, {", ".join(FIELDS)} FROM SensorSamples WHERE oven_id = {LEGACY_OVEN}
+            UNION ALL
+            SELECT {LEGACY_TIMESTAMP_MS}, {", ".join(FIELDS)} FROM SensorData WHERE rowid > {self.migrated_rowid}
+        )"""
+        if not self.connection.execute(f"SELECT 1 FROM {source} LIMIT 1").fetchone():
+            return
+        logging.info("Building sensor rollups from existing data")
+        columns = ", ".join(f"{f}_n, {f}_sum, {f}_min, {f}_max" for f in FIELDS)
+        aggregates = ", ".join(f"COUNT({f}), TOTAL({f}), MIN({f}), MAX({f})" for f in FIELDS)
+        with self.connection as conn:
+            for level in ROLLUP_LEVELS:
+                conn.execute(f"""
+                    INSERT INTO SensorRollup (oven_id, level, bucket, count, {columns})
+                    SELECT ?, ?, timestamp / 1000 / ? * ?, COUNT(*), {aggregates}
+                    FROM {source}
+                    GROUP BY 3
+                """, (self.oven_id, level, level, level))
+
+    def update_rollups(self, conn, rows):
+        """
+        Merges a batch of raw rows into every rollup level.
+
+        Args:
+            conn (sqlite3.Connection): The connection of the running transaction.
+            rows (List[tuple]): Rows of (timestamp_ms, *FIELDS).
+        """
+        for level in ROLLUP_LEVELS:
+            buckets = {}
+            for row in rows:
+                bucket = row[0] // 1000 // level * level
+                agg = buckets.get(bucket)
+                if agg is None:
+                    agg = buckets[bucket] = [0] + [0, 0.0, None, None] * len(FIELDS)
+                agg[0] += 1
+                for i, value in enumerate(row[1:]):
+                    if value is None:
+                        continue
+                    j = 1 + 4 * i
+                    agg[j] += 1
+                    agg[j + 1] += value
+                    agg[j + 2] = value if agg[j + 2] is None else min(agg[j + 2], value)
+                    agg[j + 3] = value if agg[j + 3] is None else max(agg[j + 3], value)
+            conn.executemany(ROLLUP_UPSERT, [(self.oven_id, level, bucket, *agg) for bucket, agg in buckets.items()])
+
+    def add(self, sensor_data, timestamp=None):
+        """
+        Queues a sample for writing and flushes if a size or time threshold is reached.
+
+        Args:
+            sensor_data (SensorData): The sensor data to store.
+            timestamp (int): When the sample was taken in epoch milliseconds, defaults to now.
+
+        Returns:
+            int: The timestamp the sample is stored under.
+        """
+        timestamp = timestamp or int(time.time() * 1000)
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append((
+            timestamp,
+            sensor_data.temperature,
+            sensor_data.humidity,
+            sensor_data.ow1,
+            sensor_data.ow2,
+            sensor_data.ow3,
+            sensor_data.ow4,
+            sensor_data.ow5,
+        ))
+        if len(self.pending) > self.max_pending:
+            dropped = len(self.pending) - self.max_pending
+            del self.pending[:dropped]
+            logging.error(f"Write-behind buffer full, dropped {dropped} oldest samples")
+        self.flush_if_due()
+        return timestamp
+
+    def flush_if_due(self):
+        """
+        Flushes the pending samples if the batch is full or the oldest sample is too old.
+        """
+        if not self.pending:
+            return
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.pending_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all pending samples in a single transaction.
+        On failure the samples stay pending and are retried on the next flush.
+
+        Returns:
+            int: The number of samples written.
+        """
+        if not self.pending:
+            return 0
+        rows = self.pending
+        try:
+            with metrics.DB_QUERY_SECONDS.time('flush'), self.connection as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO SensorSamples (oven_id, timestamp, temperature, humidity, ow1, ow2, ow3, ow4, ow5) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self.oven_id, *row) for row in rows]
+                )
+                self.update_rollups(conn, rows)
+        except Exception as e:
+            logging.error(f"Error storing sensor data: {e}")
+            return 0
+        self.pending = []
+        self.pending_since = None
+        logging.debug(f"Stored {len(rows)} sensor samples")
+        return len(rows)
+
+    def save_control_state(self, state):
+        """
+        Replaces the control state checkpoint in its own small transaction, independent of the
+        write-behind buffer.
+
+        Args:
+            state (dict): JSON serializable control state, see Logic.checkpoint.
+        """
+        with self.connection as conn:
+            conn.execute("INSERT OR REPLACE INTO ControlState (oven_id, state) VALUES (?, ?)",
+                         (self.oven_id, json.dumps(state)))
+
+    def load_control_state(self):
+        """
+        Returns:
+            dict: The last control state saved with save_control_state, or None.
+        """
+        row = self.connection.execute("SELECT state FROM ControlState WHERE oven_id = ?", (self.oven_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        """
+        Flushes any pending samples and closes the database connections, unless they are shared.
+        """
+        self.flush()
+        if self.shared:
+            return
+        self.readers.close()
+        self.connection.close()
+
+    def read_samples(self, since, chunk_size=10000):
+        """
+        Reads raw samples newer than `since` in chunks, oldest first.
+
+        Args:
+            since (float): Epoch timestamp in seconds.
+            chunk_size (int): Number of rows per chunk.
+
+        Yields:
+            List[tuple]: Rows of (timestamp_ms, *FIELDS).
+        """
+        query = f"SELECT timestamp, {', '.join(FIELDS)} FROM SensorSamples WHERE oven_id = :oven AND timestamp >= :since"
+        if self.oven_id == LEGACY_OVEN and self.migration_pending:
+            # Rows not migrated yet are still only in the legacy table.
+            query = f"""
+                SELECT * FROM ({query}
+                UNION ALL
+                SELECT {LEGACY_TIMESTAMP_MS}, {", ".join(FIELDS)}
+                FROM SensorData
+                WHERE rowid > :migrated AND timestamp >= datetime(:since / 1000, 'unixepoch', 'localtime'))
+                ORDER BY timestamp
+            """
+        else:
+            query += " ORDER BY timestamp"
+        cursor = self.connection.execute(query, {'oven': self.oven_id, 'since': int(since * 1000),
+                                                 'migrated': self.migrated_rowid})
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+    async def get_sensor_series(self, days, max_points=MAX_POINTS, mode=downsample.AVG):
+        """
+        Retrieves sensor data for the last `days` days from the rollup tables.
+
+        Args:
+            days (int): The number of days for which to retrieve data.
+            max_points (int): The maximum number of points to return.
+            mode (str): The downsampling mode, see downsample.aggregate.
+
+        Returns:
+            dict: One list per column: 'timestamp' (epoch seconds of the bucket), FIELDS and 'count'.
+        """
+        now = int(time.time())
+        return await self.get_range_series(now - days * 86400, now, max_points, mode)
+
+    async def get_range_series(self, start, end, max_points=MAX_POINTS, mode=downsample.AVG):
+        """
+        Retrieves sensor data from `start` up to `end` from the rollup tables on the read pool.
+        Identical requests that arrive while the query runs share its result.
+
+        Args:
+            start (int): Start of the range in epoch seconds.
+            end (int): End of the range (exclusive) in epoch seconds.
+            max_points (int): The maximum number of points to return.
+            mode (str): The downsampling mode, see downsample.aggregate.
+
+        Returns:
+            dict: One list per column: 'timestamp' (epoch seconds of the bucket), FIELDS and 'count'.
+        """
+        return await self.readers.coalesce(('range', self.oven_id, start, end, max_points, mode),
+                                           query_range_series, self.oven_id, start, end, max_points, mode,
+                                           self.rollup_days)
+
+    async def iter_range(self, start, end, level=None, chunk_size=5000):
+        """
+        Reads the samples or rollup buckets from `start` up to `end` in chunks, oldest first.
+
+        Every chunk is a separate short query on the read pool that continues after the last row
+        of the previous chunk, so memory use stays constant and no read transaction is held open
+        however long the range is. Raw samples older than the database's oldest come from the
+        archive, one day file at a time, so chunks can be shorter than `chunk_size`.
+
+        Args:
+            start (float): Start of the range in epoch seconds.
+            end (float): End of the range (exclusive) in epoch seconds.
+            level (int): A level from ROLLUP_LEVELS, or None for raw samples.
+            chunk_size (int): The maximum number of rows per chunk.
+
+        Yields:
+            List[tuple]: Rows of (timestamp in epoch seconds, *FIELDS, count).
+        """
+        if level is None:
+            key, end_key = round(start * 1000), round(end * 1000)
+            days = [day for day in self.archive.days() if key < day_start(day) + 86400000 and day_start(day) < end_key]
+            if days:
+                oldest = await self.readers.run(query_oldest_sample, self.oven_id)
+                archive_end = end_key if oldest is None else min(end_key, oldest)
+                for day in days:
+                    rows = await asyncio.to_thread(self.archive.read_range, max(key, day_start(day)),
+                                                   min(archive_end, day_start(day) + 86400000))
+                    for i in range(0, len(rows), chunk_size):
+                        yield rows[i:i + chunk_size]
+                key = max(key, archive_end)
+        else:
+            key, end_key = int(start), int(end)
+        while True:
+            rows = await self.readers.run(query_range_chunk, self.oven_id, key, end_key, level, chunk_size)
+            if not rows:
+                break
+            yield [row[:-1] for row in rows]
+            if len(rows) < chunk_size:
+                break
+            key = rows[-1][-1] + 1
+
+    async def get_raw_page(self, start, end, limit=MAX_POINTS):
+        """
+        Retrieves up to `limit` raw samples from `start` up to `end`.
+
+        Args:
+            start (float): Start of the range in epoch seconds.
+            end (float): End of the range (exclusive) in epoch seconds.
+            limit (int): The maximum number of samples to return.
+
+        Returns:
+            Tuple[dict, float]: The samples as a series, and the start of the next page in epoch
+            seconds, or None if the range is complete.
+        """
+        rows = []
+        async for chunk in self.iter_range(start, end, chunk_size=limit):
+            rows += chunk[:limit - len(rows)]
+            if len(rows) == limit:
+                break
+        columns = list(zip(*rows)) or [()] * (len(FIELDS) + 2)
+        cursor = round(rows[-1][0] + 0.001, 3) if len(rows) == limit else None
+        return dict(zip(SERIES_COLUMNS, map(list, columns))), cursor
+
+
+def query_range_series(conn, oven_id, start, end, max_points, mode=downsample.AVG, retention=ROLLUP_RETENTION_DAYS):
+    """
+    Aggregates the rollup buckets of an oven from `start` up to `end`, see SensorStorage.get_range_series.
+
+    Uses the coarsest rollup level that still has at least `max_points` buckets in the range
+    and merges adjacent buckets down to at most `max_points` points. In LTTB mode, the picks are
+    made from the finest level with at most LTTB_OVERSAMPLE times `max_points` buckets. Either
+    level is replaced by the next coarser one whose `retention` still covers `start`.
+    """
+    level, width = bucket_width(max(1, end - start), max_points)
+    if mode == downsample.LTTB:
+        for level in ROLLUP_LEVELS:
+            if (end - start) // level <= LTTB_OVERSAMPLE * max_points:
+                break
+        level = retained_level(level, start, retention)
+        rows = conn.execute(f"""
+            SELECT bucket, {", ".join(f"{f}_sum / {f}_n" for f in FIELDS)}, count
+            FROM SensorRollup
+            WHERE oven_id = ? AND level = ? AND bucket >= ? AND bucket < ?
+            ORDER BY bucket
+        """, (oven_id, level, start, end)).fetchall()
+        data = np.array(rows, dtype=np.float64).reshape(-1, len(FIELDS) + 2)
+        columns = {field: data[:, i] for i, field in enumerate(FIELDS, start=1)}
+        return downsample.aggregate(data[:, 0], columns, width, mode, weights=data[:, -1])
+    coarser = retained_level(level, start, retention)
+    if coarser != level:
+        level, width = coarser, coarser * -(-width // coarser)
+    names, aggregates = [], []
+    for f in FIELDS:
+        names.append(f)
+        aggregates.append(f"SUM({f}_sum) / SUM({f}_n)")
+        if mode == downsample.MINMAX:
+            names += [f"{f}_min", f"{f}_max"]
+            aggregates += [f"MIN({f}_min)", f"MAX({f}_max)"]
+    rows = conn.execute(f"""
+        SELECT bucket / ? * ? AS start, {", ".join(aggregates)}, SUM(count)
+        FROM SensorRollup
+        WHERE oven_id = ? AND level = ? AND bucket >= ? AND bucket < ?
+        GROUP BY start
+        ORDER BY start
+    """, (width, width, oven_id, level, start, end)).fetchall()
+    columns = list(zip(*rows)) or [()] * (len(names) + 2)
+    return dict(zip(['timestamp'] + names + ['count'], map(list, columns)))
+
+
+def query_range_chunk(conn, oven_id, key, end_key, level, limit):
+    """
+    Reads up to `limit` of an oven's raw samples (level None, keys in epoch ms) or rollup buckets (keys in epoch
+    seconds) with keys from `key` up to `end_key`. Every row ends with its key for the next chunk.
+    """
+    if level is None:
+        return conn.execute(f"""
+            SELECT timestamp / 1000.0, {", ".join(FIELDS)}, 1, timestamp
+            FROM SensorSamples
+            WHERE oven_id = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp
+            LIMIT ?
+        """, (oven_id, key, end_key, limit)).fetchall()
+    return conn.execute(f"""
+        SELECT bucket, {", ".join(f"{f}_sum / {f}_n" for f in FIELDS)}, count, bucket
+        FROM SensorRollup
+        WHERE oven_id = ? AND level = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket
+        LIMIT ?
+    """, (oven_id, level, key, end_key, limit)).fetchall()
+
+
+def query_oldest_sample(conn, oven_id):
+    """
+    Returns the epoch millisecond timestamp of an oven's oldest raw sample, or None if there is none.
+    """
+    return conn.execute("SELECT MIN(timestamp) FROM SensorSamples WHERE oven_id = ?", (oven_id,)).fetchone()[0]
+
+
+def query_raw_day(conn, oven_id, start):
+    """
+    Reads an oven's raw samples of the UTC day starting at `start` (epoch ms) for the archive.
+    """
+    return conn.execute(f"""
+        SELECT timestamp, {", ".join(FIELDS)}
+        FROM SensorSamples
+        WHERE oven_id = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp
+    """, (oven_id, start, start + 86400000)).fetchall()
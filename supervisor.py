@@ -0,0 +1,89 @@
+import argparse
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    """
+    Runs acquisition and control in one process (control.py) and serves clients from several API
+    worker processes (api.py) that share the port, so client load never delays relay actuation and
+    serving scales across cores. Stops everything as soon as one process exits.
+
+    With more than one worker, clients must connect with the websocket transport, since Socket.IO
+    long polling needs every request of a session to reach the same worker. Only one oven is
+    supported; several ovens (OVEN_CONFIG) run in a single api.py process.
+    """
+    parser = argparse.ArgumentParser(description="Run the control process and API workers.")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', default='data2.db')
+    parser.add_argument('--metrics-port', type=int, default=9101, help="port of the control process's /metrics")
+    parser.add_argument('--control-nice', type=int, default=0,
+                        help="niceness increment of the control process, negative to prioritize it (needs privileges)")
+    args = parser.parse_args()
+    if os.environ.get('OVEN_CONFIG'):
+        # control.py runs a single Logic, so it would quietly control only one of the ovens.
+        parser.error("OVEN_CONFIG is not supported with separate control and API processes, run api.py for several ovens")
+
+    address = os.path.join(tempfile.mkdtemp(prefix='oven-'), 'control.sock')
+    env = dict(
+        os.environ,
+        OVEN_SHARED_RING=f'oven-{os.getpid()}',
+        OVEN_CONTROL_ADDRESS=address,
+        OVEN_CONTROL_AUTHKEY=secrets.token_hex(16),
+        OVEN_CONTROL_METRICS_PORT=str(args.metrics_port),
+        OVEN_CONTROL_NICE=str(args.control_nice),
+        OVEN_DB=args.db,
+        OVEN_PORT=str(args.port),
+    )
+    processes = [subprocess.Popen([sys.executable, os.path.join(HERE, 'control.py')], env=env)]
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        # Workers attach to the ring and the command socket, so wait until the control process is up.
+        while not os.path.exists(address):
+            if stopping or processes[0].poll() is not None:
+                return 1
+            time.sleep(0.1)
+        processes += [subprocess.Popen([sys.executable, os.path.join(HERE, 'api.py')], env=env)
+                      for _ in range(args.workers)]
+        logging.info(f"Control process and {args.workers} API worker(s) running on port {args.port}")
+        while not stopping:
+            exited = [p for p in processes if p.poll() is not None]
+            if exited:
+                logging.error(f"Process {exited[0].args[-1]} exited with {exited[0].returncode}, stopping")
+                return 1
+            time.sleep(0.5)
+        return 0
+    finally:
+        # Workers first, so the control process flushes the last samples after they are gone.
+        for process in reversed(processes):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if os.path.exists(address):
+            os.remove(address)
+        os.rmdir(os.path.dirname(address))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
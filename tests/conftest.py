@@ -0,0 +1,37 @@
+import pytest
+
+import hardware
+from hardware.sim import SimulatedPCF8574, ThermalModel
+from logic import Logic
+
+
+class NullSocketIO:
+    """
+    Accepts and discards Socket.IO events.
+    """
+
+    async def emit(self, *args, **kwargs):
+        pass
+
+    async def enter_room(self, *args, **kwargs):
+        pass
+
+    async def leave_room(self, *args, **kwargs):
+        pass
+
+
+def sensor_data(**values):
+    """
+    Returns a SensorData with every reading at 20 degrees and 50% humidity, except `values`.
+    """
+    readings = dict(temperature=20.0, humidity=50.0, ow1=20.0, ow2=20.0, ow3=20.0, ow4=20.0, ow5=20.0)
+    readings.update(values)
+    return hardware.SensorData(**readings)
+
+
+@pytest.fixture
+def logic(tmp_path):
+    logic = Logic(NullSocketIO(), db_path=str(tmp_path / 'logic.db'), history_days=1,
+                  pcf=SimulatedPCF8574(ThermalModel()))
+    yield logic
+    logic.close()
@@ -0,0 +1,28 @@
+import numpy as np
+
+import downsample
+
+
+def test_lttb_keeps_first_and_last_sample():
+    timestamps = np.arange(100, dtype=np.float64)
+    values = np.sin(timestamps / 7.0)
+    series = downsample.aggregate(timestamps, {'temperature': values}, 10, downsample.LTTB)
+    assert len(series['temperature']) == 10
+    assert series['temperature'][0] == values[0]
+    assert series['temperature'][-1] == values[-1]
+
+
+def test_lttb_last_bucket_skips_missing_newest_value():
+    timestamps = np.arange(20, dtype=np.float64)
+    values = np.arange(20, dtype=np.float64)
+    values[-1] = np.nan
+    series = downsample.aggregate(timestamps, {'temperature': values}, 10, downsample.LTTB)
+    assert series['temperature'][-1] == 18.0
+
+
+def test_lttb_keeps_spike():
+    timestamps = np.arange(30, dtype=np.float64)
+    values = np.zeros(30)
+    values[15] = 50.0
+    series = downsample.aggregate(timestamps, {'temperature': values}, 10, downsample.LTTB)
+    assert series['temperature'][1] == 50.0
@@ -0,0 +1,29 @@
+import os
+import shutil
+
+import pytest
+
+from hardware import ds18b20
+from hardware.sim import SimulatedW1Bus, ThermalModel
+
+
+@pytest.fixture
+def w1(monkeypatch):
+    bus = SimulatedW1Bus(ThermalModel(seed=1))
+    monkeypatch.setattr(ds18b20, 'base_dir', bus.root + '/')
+    monkeypatch.setattr(ds18b20, 'probe_ids', list(bus.probe_ids))
+    yield bus
+    bus.close()
+
+
+def test_missing_probe_keeps_its_slot(w1):
+    shutil.rmtree(os.path.join(w1.root, w1.probe_ids[1]))
+    temps = ds18b20.read_all()
+    assert len(temps) == 5
+    assert temps[1] is None
+    assert None not in temps[:1] + temps[2:]
+
+
+def test_probe_ids_are_not_discovered(w1, monkeypatch):
+    monkeypatch.setattr(ds18b20, 'probe_ids', [])
+    assert ds18b20.read_all() == []
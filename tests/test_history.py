@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import downsample
+import hardware
+from history import SensorHistory
+from storage import SensorStorage
+
+
+def make_storage(path, days, step=600):
+    """
+    Creates a database with a sample every `step` seconds over the last `days` days.
+    """
+    storage = SensorStorage(str(path))
+    now = int(time.time())
+    for t in range(now - days * 86400, now, step):
+        storage.add(hardware.SensorData(temperature=20.0, humidity=50.0, ow1=20.0, ow2=20.0, ow3=20.0,
+                                        ow4=20.0, ow5=20.0), t * 1000)
+    storage.flush()
+    return storage
+
+
+def test_range_before_ring_horizon_reads_database(tmp_path):
+    storage = make_storage(tmp_path / 'history.db', days=3)
+    try:
+        history = SensorHistory(storage, days=1)
+        now = int(time.time())
+        assert not history.ring.covers(now - 3 * 86400)
+        assert history.ring.covers(now - 3600)
+        series, _, _ = asyncio.run(history.get_sensor_range(now - 3 * 86400, now))
+        assert series['timestamp'][0] < now - 2 * 86400
+    finally:
+        storage.close()
+
+
+def test_concurrent_cold_requests_share_one_aggregation(tmp_path):
+    storage = make_storage(tmp_path / 'history.db', days=1, step=10)
+    try:
+        history = SensorHistory(storage, days=1)
+
+        async def request_twice():
+            return await asyncio.gather(history.get_sensor_series(1), history.get_sensor_series(1))
+
+        first, second = asyncio.run(request_twice())
+        assert first == second
+        assert len(first['timestamp']) > 0
+        assert history.cache.coalesced == 1
+        assert len(history.cache.entries) == 1
+    finally:
+        storage.close()
+
+
+def test_concurrent_lttb_requests_share_one_pass(tmp_path):
+    storage = make_storage(tmp_path / 'history.db', days=1, step=10)
+    try:
+        history = SensorHistory(storage, days=1)
+
+        async def request_twice():
+            return await asyncio.gather(history.get_sensor_series(1, downsample.LTTB),
+                                        history.get_sensor_series(1, downsample.LTTB))
+
+        first, second = asyncio.run(request_twice())
+        assert first == second
+        assert history.coalesced == 1
+    finally:
+        storage.close()
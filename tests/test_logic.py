@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import time
+
+import hardware
+from hardware.sim import SimulatedPCF8574, ThermalModel
+from logic import Logic, Task
+from tests.conftest import NullSocketIO, sensor_data
+
+
+def publish(logic, *samples):
+    async def run():
+        for i, sample in enumerate(samples):
+            await logic.publish_sample(int(time.time() * 1000) + i, sample)
+    asyncio.run(run())
+
+
+def heater_on(logic):
+    return logic.outputs.get(hardware.HEATER)
+
+
+def test_missing_reading_switches_heater_off_then_stops_task(logic):
+    logic.start({'never_ending': True, 'temp_low': 60, 'temp_high': 70})
+    publish(logic, sensor_data())
+    assert heater_on(logic)
+    publish(logic, *[sensor_data(ow3=None)] * (logic.max_missed_readings - 1))
+    assert logic.current_task is not None
+    assert not heater_on(logic)
+    publish(logic, sensor_data(ow3=None))
+    assert logic.current_task is None
+
+
+def test_missing_reading_does_not_delay_limit_trip(logic):
+    logic.start({'never_ending': True, 'temp_low': 60, 'temp_high': 70})
+    publish(logic, sensor_data(ow3=None, temperature=120.0, humidity=95.0))
+    assert logic.current_task is None
+
+
+def test_control_runs_once_per_sample(logic, monkeypatch):
+    calls = []
+    control_iteration = logic.control_iteration
+
+    async def counted():
+        calls.append(1)
+        await control_iteration()
+    monkeypatch.setattr(logic, 'control_iteration', counted)
+    publish(logic, sensor_data(), sensor_data(), sensor_data())
+    assert len(calls) == 3
+
+
+def test_watchdog_switches_hardware_off_without_recent_sample(logic):
+    logic.start({'never_ending': True, 'temp_low': 60, 'temp_high': 70})
+    publish(logic, sensor_data())
+    assert heater_on(logic)
+    asyncio.run(logic.watchdog_iteration())
+    assert heater_on(logic)
+    logic.latest_sample_time -= logic.max_sample_age + 1
+    asyncio.run(logic.watchdog_iteration())
+    assert not heater_on(logic)
+    assert logic.current_task is not None
+
+
+def test_restore_advances_cooler_phase_and_rearms_timers(tmp_path):
+    now = datetime.datetime.utcnow()
+    started = now - datetime.timedelta(minutes=105)
+    task = Task(hours=4, temp_low=60, temp_high=70, cooler_on=10, cooler_off=20, start_date=started)
+    db_path = str(tmp_path / 'restore.db')
+    first = Logic(NullSocketIO(), db_path=db_path, history_days=1, pcf=SimulatedPCF8574(ThermalModel()))
+    first.storage.save_control_state({
+        'task': task.to_dict(),
+        'cooler_cycle_status': True,
+        'cooler_on_start_time': started.isoformat(),
+        'cooler_off_start_time': None,
+    })
+    first.close()
+
+    logic = Logic(NullSocketIO(), db_path=db_path, history_days=1, pcf=SimulatedPCF8574(ThermalModel()))
+    try:
+        # Three 30 minute cycles plus 10 minutes of cooling: off since 100 minutes after the start.
+        assert logic.current_task.end_time() == task.end_time()
+        assert logic.cooler_cycle_status is False
+        assert logic.cooler_off_start_time == started + datetime.timedelta(minutes=100)
+
+        async def run():
+            logic.set_timers()
+            timers = {name: due for name, (due, _, _) in logic.timers.timers.items()}
+            logic.timers.cancel_all()
+            return timers
+        assert asyncio.run(run()) == {
+            "Task expiry": task.end_time(),
+            "Cooler cycle": started + datetime.timedelta(minutes=120),
+        }
+    finally:
+        logic.close()
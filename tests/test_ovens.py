@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+from hardware.sim import SimulatedPCF8574, ThermalModel
+from ovens import OvenConfig, OvenManager
+from tests.conftest import NullSocketIO, sensor_data
+
+
+def test_ovens_share_one_storage_connection(tmp_path):
+    configs = [OvenConfig(id=i, probe_ids=['28-a', '28-b', '28-c'], history_days=1) for i in (1, 2)]
+    manager = OvenManager(NullSocketIO(), configs, db_path=str(tmp_path / 'ovens.db'),
+                          pcfs={i: SimulatedPCF8574(ThermalModel()) for i in (1, 2)})
+    try:
+        first, second = manager.ovens[1], manager.ovens[2]
+        assert first.storage.connection is second.storage.connection
+        assert first.storage.readers is second.storage.readers
+        now = int(time.time())
+        for i, logic in enumerate((first, second)):
+            logic.storage.add(sensor_data(temperature=30.0 + i), now * 1000)
+            logic.storage.flush()
+
+        async def ranges():
+            return await asyncio.gather(first.storage.get_range_series(now - 60, now + 60),
+                                        second.storage.get_range_series(now - 60, now + 60))
+
+        series = asyncio.run(ranges())
+        assert [s['temperature'] for s in series] == [[30.0], [31.0]]
+    finally:
+        manager.close()
@@ -0,0 +1,68 @@
+import asyncio
+
+import metrics
+from pipeline import DROP_NEWEST, QueueConsumer, SamplePipeline
+
+
+def errors(stage):
+    return metrics.STAGE_ERRORS.values.get((stage,), 0)
+
+
+def test_control_runs_before_samples_are_queued():
+    log = []
+    consumer = QueueConsumer("Test", lambda sample: log.append(('consumer', sample)), maxsize=10)
+
+    async def control(sample):
+        log.append(('control', sample, consumer.queue.qsize()))
+    pipeline = SamplePipeline(control)
+    pipeline.add_consumer(consumer)
+
+    async def run():
+        for sample in range(3):
+            await pipeline.publish(sample)
+        await pipeline.drain()
+    asyncio.run(run())
+    assert log == [('control', 0, 0), ('control', 1, 1), ('control', 2, 2),
+                   ('consumer', 0), ('consumer', 1), ('consumer', 2)]
+
+
+def test_full_queue_drops_by_policy():
+    async def run():
+        oldest = QueueConsumer("Oldest", lambda sample: None, maxsize=2, log_drops=False)
+        newest = QueueConsumer("Newest", lambda sample: None, maxsize=2, drop_policy=DROP_NEWEST, log_drops=False)
+        for sample in range(5):
+            oldest.offer(sample)
+            newest.offer(sample)
+        return oldest, newest
+    oldest, newest = asyncio.run(run())
+    assert oldest.take_pending() == [3, 4]
+    assert newest.take_pending() == [0, 1]
+    assert oldest.stats()['dropped'] == newest.stats()['dropped'] == 3
+
+
+def test_failures_stay_in_their_stage():
+    handled = []
+
+    async def control(sample):
+        if sample == 0:
+            raise OSError("I2C error")
+
+    def fail(sample):
+        if sample == 1:
+            raise ValueError("disk full")
+        handled.append(('failing', sample))
+
+    pipeline = SamplePipeline(control)
+    failing = pipeline.add_consumer(QueueConsumer("Failing", fail, maxsize=10))
+    pipeline.add_consumer(QueueConsumer("Healthy", lambda sample: handled.append(('healthy', sample)), maxsize=10))
+    control_errors = errors('Control')
+
+    async def run():
+        for sample in range(3):
+            await pipeline.publish(sample)
+        await pipeline.drain()
+    asyncio.run(run())
+    assert sorted(handled) == [('failing', 0), ('failing', 2), ('healthy', 0), ('healthy', 1), ('healthy', 2)]
+    assert failing.stats()['handled'] == 2
+    assert errors('Failing') == 1
+    assert errors('Control') == control_errors + 1
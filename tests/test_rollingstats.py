@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+from rollingstats import RollingStats
+from tests.conftest import sensor_data
+
+
+def test_single_spike_is_replaced_by_median():
+    stats = RollingStats()
+    for t in range(5):
+        assert stats.add(t, 40.0) == 40.0
+    assert stats.add(5, 95.0) == 40.0
+    assert stats.add(6, 40.0) == 40.0
+    assert stats.spikes == 1
+    assert stats.summary()['max'] == 40.0
+
+
+def test_step_is_accepted_once_it_is_the_majority():
+    stats = RollingStats()
+    for t in range(5):
+        stats.add(t, 40.0)
+    assert [stats.add(t, 95.0) for t in range(5, 9)] == [40.0, 40.0, 95.0, 95.0]
+    assert stats.spikes == 2
+
+
+def test_rate_is_per_minute():
+    stats = RollingStats()
+    for t in range(20):
+        stats.add(t, 20.0 + t * 0.5)
+    assert abs(stats.rate - 30.0) < 1e-6
+
+
+def test_fast_rise_stops_task(logic):
+    logic.start({'never_ending': True, 'temp_low': 60, 'temp_high': 70})
+    start = int(time.time() * 1000)
+
+    async def rise():
+        for i in range(20):
+            await logic.publish_sample(start + i * 1000, sensor_data(temperature=20.0 + i * 0.5))
+            if logic.current_task is None:
+                return i
+
+    stopped_at = asyncio.run(rise())
+    assert stopped_at is not None
+    assert logic.current_task is None
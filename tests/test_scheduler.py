@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+import scheduler
+from scheduler import DeadlineTimers
+
+
+class SteppedClock(datetime.datetime):
+    """
+    The wall clock, stepped by `step` like NTP would on a Pi without an RTC.
+    """
+    step = datetime.timedelta(0)
+
+    @classmethod
+    def utcnow(cls):
+        return datetime.datetime.utcnow() + cls.step
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    SteppedClock.step = datetime.timedelta(0)
+    monkeypatch.setattr(scheduler, 'datetime', types.SimpleNamespace(datetime=SteppedClock,
+                                                                      timedelta=datetime.timedelta))
+    return SteppedClock
+
+
+def in_seconds(seconds):
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
+
+
+def test_resync_fires_timer_after_clock_steps_forward(clock):
+    fired = []
+
+    async def run():
+        timers = DeadlineTimers()
+        timers.set("Test", in_seconds(100), lambda: fired.append(1))
+        clock.step = datetime.timedelta(seconds=100)
+        timers.resync()
+        await asyncio.sleep(0.05)
+        return timers
+    timers = asyncio.run(run())
+    assert fired == [1]
+    assert not timers.timers
+
+
+def test_resync_delays_timer_after_clock_steps_back(clock):
+    fired = []
+
+    async def run():
+        timers = DeadlineTimers()
+        timers.set("Test", in_seconds(0.05), lambda: fired.append(1))
+        clock.step = datetime.timedelta(seconds=-100)
+        timers.resync()
+        await asyncio.sleep(0.2)
+        return timers
+    timers = asyncio.run(run())
+    assert fired == []
+    assert "Test" in timers.timers
+
+
+def test_resync_ignores_drift_within_tolerance(clock):
+    async def run():
+        timers = DeadlineTimers(tolerance=1.0)
+        timers.set("Test", in_seconds(100), lambda: None)
+        handle = timers.handles["Test"]
+        clock.step = datetime.timedelta(seconds=0.5)
+        timers.resync()
+        return handle, timers.handles["Test"]
+    before, after = asyncio.run(run())
+    assert before is after
+
+
+def test_early_fire_is_rearmed_until_due(clock):
+    fired = []
+
+    async def run():
+        timers = DeadlineTimers()
+        due = in_seconds(0.05)
+        timers.set("Test", due, lambda: fired.append(1))
+        # Stepped back without a resync, the timer fires on the monotonic clock before it is due.
+        clock.step = datetime.timedelta(seconds=-100)
+        await asyncio.sleep(0.2)
+        assert fired == []
+        assert timers.timers["Test"][0] == due
+        clock.step = datetime.timedelta(0)
+        timers.resync()
+        await asyncio.sleep(0.05)
+    asyncio.run(run())
+    assert fired == [1]
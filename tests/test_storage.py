@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import hardware
+from storage import SensorStorage
+
+
+def reading(i):
+    """
+    Returns the readings of sample `i` at the archive's resolution of thousandths, some missing.
+    """
+    values = [round(20 + (i * 37 % 1000) / 1000 + k, 3) for k in range(7)]
+    if i % 7 == 0:
+        values[4] = None
+    return values
+
+
+def read_all(storage, start, end, chunk_size):
+    async def run():
+        return [row async for rows in storage.iter_range(start, end, chunk_size=chunk_size) for row in rows]
+    return asyncio.run(run())
+
+
+def test_pruned_days_read_back_exactly_across_archive_and_database(tmp_path):
+    storage = SensorStorage(str(tmp_path / 'storage.db'), raw_days=1)
+    try:
+        now = int(time.time())
+        start = now - 4 * 86400
+        expected = []
+        for i, t in enumerate(range(start * 1000 + 123, now * 1000, 900 * 1000)):
+            values = reading(i)
+            storage.add(hardware.SensorData(*values), t)
+            expected.append((t / 1000.0, *values, 1))
+        storage.flush()
+
+        async def prune():
+            steps = 0
+            while await storage.prune_step():
+                steps += 1
+            return steps
+        assert asyncio.run(prune()) > 0
+        archived = storage.archive.days()
+        assert len(archived) >= 2
+        oldest = storage.connection.execute("SELECT MIN(timestamp) FROM SensorSamples").fetchone()[0]
+        assert oldest > expected[0][0] * 1000
+
+        rows = read_all(storage, start, now, chunk_size=50)
+        assert rows == expected
+        # A range starting inside the archive and ending inside the database.
+        assert read_all(storage, expected[10][0], expected[-10][0], chunk_size=7) == expected[10:-10]
+    finally:
+        storage.close()
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+# Payload formats for history responses. LEGACY is the default for clients that do not ask for one.
+LEGACY = 'legacy'
+COLUMNAR = 'columnar'
+BINARY = 'binary'
+
+# Decimal places kept for sensor values in the columnar format.
+PRECISION = 2
+
+
+def to_rows(series):
+    """
+    Converts a series to the legacy format: one dict per point with a local-time timestamp string.
+
+    Args:
+        series (dict): One list per column, see SensorStorage.get_sensor_series.
+
+    Returns:
+        List[dict]: A list of dictionaries representing the sensor data.
+    """
+    timestamps = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) for t in series['timestamp']]
+    keys = list(series)
+    columns = [timestamps] + [series[key] for key in keys[1:]]
+    return [dict(zip(keys, point)) for point in zip(*columns)]
+
+
+def _time_axis(timestamps):
+    """
+    Encodes epoch timestamps as a start value plus either a fixed step or a list of deltas.
+    """
+    axis = {'start': timestamps[0] if timestamps else None}
+    deltas = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    if len(set(deltas)) <= 1:
+        axis['step'] = deltas[0] if deltas else 0
+    else:
+        axis['deltas'] = deltas
+    return axis
+
+
+def to_columnar(series, precision=PRECISION):
+    """
+    Converts a series to the columnar format: one array per column, values rounded to `precision`
+    decimals and the time axis encoded as a start value plus a fixed step or deltas.
+
+    Args:
+        series (dict): One list per column, see SensorStorage.get_sensor_series.
+        precision (int): Decimal places kept for sensor values.
+
+    Returns:
+        dict: The payload.
+    """
+    payload = {'format': COLUMNAR, 'length': len(series['timestamp'])}
+    payload.update(_time_axis(series['timestamp']))
+    for column, values in series.items():
+        if column == 'count':
+            payload[column] = values
+        elif column != 'timestamp':
+            payload[column] = [None if v is None else round(v, precision) for v in values]
+    return payload
+
+
+def to_binary(series):
+    """
+    Converts a series to the binary format. The time axis is encoded as in the columnar format, and
+    `data` holds little-endian float32 arrays of `length` values for each column in `columns`, one
+    after the other, with NaN for missing values. python-socketio sends `data` as a binary attachment.
+
+    Args:
+        series (dict): One list per column, see SensorStorage.get_sensor_series.
+
+    Returns:
+        dict: The payload.
+    """
+    columns = [column for column in series if column != 'timestamp']
+    payload = {'format': BINARY, 'length': len(series['timestamp']), 'columns': columns}
+    payload.update(_time_axis(series['timestamp']))
+    data = np.array([[np.nan if v is None else v for v in series[column]] for column in columns], dtype='<f4')
+    payload['data'] = data.tobytes()
+    return payload
+
+
+def encode(series, fmt=LEGACY):
+    """
+    Encodes a series in the requested format, falling back to the legacy format for unknown ones.
+    """
+    if fmt == COLUMNAR:
+        return to_columnar(series)
+    if fmt == BINARY:
+        return to_binary(series)
+    return to_rows(series)
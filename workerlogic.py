@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import threading
+from multiprocessing.connection import Client
+
+import downsample
+import metrics
+from history import SensorHistory
+from livefeed import LiveFeed
+from logic import Task
+from rollingstats import SensorStatistics
+from shmring import SharedSampleRing
+from storage import MAX_POINTS, SensorStorage
+
+
+class WorkerLogic:
+    """
+    The part of Logic that api.py uses, for an API worker next to a separate control process.
+
+    Samples come from the control process through the shared sample ring, and tasks are started and
+    stopped over its control connection, see control.ControlProcess. History is answered from an
+    in-memory history of its own and a read-only connection to the database the control process
+    writes. Client load on a worker therefore never delays sensor reads or relay actuation. Rolling
+    statistics for 'sensor_state' are computed here from the same samples the control process sees.
+
+    Commands run on a thread with a timeout of `command_timeout` seconds, so a hung or restarting
+    control process fails the command instead of freezing the worker's event loop.
+    """
+
+    def __init__(self, sio, ring_name, address, authkey, db_path="data2.db", history_days=7, poll_interval=0.1,
+                 command_timeout=5.0):
+        """
+        Args:
+            sio (socketio.AsyncServer): The Socket.IO server to emit events on.
+            ring_name (str): Name of the shared sample ring of the control process.
+            address (str): Path of the control process's command socket.
+            authkey (bytes): The key to authenticate to the control process with.
+            db_path (str): Path of the SQLite database file.
+            history_days (int): Number of days of samples kept in memory.
+            poll_interval (float): Seconds between checks of the ring for new samples.
+            command_timeout (float): Seconds to wait for the control process to answer a command.
+        """
+        self.sio = sio
+        self.live = LiveFeed(sio)
+        self.stats = SensorStatistics()
+        self.address = address
+        self.authkey = authkey
+        self.poll_interval = poll_interval
+        self.command_timeout = command_timeout
+        self.connection = None
+        self.lock = threading.Lock()
+        self.ring = SharedSampleRing(ring_name)
+        self.storage = SensorStorage(db_path, readonly=True)
+        self.history = SensorHistory(self.storage, history_days)
+        self.state = {}
+        self.state_version = None
+        self.last_event = None
+        # Samples the control process has not flushed to the database yet are still in the ring.
+        newest = self.history.ring.newest or 0
+        self.seq, samples = self.ring.read_since(0)
+        for timestamp, sensor_data in samples:
+            if timestamp > newest:
+                self.history.append(timestamp, sensor_data)
+        metrics.REGISTRY.register(metrics.Gauge(
+            'oven_shared_ring_lost_total', 'Samples overwritten in the shared ring before this worker read them.',
+            lambda: self.ring.lost, kind='counter'))
+
+    async def get_sensor_data_for_period(self, days):
+        return await self.history.get_sensor_data_for_period(days)
+
+    async def get_sensor_series(self, days, mode=downsample.AVG):
+        return await self.history.get_sensor_series(days, mode)
+
+    async def get_sensor_range(self, start, end, max_points=MAX_POINTS, raw=False, mode=downsample.AVG):
+        return await self.history.get_sensor_range(start, end, max_points, raw, mode)
+
+    def send(self, command):
+        """
+        Sends a command to the control process and waits at most `command_timeout` seconds for its
+        reply. Blocks, so it runs on a thread, see command(). The connection is dropped on failure
+        and reopened by the next command.
+
+        Returns:
+            dict: The reply.
+        """
+        if not self.lock.acquire(timeout=self.command_timeout):
+            raise TimeoutError("Another command to the control process is still waiting")
+        try:
+            if self.connection is None:
+                self.connection = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            self.connection.send(command)
+            if not self.connection.poll(self.command_timeout):
+                raise TimeoutError(f"No reply within {self.command_timeout}s")
+            return self.connection.recv()
+        except (EOFError, OSError):
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            raise
+        finally:
+            self.lock.release()
+
+    async def command(self, command):
+        """
+        Sends a command to the control process and waits for its reply without blocking the event loop.
+
+        Raises:
+            ValueError: If the control process rejected the command.
+            ConnectionError: If the control process could not be reached or did not answer in time.
+        """
+        try:
+            reply = await asyncio.wait_for(asyncio.to_thread(self.send, command), self.command_timeout * 2)
+        except (asyncio.TimeoutError, EOFError, OSError) as e:
+            logging.error(f"Command {command.get('command')} to the control process failed: {e!r}")
+            raise ConnectionError(f"Control process unavailable: {str(e) or 'timed out'}") from e
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+
+    async def start(self, task_data):
+        """
+        Starts a new task in the control process, see Logic.start.
+
+        Raises:
+            ValueError: If the task data is invalid.
+            ConnectionError: If the control process could not be reached.
+        """
+        try:
+            Task(**task_data)
+        except Exception as e:
+            raise ValueError(f"Invalid task data: {e}")
+        await self.command({'command': 'start', 'task': task_data})
+        self.refresh_state()
+
+    async def stop(self):
+        """
+        Stops the current task in the control process.
+
+        Raises:
+            ConnectionError: If the control process could not be reached.
+        """
+        await self.command({'command': 'stop'})
+        self.refresh_state()
+
+    def get_current_task(self):
+        """
+        Returns:
+            dict: The current task as a dictionary, or None if no task is active.
+        """
+        self.refresh_state()
+        return self.state.get('task')
+
+    def refresh_state(self):
+        """
+        Reads the control state if it changed.
+
+        Returns:
+            List[list]: Events published since the last call, as [seq, event, data].
+        """
+        version, state = self.ring.read_state()
+        if version is None or version == self.state_version:
+            return []
+        self.state_version = version
+        self.state = state or {}
+        events = self.state.get('events', [])
+        if self.last_event is None:
+            # Events from before this worker started were sent by whoever ran then.
+            self.last_event = events[-1][0] if events else 0
+            return []
+        new = [event for event in events if event[0] > self.last_event]
+        if new:
+            self.last_event = new[-1][0]
+        return new
+
+    async def logic_loop(self):
+        """
+        Follows the shared ring until cancelled: appends new samples to the history, sends the newest
+        one to the live clients and forwards control events such as 'task_done'.
+        """
+        await asyncio.gather(self.follow_ring(), metrics.monitor_loop_lag())
+
+    async def follow_ring(self):
+        while True:
+            self.seq, samples = self.ring.read_since(self.seq)
+            for timestamp, sensor_data in samples:
+                self.history.append(timestamp, sensor_data)
+                self.stats.update(timestamp, sensor_data)
+            if samples:
+                try:
+                    await self.live.publish(*samples[-1], self.stats.summary())
+                except Exception as e:
+                    logging.exception(f"Broadcasting sensor data failed: {e}")
+            for _, event, data in self.refresh_state():
+                await self.sio.emit(event, data)
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self):
+        """
+        Closes the database, the ring and the control connection.
+        """
+        self.storage.close()
+        self.ring.close()
+        if self.connection is not None:
+            self.connection.close()